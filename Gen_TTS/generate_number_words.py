@@ -0,0 +1,22 @@
+import os
+import sys
+from io import BytesIO
+from gtts import gTTS
+
+# Tạo clip từ nối để ghép số > 400 (xem app/utils/tts_clips.py): không, linh, trăm, nghìn
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BASE_DIR))
+from app.utils.tts_clips import NUMBER_WORDS, WORDS_DIR
+
+os.makedirs(WORDS_DIR, exist_ok=True)
+
+for name, word in NUMBER_WORDS.items():
+    filepath = os.path.join(WORDS_DIR, f"{name}.mp3")
+
+    # Cùng giọng gTTS với numbers/ để ghép frame MP3 trực tiếp; tổng hợp xong mới ghi (lỗi mạng không để lại file rỗng)
+    mp3_io = BytesIO()
+    gTTS(text=word, lang='vi').write_to_fp(mp3_io)
+    with open(filepath, "wb") as f:
+        f.write(mp3_io.getvalue())
+
+    print(f"✅ Đã tạo: {filepath}")
@@ -7,13 +7,35 @@ from app.auth import get_db, get_current_user, check_counter_permission
 from typing import Optional, List
 from app.api.endpoints.realtime import notify_frontend
 from app import models, schemas, auth
-from app.utils.auto_call_loop import reset_events
+from app.utils.auto_call_loop import request_auto_call_reset, request_auto_call_sync
+from app.utils.queue_state import queue_state
+from app.utils.seat_state import seat_state
+from app.utils.tts_announcement import announcement_audio_id, prerender_announcement
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime
 from sqlalchemy import func
 import pytz
 
 router = APIRouter()
 
+async def notify_ticket_called(event: dict, tenxa_id: int):
+    """Gửi ticket_called kèm audio_id ngay, rồi mới ghép câu gọi số (ngoài event loop)"""
+    event["audio_id"] = None
+    if event["ticket_number"] is not None:
+        event["audio_id"] = await run_in_threadpool(
+            announcement_audio_id_for, tenxa_id, event["counter_id"], event["ticket_number"]
+        )
+    await notify_frontend(event)
+    if event["audio_id"]:
+        await run_in_threadpool(prerender_announcement, tenxa_id, event["counter_id"], event["ticket_number"])
+
+def announcement_audio_id_for(tenxa_id: int, counter_id: int, ticket_number: int) -> Optional[str]:
+    db = database.SessionLocal()
+    try:
+        return announcement_audio_id(db, tenxa_id, counter_id, ticket_number)
+    finally:
+        db.close()
+
 @router.post("/{counter_id}/call-next/old", response_model=Optional[schemas.CalledTicket])
 def call_next_manually(
     counter_id: int,
@@ -34,7 +56,7 @@ def call_next_manually(
         # ✅ Gửi sự kiện WebSocket qua background task
         vn_time = datetime.now(pytz.timezone("Asia/Ho_Chi_Minh")).isoformat()
         background_tasks.add_task(
-            notify_frontend,
+            notify_ticket_called,
             {
                 "event": "ticket_called",
                 "ticket_number": ticket.number,
@@ -42,12 +64,10 @@ def call_next_manually(
                 "counter_id": counter.id,
                 "tenxa": tenxa,
                 "timestamp": vn_time
-            }
+            },
+            tenxa_id
         )
-        event = reset_events.get((counter_id, tenxa_id))
-        if event:
-            print(f"♻️ Reset auto-call cho quầy {counter_id} xã {tenxa_id}")
-            event.set()
+        background_tasks.add_task(request_auto_call_reset, counter_id, tenxa_id)
 
 
         return schemas.CalledTicket(
@@ -78,6 +98,7 @@ def pause_counter(
 @router.put("/{counter_id}/resume", response_model=schemas.Counter)
 def resume_counter_route(
     counter_id: int,
+    background_tasks: BackgroundTasks,
     tenxa: str = Query(...),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
@@ -88,6 +109,7 @@ def resume_counter_route(
     counter = crud.resume_counter(db, tenxa_id, counter_id=counter_id)
     if not counter:
         raise HTTPException(status_code=404, detail="Counter not found")
+    background_tasks.add_task(request_auto_call_reset, counter_id, tenxa_id)
     return counter
 
 @router.get("/", response_model=List[schemas.Counter])
@@ -129,7 +151,7 @@ def call_next_manually(
 
     # Gửi sự kiện WebSocket với ticket_number có thể là None
     background_tasks.add_task(
-        notify_frontend,
+        notify_ticket_called,
         {
             "event": "ticket_called",
             "ticket_number": ticket.number if ticket else None,
@@ -137,15 +159,13 @@ def call_next_manually(
             "counter_id": counter.id,
             "tenxa": tenxa,
             "timestamp": vn_time
-        }
+        },
+        tenxa_id
     )
 
     if ticket:
         # Nếu có vé thì reset auto-call và trả về kết quả
-        event = reset_events.get((counter_id, tenxa_id))
-        if event:
-            print(f"♻️ Reset auto-call cho quầy {counter_id} xã {tenxa_id}")
-            event.set()
+        background_tasks.add_task(request_auto_call_reset, counter_id, tenxa_id)
 
         return schemas.CalledTicket(
             number=ticket.number,
@@ -204,6 +224,7 @@ def upsert_counter_old(
     db.add(counter)
     db.commit()
     db.refresh(counter)
+    background_tasks.add_task(request_auto_call_sync, tenxa_id)
     background_tasks.add_task(
             notify_frontend,
             {
@@ -253,6 +274,13 @@ def delete_counter(
             models.SeatLog.tenxa_id == tenxa_id
         ).delete(synchronize_session=False)
 
+        # Xóa seat_sessions (không có FK tới seats): khoảng đang mở bị ghế mới trùng id nhận nhầm,
+        # khoảng vắng đã đóng vẫn bị AFK_SQL tính
+        db.query(models.SeatSession).filter(
+            models.SeatSession.seat_id.in_(seat_ids),
+            models.SeatSession.tenxa_id == tenxa_id
+        ).delete(synchronize_session=False)
+
         # Xóa Seat
         db.query(models.Seat).filter(
             models.Seat.id.in_(seat_ids)
@@ -276,6 +304,9 @@ def delete_counter(
     # Xóa counter
     db.delete(counter)
     db.commit()
+    queue_state.record_counter_deleted(tenxa_id, counter_id)
+    seat_state.forget(tenxa_id, seat_ids)
+    background_tasks.add_task(request_auto_call_sync, tenxa_id)
     background_tasks.add_task(
             notify_frontend,
             {
@@ -296,8 +327,8 @@ def upsert_counter(
 ):
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
 
-    # Lấy record tenxa để dùng postfix và password
-    tenxa_record = db.query(models.Tenxa).filter(models.Tenxa.id == tenxa_id).first()
+    # Lấy cấu hình tenxa (cache) để dùng postfix và password
+    tenxa_record = crud.get_tenant_settings(db, tenxa_id)
     if not tenxa_record:
         raise HTTPException(status_code=404, detail="Tenxa not found")
 
@@ -344,6 +375,7 @@ def upsert_counter(
     db.commit()
     db.refresh(counter)
 
+    background_tasks.add_task(request_auto_call_sync, tenxa_id)
     background_tasks.add_task(
         notify_frontend,
         {
@@ -365,23 +397,8 @@ def get_available_counters_for_transfer(
     """
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
 
-    # Lấy thời gian đầu ngày và cuối ngày (theo giờ VN)
-    tz = pytz.timezone("Asia/Ho_Chi_Minh")
-    today = datetime.now(tz).date()
-    start_of_day = datetime.combine(today, datetime.min.time()).astimezone(tz)
-    end_of_day = datetime.combine(today, datetime.max.time()).astimezone(tz)
-
-    # Subquery: lấy các counter_id có ticket waiting/called trong hôm nay
-    busy_counter_ids = (
-        db.query(models.Ticket.counter_id)
-        .filter(models.Ticket.tenxa_id == tenxa_id)
-        .filter(models.Ticket.created_at >= start_of_day)
-        .filter(models.Ticket.created_at <= end_of_day)
-        .filter(models.Ticket.status.in_(["waiting", "called"]))
-        .distinct()
-        .all()
-    )
-    busy_counter_ids = [c[0] for c in busy_counter_ids]
+    # Các quầy có vé waiting/called hôm nay, lấy từ hàng chờ trong bộ nhớ
+    busy_counter_ids = list(queue_state.busy_counter_ids(db, tenxa_id))
 
     # Lấy counter không nằm trong busy list
     available_counters = (
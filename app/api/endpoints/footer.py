@@ -4,6 +4,7 @@ from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
 from sqlalchemy.orm import Session
 from app import crud, schemas, database, models, auth
 from app.api.endpoints.realtime import notify_frontend
+from app.utils.auto_call_loop import request_auto_call_sync
 
 router = APIRouter()
 
@@ -20,19 +21,18 @@ def get_config(tenxa: str = Query(...), db: Session = Depends(get_db)):
     if not tenxa_id:
         raise HTTPException(status_code=404, detail="Không tìm thấy xã")
 
-    footer = crud.get_footer_by_tenxa(db, tenxa_id)
-    if not footer:
+    settings = crud.get_tenant_settings(db, tenxa_id)
+    if not settings or not settings.has_footer:
         raise HTTPException(status_code=404, detail="Chưa có dữ liệu footer cho xã này")
-    tenxa_record = db.query(models.Tenxa).filter(models.Tenxa.id == tenxa_id).first()
 
     return schemas.FooterResponse(
         tenxa=tenxa,
-        work_time=footer.work_time,
-        hotline=footer.hotline,
-        header= footer.header,
-        allowed_time_ranges= footer.allowed_time_ranges,
-        postfix=tenxa_record.postfix,
-        password=tenxa_record.password
+        work_time=settings.work_time,
+        hotline=settings.hotline,
+        header= settings.header,
+        allowed_time_ranges= settings.allowed_time_ranges,
+        postfix=settings.postfix,
+        password=settings.password
     )
 
 @router.post("/old", response_model=schemas.FooterResponse)
@@ -52,6 +52,7 @@ def update_config_old(data: schemas.FooterCreate, background_tasks: BackgroundTa
     tenxa_record.password = data.password
 
     db.commit()
+    crud.tenant_registry.invalidate(tenxa_id)
     db.refresh(tenxa_record)
     
     background_tasks.add_task(
@@ -108,6 +109,7 @@ def update_config(
                 user.hashed_password = hashed_password
 
         db.commit()
+        crud.tenant_registry.invalidate(tenxa_id)
         db.refresh(tenxa_record)
 
     except Exception as e:
@@ -136,6 +138,7 @@ def update_config(
 @router.put("/qr_rating", response_model=schemas.TenXaConfigResponse)
 def update_QR_raing_config(
     config_data: schemas.TenXaConfigUpdate,
+    background_tasks: BackgroundTasks,
     tenxa: str = Query(...),
     db: Session = Depends(get_db)
 ):
@@ -143,13 +146,16 @@ def update_QR_raing_config(
     tenxa_obj = crud.update_tenxa_config(db, tenxa_id, config_data)
     if not tenxa_obj:
         raise HTTPException(status_code=404, detail="Không tìm thấy đơn vị")
+    if config_data.auto_call is not None:
+        # Bật/tắt auto_call có hiệu lực ngay, không cần khởi động lại
+        background_tasks.add_task(request_auto_call_sync, tenxa_id)
     return tenxa_obj
 
 
 @router.get("/qr_rating", response_model=schemas.TenXaConfigResponse)
 def get_QR_rating_config(tenxa: str = Query(...), db: Session = Depends(get_db)):
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    tenxa_obj = db.query(models.Tenxa).filter(models.Tenxa.id == tenxa_id).first()
+    tenxa_obj = crud.get_tenant_settings(db, tenxa_id)
     if not tenxa_obj:
         raise HTTPException(status_code=404, detail="Không tìm thấy đơn vị")
     return tenxa_obj
@@ -1,15 +1,240 @@
 # app/api/endpoints/realtime.py
-from fastapi import APIRouter, WebSocket
+from fastapi import APIRouter, WebSocket, Query
+from starlette.concurrency import run_in_threadpool
+from collections import defaultdict, deque
+from typing import Optional, List, Set, Dict
 import json
+import asyncio
+from app import database, models, crud
+from app.utils.realtime_bus import bus
+from app.utils.queue_state import queue_state
 
 router = APIRouter()
-connected_clients: list[WebSocket] = []
+
+
+# Mỗi client có hàng đợi gửi riêng và 1 task gửi riêng: publish chỉ đẩy vào hàng đợi,
+# 1 TV mạng chậm không làm chậm các màn hình khác
+OUTBOX_SIZE = 100       # số tin tối đa chờ gửi cho 1 client, đầy thì ngắt client
+SEND_TIMEOUT = 5        # giây, gửi 1 tin quá hạn này thì ngắt client
+
+realtime_metrics = {
+    "sent": 0,              # số tin đã gửi thành công
+    "dropped": 0,           # số tin bỏ vì hàng đợi client đầy
+    "evicted_overflow": 0,  # số client bị ngắt vì hàng đợi đầy
+    "evicted_timeout": 0,   # số client bị ngắt vì gửi quá SEND_TIMEOUT
+    "send_errors": 0,       # số client bị ngắt vì lỗi khi gửi
+}
+
+
+class Subscription:
+    """
+    1 kết nối WebSocket và phạm vi nó muốn nhận: 1 xã (tenxa=None → mọi xã, như client cũ),
+    tuỳ chọn giới hạn theo danh sách quầy (trực tiếp hoặc lấy từ tv_group).
+    """
+    def __init__(self, websocket: WebSocket, tenxa: Optional[str] = None, counter_ids: Optional[Set[int]] = None):
+        self.websocket = websocket
+        self.tenxa = tenxa
+        self.counter_ids = counter_ids
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=OUTBOX_SIZE)
+        self.sender: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def wants(self, data: dict) -> bool:
+        if not self.counter_ids:
+            return True
+        counter_ids = event_counter_ids(data)
+        # Sự kiện không gắn quầy (cấu hình, tv_group...) thì ai trong xã cũng nhận
+        return not counter_ids or bool(counter_ids & self.counter_ids)
+
+    def start(self):
+        self.sender = asyncio.create_task(self._send_loop())
+
+    def stop(self):
+        self.closed = True
+        if self.sender:
+            self.sender.cancel()
+
+    def enqueue(self, message: str):
+        if self.closed:
+            return
+        try:
+            self.outbox.put_nowait(message)
+        except asyncio.QueueFull:
+            realtime_metrics["dropped"] += 1
+            hub.evict(self, "evicted_overflow")
+
+    async def _send_loop(self):
+        while True:
+            message = await self.outbox.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(message), timeout=SEND_TIMEOUT)
+                realtime_metrics["sent"] += 1
+            except asyncio.TimeoutError:
+                hub.evict(self, "evicted_timeout")
+                return
+            except Exception as e:
+                print("⚠️ Gửi WebSocket lỗi, bỏ client:", e)
+                hub.evict(self, "send_errors")
+                return
+
+
+def event_tenxa(data: dict) -> Optional[str]:
+    # Một số sự kiện để tenxa trong "data" (transfer-single, transfer_permission)
+    nested = data.get("data")
+    return data.get("tenxa") or (nested.get("tenxa") if isinstance(nested, dict) else None)
+
+def event_counter_ids(data: dict) -> Set[int]:
+    nested = data.get("data") if isinstance(data.get("data"), dict) else {}
+    ids = set()
+    for source in (data, nested):
+        if source.get("counter_id") is not None:
+            ids.add(source["counter_id"])
+        ids.update(source.get("counter_ids") or [])
+    return ids
+
+
+class ConnectionHub:
+    """
+    Index topic (slug xã) → các kết nối, để 1 sự kiện chỉ duyệt qua client của đúng xã đó.
+    """
+    def __init__(self):
+        self.by_tenxa: Dict[Optional[str], Set[Subscription]] = defaultdict(set)
+
+    def add(self, sub: Subscription):
+        self.by_tenxa[sub.tenxa].add(sub)
+
+    def remove(self, sub: Subscription):
+        subs = self.by_tenxa.get(sub.tenxa)
+        if subs is None:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self.by_tenxa[sub.tenxa]
+
+    def match(self, data: dict) -> List[Subscription]:
+        tenxa = event_tenxa(data)
+        targets = [sub for sub in self.by_tenxa.get(tenxa, ()) if sub.wants(data)] if tenxa else []
+        # Client không đăng ký xã (bản cũ) vẫn nhận mọi sự kiện
+        targets.extend(self.by_tenxa.get(None, ()))
+        return targets
+
+    def evict(self, sub: Subscription, reason: str):
+        """Ngắt client chậm/lỗi: bỏ khỏi index ngay, đóng socket ở task riêng"""
+        if sub.closed:
+            return
+        realtime_metrics[reason] += 1
+        self.remove(sub)
+        sub.stop()
+        print(f"🚫 Ngắt client WebSocket xã {sub.tenxa or '*'} ({reason})")
+        asyncio.create_task(_close_quietly(sub.websocket))
+
+    def __len__(self):
+        return sum(len(subs) for subs in self.by_tenxa.values())
+
+
+async def _close_quietly(websocket: WebSocket):
+    try:
+        await asyncio.wait_for(websocket.close(code=1013), timeout=SEND_TIMEOUT)
+    except Exception:
+        pass
+
+
+hub = ConnectionHub()
+
+# Bộ đệm vòng các sự kiện gần nhất theo xã: (seq, data, message đã encode).
+# TV kết nối lại gửi ?last_seq=N để nhận lại các sự kiện bị lỡ thay vì gọi lại hàng loạt API.
+REPLAY_SIZE = 500
+replay_buffers: Dict[str, deque] = defaultdict(lambda: deque(maxlen=REPLAY_SIZE))
+
+
+def missed_events(tenxa: str, last_seq: int) -> Optional[list]:
+    """
+    Các sự kiện có seq > last_seq theo thứ tự seq, hoặc None nếu không replay được
+    (bộ đệm đã trôi qua, hoặc server khởi động lại nên seq của client lớn hơn hiện tại).
+    """
+    buffer = replay_buffers.get(tenxa)
+    if not buffer:
+        return None
+    seqs = [entry[0] for entry in buffer]
+    if last_seq + 1 < min(seqs) or last_seq > max(seqs):
+        return None
+    return sorted((entry for entry in buffer if entry[0] > last_seq), key=lambda entry: entry[0])
+
+
+def build_snapshot(tenxa: str, counter_ids: Optional[Set[int]]) -> dict:
+    """Ảnh chụp gọn trạng thái hàng chờ hôm nay của xã: số vé đang chờ và vé đang gọi theo quầy"""
+    db = database.SessionLocal()
+    try:
+        tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+        counters = defaultdict(lambda: {"waiting": [], "called": None})
+        for ticket in queue_state.tickets(db, tenxa_id, "waiting"):
+            counters[ticket.counter_id]["waiting"].append(ticket.number)
+        for ticket in queue_state.tickets(db, tenxa_id, "called"):
+            counters[ticket.counter_id]["called"] = ticket.number
+    finally:
+        db.close()
+    return {
+        "event": "snapshot",
+        "tenxa": tenxa,
+        "counters": {
+            counter_id: state for counter_id, state in counters.items()
+            if not counter_ids or counter_id in counter_ids
+        },
+    }
+
+
+def resolve_subscription_counters(tenxa: str, counter_id: Optional[List[int]], tv_group: Optional[int]) -> Optional[Set[int]]:
+    """
+    Trả về tập quầy cần nghe (None = cả xã). tv_group được đổi thành danh sách quầy của nhóm.
+    """
+    counter_ids = set(counter_id or [])
+    if tv_group is not None:
+        db = database.SessionLocal()
+        try:
+            tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+            group = db.query(models.TvGroup).filter(
+                models.TvGroup.id == tv_group,
+                models.TvGroup.tenxa_id == tenxa_id
+            ).first()
+            if group:
+                counter_ids.update(group.counter_ids or [])
+        finally:
+            db.close()
+    return counter_ids or None
+
 
 @router.websocket("/ws/updates")
-async def websocket_updates(websocket: WebSocket):
+async def websocket_updates(
+    websocket: WebSocket,
+    tenxa: Optional[str] = Query(None),
+    counter_id: Optional[List[int]] = Query(None),
+    tv_group: Optional[int] = Query(None),
+    last_seq: Optional[int] = Query(None),
+):
     await websocket.accept()
-    connected_clients.append(websocket)
-    print("🔌 Client kết nối WebSocket")
+    counter_ids = None
+    if tenxa and (counter_id or tv_group is not None):
+        counter_ids = await run_in_threadpool(resolve_subscription_counters, tenxa, counter_id, tv_group)
+    sub = Subscription(websocket, tenxa, counter_ids)
+    sub.start()
+
+    if tenxa and last_seq is not None:
+        missed = missed_events(tenxa, last_seq)
+        if missed is None:
+            # Lỡ quá nhiều (hoặc server mới khởi động): gửi ảnh chụp, rồi các sự kiện phát sinh trong lúc chụp
+            buffer = replay_buffers.get(tenxa)
+            snapshot_seq = max((entry[0] for entry in buffer), default=None) if buffer else None
+            snapshot = await run_in_threadpool(build_snapshot, tenxa, counter_ids)
+            sub.enqueue(json.dumps({**snapshot, "seq": snapshot_seq}))
+            missed = missed_events(tenxa, snapshot_seq) if snapshot_seq is not None else None
+            if missed is None:
+                missed = sorted(replay_buffers.get(tenxa) or (), key=lambda entry: entry[0])
+        for seq, data, message in missed:
+            if sub.wants(data):
+                sub.enqueue(message)
+    # Không có await giữa replay và add → không lẫn thứ tự với sự kiện mới
+    hub.add(sub)
+    print(f"🔌 Client kết nối WebSocket (xã {tenxa or '*'}, quầy {sorted(counter_ids) if counter_ids else '*'})")
 
     try:
         while True:
@@ -17,15 +242,34 @@ async def websocket_updates(websocket: WebSocket):
     except Exception as e:
         print("⚠️ Client mất kết nối WebSocket:", e)
     finally:
-        connected_clients.remove(websocket)
+        hub.remove(sub)
+        sub.stop()
         print("❌ Client ngắt kết nối WebSocket")
 
 
+@router.get("/ws/metrics")
+def websocket_metrics():
+    return {**realtime_metrics, "connections": len(hub)}
+
+
 async def notify_frontend(data: dict):
-    """Gửi dữ liệu đến tất cả client đang kết nối WebSocket"""
+    """Phát sự kiện lên bus (kèm seq tăng dần theo xã), mọi worker sẽ gửi xuống client WebSocket của mình"""
+    tenxa = event_tenxa(data)
+    if tenxa:
+        seq = await bus.next_seq(tenxa)
+        if seq is not None:
+            data = {**data, "seq": seq}
+    await bus.publish("ws", data)
+
+
+async def broadcast_local(data: dict):
+    """Gửi dữ liệu đến các client (của worker này) đang nghe xã (và quầy) của sự kiện"""
     message = json.dumps(data)
-    for client in connected_clients.copy():
-        try:
-            await client.send_text(message)
-        except:
-            connected_clients.remove(client)
+    tenxa = event_tenxa(data)
+    if tenxa and data.get("seq") is not None:
+        replay_buffers[tenxa].append((data["seq"], data, message))
+    for sub in hub.match(data):
+        sub.enqueue(message)
+
+
+bus.subscribe("ws", broadcast_local)
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
 from sqlalchemy.orm import Session
 from typing import List
 from datetime import datetime
 import pytz
 from app import models, schemas, database, crud
-from app.utils.auto_call_loop import reset_events
+from app.utils.auto_call_loop import request_auto_call_reset, request_auto_call_wake
+from app.utils.seat_state import seat_state, record_seat_states
+from app.utils.seat_debounce import seat_debouncer
 
 vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
 router = APIRouter()
@@ -24,14 +26,20 @@ def list_seats(tenxa: str = Query(...), db: Session = Depends(get_db)):
 
 
 @router.put("/{seat_id}", response_model=schemas.Seat)
-def update_seat(seat_id: int, seat_update: schemas.SeatUpdate, tenxa: str = Query(...), db: Session = Depends(get_db)):
+def update_seat(seat_id: int, seat_update: schemas.SeatUpdate, background_tasks: BackgroundTasks, tenxa: str = Query(...), db: Session = Depends(get_db)):
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    seat = db.query(models.Seat).filter(models.Seat.tenxa_id == tenxa_id).filter(models.Seat.id == seat_id).first()
+    # Khoá dòng ghế: 2 request cùng ghế không ghi chồng seat_sessions
+    seat = db.query(models.Seat).filter(models.Seat.tenxa_id == tenxa_id).filter(models.Seat.id == seat_id).with_for_update().first()
     if not seat:
         raise HTTPException(status_code=404, detail="Seat not found")
     
     old_status = seat.status
     new_status = seat_update.status
+
+    # Chưa ổn định đủ debounce_seconds thì chưa ghi gì (sweeper sẽ ghi khi đủ thời gian)
+    if not seat_debouncer.observe(tenxa_id, seat_id, old_status, new_status, seat_debouncer.seconds(seat.debounce_seconds)):
+        db.rollback()
+        return seat
     
     # Nếu cập nhật sang trạng thái trống (False), lưu lại thời điểm
     if seat_update.status is False and seat.status is True:
@@ -39,22 +47,94 @@ def update_seat(seat_id: int, seat_update: schemas.SeatUpdate, tenxa: str = Quer
 
     seat.status = seat_update.status
     
+    now = datetime.now(vn_tz)
     log = models.SeatLog(
         seat_id=seat_id,
         old_status=old_status,
         new_status=new_status,
-        timestamp=datetime.now(vn_tz),
+        timestamp=now,
         tenxa_id=tenxa_id
     )
     db.add(log)
+    crud.record_seat_session(db, seat, new_status, now)
     db.commit()
     db.refresh(seat)
+    record_seat_states(tenxa_id, {seat_id: new_status})
     if old_status != new_status and seat.type == "client":
-        event = reset_events.get(seat.counter_id)
-        if event:
-            print(f"♻️ Reset auto-call cho quầy {seat.counter_id}")
-            event.set()
+        background_tasks.add_task(request_auto_call_reset, seat.counter_id, tenxa_id)
+    elif old_status != new_status:
+        # Cán bộ vào/rời ghế: quầy đang nghỉ (vắng cán bộ) thì hẹn kiểm tra lại
+        background_tasks.add_task(request_auto_call_wake, seat.counter_id, tenxa_id)
+
+    return seat
+
+@router.post("/batch", response_model=schemas.SeatBatchResult)
+def update_seats_batch(batch: schemas.SeatBatchUpdate, background_tasks: BackgroundTasks, tenxa: str = Query(...), db: Session = Depends(get_db)):
+    """
+    Thiết bị gửi toàn bộ trạng thái ghế của 1 quầy / 1 phòng trong 1 request.
+    Ghế trùng trạng thái đã biết trong bộ nhớ thì bỏ qua; còn lại ghi 1 lần (chỉ ghế thật sự đổi).
+    """
+    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+    states = {item.seat_id: item.status for item in batch.seats}  # trùng ghế thì lấy trạng thái cuối
+    pending = seat_state.changed(tenxa_id, states)
+    # Ghế báo lại đúng trạng thái đã lưu: huỷ trạng thái đang chờ (nếu có) = 1 lần nhiễu
+    for seat_id in states.keys() - pending.keys():
+        seat_debouncer.observe(tenxa_id, seat_id, states[seat_id], states[seat_id], 0)
+    held = []
+    if pending:
+        config = seat_debouncer.seat_seconds(db, tenxa_id)
+        # So với trạng thái đang lưu (không phải seat_state.get có TTL): ghế đứng yên lâu vẫn là "không đổi"
+        committed = seat_debouncer.committed_states(db, tenxa_id, pending)
+        held = [
+            seat_id for seat_id, status in pending.items()
+            if not seat_debouncer.observe(tenxa_id, seat_id, committed[seat_id], status, seat_debouncer.seconds(config.get(seat_id)))
+        ]
+        pending = {seat_id: status for seat_id, status in pending.items() if seat_id not in held}
+    if not pending:
+        return schemas.SeatBatchResult(received=len(batch.seats), changed=[], pending_seat_ids=held)
+
+    rows = crud.apply_seat_states(db, tenxa_id, pending, datetime.now(vn_tz))
+    db.commit()
+    record_seat_states(tenxa_id, {row.id: row.status for row in rows})
 
+    changed = [row for row in rows if row.changed]
+    # Mỗi quầy chỉ báo auto-call 1 lần dù nhiều ghế cùng đổi
+    reset_counters = {row.counter_id for row in changed if row.type == "client"}
+    wake_counters = {row.counter_id for row in changed if row.type != "client"} - reset_counters
+    for counter_id in reset_counters:
+        background_tasks.add_task(request_auto_call_reset, counter_id, tenxa_id)
+    for counter_id in wake_counters:
+        background_tasks.add_task(request_auto_call_wake, counter_id, tenxa_id)
+
+    known = {row.id for row in rows}
+    return schemas.SeatBatchResult(
+        received=len(batch.seats),
+        changed=[
+            schemas.SeatPublic(id=row.id, status=row.status, type=row.type, counter_id=row.counter_id)
+            for row in changed
+        ],
+        unknown_seat_ids=[seat_id for seat_id in pending if seat_id not in known],
+        pending_seat_ids=held,
+    )
+
+@router.get("/debounce-metrics")
+def get_seat_debounce_metrics(tenxa: str = Query(...), db: Session = Depends(get_db)):
+    """Số lần nhiễu bị chặn theo ghế và các trạng thái đang chờ ổn định"""
+    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+    return seat_debouncer.metrics(tenxa_id)
+
+@router.put("/{seat_id}/debounce", response_model=schemas.Seat)
+def update_seat_debounce(seat_id: int, data: schemas.SeatDebounceUpdate, tenxa: str = Query(...), db: Session = Depends(get_db)):
+    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+    seat = db.query(models.Seat).filter(models.Seat.tenxa_id == tenxa_id).filter(models.Seat.id == seat_id).first()
+    if not seat:
+        raise HTTPException(status_code=404, detail="Seat not found")
+    if data.debounce_seconds is not None and data.debounce_seconds < 0:
+        raise HTTPException(status_code=400, detail="debounce_seconds phải >= 0")
+    seat.debounce_seconds = data.debounce_seconds
+    db.commit()
+    db.refresh(seat)
+    seat_debouncer.invalidate_config(tenxa_id)
     return seat
 
 @router.get("/{seat_id}", response_model=schemas.SeatPublic)
@@ -3,8 +3,8 @@ from pydantic import BaseModel
 from typing import List, Optional
 from datetime import date, datetime
 from sqlalchemy.orm import Session
-from app.models import Ticket, SeatLog, Seat, Counter, Tenxa  # assuming these are your SQLAlchemy models
-from sqlalchemy import func, and_, or_
+from app.models import Ticket, SeatLog, Seat, SeatSession, Counter, Tenxa, TicketDailyStat  # assuming these are your SQLAlchemy models
+from sqlalchemy import func, and_, or_, text
 from app import crud, schemas, database
 from collections import defaultdict
 from datetime import datetime, timedelta, time
@@ -13,6 +13,9 @@ from fastapi.responses import StreamingResponse
 from io import BytesIO
 import openpyxl
 from openpyxl.styles import Font
+import functools
+import inspect
+from app.utils.stats_cache import stats_cache
 
 #app = FastAPI()
 router = APIRouter()
@@ -65,18 +68,75 @@ class AverageWaitingTime(BaseModel):
 
 # ==== UTILS ====
 
+vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
+
 def get_date_range(start: Optional[date], end: Optional[date]):
-    today = date.today()
+    # Mặc định là hôm nay theo giờ VN (server chạy UTC)
+    today = datetime.now(vn_tz).date()
     if not start:
         start = today
     if not end:
         end = today
     return start, end
 
+def daily_stats_query(db: Session, tenxa_id: int, start: date, end: date, *columns):
+    """Gộp bảng ticket_daily_stats (xã, quầy, ngày) theo quầy — đọc số ngày × số quầy dòng thay vì từng vé"""
+    return (
+        db.query(TicketDailyStat.counter_id, *columns)
+        .filter(
+            TicketDailyStat.tenxa_id == tenxa_id,
+            TicketDailyStat.service_date.between(start, end),
+        )
+        .group_by(TicketDailyStat.counter_id)
+    )
+
+def cached_stats(model):
+    """
+    Cache kết quả endpoint thống kê (app/utils/stats_cache.py).
+    Key: tên endpoint + xã + khoảng ngày (đã áp mặc định) + các tham số lọc còn lại.
+    model: schema của từng phần tử trong list trả về (để dựng lại từ Redis).
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            params = dict(bound.arguments)
+            db = params.pop("db")
+            tenxa = params.pop("tenxa", None)
+            tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa) if tenxa else None
+            if "date_check" in params:
+                start = end = params.pop("date_check") or datetime.now(vn_tz).date()
+            else:
+                start, end = get_date_range(params.pop("start_date", None), params.pop("end_date", None))
+            return stats_cache.get_or_compute(
+                func.__name__, tenxa_id, start, end, params,
+                compute=lambda: func(*args, **kwargs),
+                dump=lambda items: [item.dict() for item in items],
+                load=lambda rows: [row if isinstance(row, model) else model(**row) for row in rows],
+            )
+        return wrapper
+    return decorator
+
+def get_datetime_range(start: date, end: date):
+    """[00:00 ngày start, 00:00 ngày sau end) theo giờ VN, để lọc cột timestamp bằng khoảng (dùng được index)"""
+    return (
+        vn_tz.localize(datetime.combine(start, time.min)),
+        vn_tz.localize(datetime.combine(end + timedelta(days=1), time.min)),
+    )
+
 
 # ==== ENDPOINTS ====
 
+@router.get("/cache-metrics")
+def stats_cache_metrics():
+    """Số lần hit/miss của cache thống kê theo từng endpoint"""
+    return stats_cache.snapshot_metrics()
+
+
 @router.get("/tickets-per-counter", response_model=List[TicketsPerCounter])
+@cached_stats(TicketsPerCounter)
 def tickets_per_counter(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
@@ -87,11 +147,10 @@ def tickets_per_counter(
     print("start_date:", start_date, "end_date:", end_date)
     start, end = get_date_range(start_date, end_date)
 
+    total_tickets = func.sum(TicketDailyStat.total_tickets)
     result = (
-        db.query(Ticket.counter_id, func.count().label("total_tickets"))
-        .filter(func.date(Ticket.created_at) >= start, func.date(Ticket.created_at) <= end)
-        .filter(Ticket.tenxa_id == tenxa_id)
-        .group_by(Ticket.counter_id)
+        daily_stats_query(db, tenxa_id, start, end, total_tickets.label("total_tickets"))
+        .having(total_tickets > 0)
         .all()
     )
 
@@ -108,6 +167,7 @@ def tickets_per_counter(
 
 
 @router.get("/attended-tickets", response_model=List[AttendedTickets])
+@cached_stats(AttendedTickets)
 def attended_tickets(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
@@ -117,16 +177,10 @@ def attended_tickets(
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
     start, end = get_date_range(start_date, end_date)
 
+    attended = func.sum(TicketDailyStat.attended_tickets)
     result = (
-        db.query(Ticket.counter_id, func.count().label("attended_tickets"))
-        .filter(
-            Ticket.called_at.isnot(None),
-            Ticket.finished_at.isnot(None),
-            func.date(Ticket.created_at) >= start,
-            func.date(Ticket.created_at) <= end,
-        )
-        .filter(Ticket.tenxa_id == tenxa_id)
-        .group_by(Ticket.counter_id)
+        daily_stats_query(db, tenxa_id, start, end, attended.label("attended_tickets"))
+        .having(attended > 0)
         .all()
     )
 
@@ -144,6 +198,7 @@ def attended_tickets(
 
 
 @router.get("/average-handling-time", response_model=List[AverageHandlingTime])
+@cached_stats(AverageHandlingTime)
 def average_handling_time(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
@@ -152,19 +207,13 @@ def average_handling_time(
 ):
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
     start, end = get_date_range(start_date, end_date)
+    attended = func.sum(TicketDailyStat.attended_tickets)
     result = (
-        db.query(
-            Ticket.counter_id,
-            func.avg(func.extract("epoch", Ticket.finished_at - Ticket.called_at)).label("avg_handling_time_minutes")
-        )
-        .filter(Ticket.tenxa_id == tenxa_id)
-        .filter(
-            Ticket.called_at.isnot(None),
-            Ticket.finished_at.isnot(None),
-            func.date(Ticket.created_at) >= start,
-            func.date(Ticket.created_at) <= end,
+        daily_stats_query(
+            db, tenxa_id, start, end,
+            (func.sum(TicketDailyStat.handling_seconds) / attended).label("avg_handling_time_minutes"),
         )
-        .group_by(Ticket.counter_id)
+        .having(attended > 0)
         .all()
     )
 
@@ -175,32 +224,35 @@ def average_handling_time(
 
 
 @router.get("/working-time-check", response_model=List[WorkingTimeCheck])
+@cached_stats(WorkingTimeCheck)
 def working_time_check(
     date_check: Optional[date] = Query(None),
     tenxa: str = Query(...),
     db: Session = Depends(get_db),
 ):
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    date_check = date_check or date.today()
+    date_check = date_check or datetime.now(vn_tz).date()
+    day_start, day_end = get_datetime_range(date_check, date_check)
     result = []
 
+    # Lần có mặt đầu tiên trong ngày = khoảng "có người" bắt đầu sớm nhất trong ngày (seat_sessions)
     sub = (
         db.query(
-            Seat.counter_id,
-            func.min(SeatLog.timestamp).label("first_checkin")
+            SeatSession.counter_id,
+            func.min(SeatSession.started_at).label("first_checkin")
         )
-        .join(Seat, Seat.id == SeatLog.seat_id)
-        .filter(SeatLog.tenxa_id == tenxa_id)
+        .filter(SeatSession.tenxa_id == tenxa_id)
         .filter(
-            SeatLog.new_status == True,  # Có mặt
-            func.date(SeatLog.timestamp) == date_check
+            SeatSession.occupied == True,  # Có mặt
+            SeatSession.started_at >= day_start,
+            SeatSession.started_at < day_end
         )
-        .group_by(Seat.counter_id)
+        .group_by(SeatSession.counter_id)
         .all()
     )
 
     for counter_id, first_checkin in sub:
-        is_late = first_checkin.time() > datetime.strptime("07:30:00", "%H:%M:%S").time()
+        is_late = first_checkin.astimezone(vn_tz).time() > datetime.strptime("07:30:00", "%H:%M:%S").time()
         result.append(
             WorkingTimeCheck(
                 counter_id=counter_id,
@@ -211,7 +263,37 @@ def working_time_check(
 
     return result
 
+# Thời gian vắng mặt theo quầy, tính hết trong Postgres trên seat_sessions:
+#   - mỗi khoảng "trống" đã kết thúc (ghế có người trở lại) là 1 lần vắng
+#   - cắt theo giờ làm việc (07:30 ngày bắt đầu → 17:30 ngày kết thúc, giờ VN), cộng theo quầy
+AFK_SQL = text("""
+WITH absences AS (
+    SELECT
+        counter_id,
+        started_at AT TIME ZONE 'Asia/Ho_Chi_Minh' AS afk_start,
+        ended_at AT TIME ZONE 'Asia/Ho_Chi_Minh' AS afk_end
+    FROM seat_sessions
+    WHERE tenxa_id = :tenxa_id
+      AND occupied = false
+      AND ended_at IS NOT NULL
+      AND started_at >= :range_start
+      AND ended_at < :range_end
+),
+clipped AS (
+    SELECT
+        counter_id,
+        GREATEST(afk_start, date_trunc('day', afk_start) + time '07:30') AS effective_start,
+        LEAST(afk_end, date_trunc('day', afk_end) + time '17:30') AS effective_end
+    FROM absences
+)
+SELECT counter_id, SUM(EXTRACT(EPOCH FROM effective_end - effective_start)) / 60 AS total_absent_minutes
+FROM clipped
+WHERE effective_start < effective_end
+GROUP BY counter_id
+""")
+
 @router.get("/afk-duration", response_model=List[AfkDuration])
+@cached_stats(AfkDuration)
 def afk_duration(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
@@ -221,59 +303,20 @@ def afk_duration(
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
 
     start_date, end_date = get_date_range(start_date, end_date)
-    total_afk_per_counter = defaultdict(float)
+    range_start, range_end = get_datetime_range(start_date, end_date)
 
-    seat_logs = (
-        db.query(SeatLog)
-        .join(Seat, SeatLog.seat_id == Seat.id)
-        .filter(SeatLog.tenxa_id == tenxa_id)
-        .filter(
-            func.date(SeatLog.timestamp) >= start_date,
-            func.date(SeatLog.timestamp) <= end_date,
-            SeatLog.new_status.in_([True, False])  # 0: vắng mặt, 1: có mặt
-        )
-        .order_by(SeatLog.seat_id, SeatLog.timestamp)
-        .all()
-    )
-
-    from itertools import groupby
-    grouped_by_seat = groupby(seat_logs, key=lambda log: log.seat_id)
-
-    for seat_id, logs in grouped_by_seat:
-        logs = list(logs)
-        counter_id = logs[0].seat.counter_id
-        prev_status = None
-        prev_time = None
-
-        for log in logs:
-            current_time = log.timestamp
-            current_status = log.new_status
-
-            if prev_status is False and current_status is True:
-                afk_start = prev_time
-                afk_end = current_time
-
-                tz = afk_start.tzinfo or pytz.timezone("Asia/Ho_Chi_Minh")
-
-                working_start = tz.localize(datetime.combine(afk_start.date(), time(7, 30))) if afk_start.tzinfo is None else datetime.combine(afk_start.date(), time(7, 30)).replace(tzinfo=tz)
-                working_end = tz.localize(datetime.combine(afk_end.date(), time(17, 30))) if afk_end.tzinfo is None else datetime.combine(afk_end.date(), time(17, 30)).replace(tzinfo=tz)
-
-                effective_start = max(afk_start, working_start)
-                effective_end = min(afk_end, working_end)
-
-                if effective_start < effective_end:
-                    duration = (effective_end - effective_start).total_seconds()
-                    total_afk_per_counter[counter_id] += duration / 60  # convert to minutes
-
-            prev_status = current_status
-            prev_time = current_time
+    result = db.execute(
+        AFK_SQL,
+        {"tenxa_id": tenxa_id, "range_start": range_start, "range_end": range_end},
+    ).all()
 
     return [
-        AfkDuration(counter_id=k, total_absent_minutes=v)
-        for k, v in total_afk_per_counter.items()
+        AfkDuration(counter_id=counter_id, total_absent_minutes=minutes)
+        for counter_id, minutes in result
     ]
 
 @router.get("/average-waiting-time", response_model=List[AverageWaitingTime])
+@cached_stats(AverageWaitingTime)
 def average_waiting_time(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
@@ -283,19 +326,13 @@ def average_waiting_time(
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
     start, end = get_date_range(start_date, end_date)
 
+    waiting = func.sum(TicketDailyStat.waiting_tickets)
     result = (
-        db.query(
-            Ticket.counter_id,
-            func.avg(func.extract("epoch", Ticket.called_at - Ticket.created_at)).label("avg_waiting_time_minutes")
+        daily_stats_query(
+            db, tenxa_id, start, end,
+            (func.sum(TicketDailyStat.waiting_seconds) / waiting).label("avg_waiting_time_minutes"),
         )
-        .filter(
-            Ticket.created_at.isnot(None),
-            Ticket.called_at.isnot(None),
-            func.date(Ticket.created_at) >= start,
-            func.date(Ticket.created_at) <= end,
-        )
-        .filter(Ticket.tenxa_id == tenxa_id)
-        .group_by(Ticket.counter_id)
+        .having(waiting > 0)
         .all()
     )
 
@@ -322,8 +359,8 @@ def export_ticket_report(
             Ticket.tenxa_id == tenxa_id,
             Ticket.called_at.isnot(None),
             Ticket.finished_at.isnot(None),
-            func.date(Ticket.created_at) >= start,
-            func.date(Ticket.created_at) <= end,
+            Ticket.service_date >= start,
+            Ticket.service_date <= end,
         )
         .order_by(Ticket.created_at)
         .all()
@@ -373,6 +410,7 @@ class RatingPerCounter(BaseModel):
     need_improvement: int
 
 @router.get("/rating-per-counter", response_model=List[RatingPerCounter])
+@cached_stats(RatingPerCounter)
 def rating_per_counter(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
@@ -382,35 +420,23 @@ def rating_per_counter(
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
     start, end = get_date_range(start_date, end_date)
 
+    satisfied = func.sum(TicketDailyStat.satisfied)
+    neutral = func.sum(TicketDailyStat.neutral)
+    needs_improvement = func.sum(TicketDailyStat.needs_improvement)
     result = (
-        db.query(
-            Ticket.counter_id,
-            Ticket.rating,
-            func.count().label("count")
-        )
-        .filter(
-            Ticket.tenxa_id == tenxa_id,
-            Ticket.rating.isnot(None),
-            Ticket.status == "done",
-            func.date(Ticket.created_at).between(start, end)
-        )
-        .group_by(Ticket.counter_id, Ticket.rating)
+        daily_stats_query(db, tenxa_id, start, end, satisfied, neutral, needs_improvement)
+        .having(satisfied + neutral + needs_improvement > 0)
         .all()
     )
 
-    # Gom theo counter
-    data = defaultdict(lambda: {"satisfied": 0, "neutral": 0, "needs_improvement": 0})
-    for counter_id, rating, count in result:
-        data[counter_id][rating] = count
-
     return [
         RatingPerCounter(
             counter_id=cid,
-            satisfied=vals["satisfied"],
-            neutral=vals["neutral"],
-            need_improvement=vals["needs_improvement"]
+            satisfied=sat,
+            neutral=neu,
+            need_improvement=need
         )
-        for cid, vals in data.items()
+        for cid, sat, neu, need in result
     ]
 
 class FeedbackItem(BaseModel):
@@ -421,6 +447,7 @@ class FeedbackItem(BaseModel):
     created_at: datetime
 
 @router.get("/feedbacks", response_model=List[FeedbackItem])
+@cached_stats(FeedbackItem)
 def list_feedbacks(
     rating: Optional[str] = Query(None, regex="^(satisfied|neutral|needs_improvement)$"),
     counter_id: Optional[int] = Query(None),
@@ -437,7 +464,7 @@ def list_feedbacks(
         Ticket.status == "done",
         #Ticket.feedback.isnot(None),
         Ticket.status == "done",
-        func.date(Ticket.created_at).between(start, end)
+        Ticket.service_date.between(start, end)
     )
     if rating:
         q = q.filter(Ticket.rating == rating)
@@ -468,116 +495,68 @@ class TenxaStats(BaseModel):
     neutral: int
     needs_improvement: int
 
-@router.get("/all-unit", response_model=List[TenxaStats])
-def stats_by_tenxa(
-    start_date: Optional[date] = Query(None),
-    end_date: Optional[date] = Query(None),
-    db: Session = Depends(get_db),
-):
-    start, end = get_date_range(start_date, end_date)
-
-    # --- Tổng số vé được in ---
-    total_q = (
-        db.query(
-            Ticket.tenxa_id,
-            func.count().label("total_tickets")
-        )
-        .filter(func.date(Ticket.created_at).between(start, end))
-        .group_by(Ticket.tenxa_id)
-        .all()
-    )
-    total_map = {row.tenxa_id: row.total_tickets for row in total_q}
-
-    # --- Tổng số vé đã tiếp đón ---
-    attended_q = (
-        db.query(
-            Ticket.tenxa_id,
-            func.count().label("attended_tickets")
-        )
-        .filter(
-            Ticket.called_at.isnot(None),
-            Ticket.finished_at.isnot(None),
-            func.date(Ticket.created_at).between(start, end)
-        )
-        .group_by(Ticket.tenxa_id)
-        .all()
+def compute_tenxa_stats(db: Session, start: date, end: date) -> List[TenxaStats]:
+    """
+    Số liệu từng xã trong khoảng ngày bằng 1 query gộp trên ticket_daily_stats
+    (dùng chung cho /all-unit và các file Excel, cache chung 1 key).
+    """
+    return stats_cache.get_or_compute(
+        "stats_by_tenxa", None, start, end, {},
+        compute=lambda: _compute_tenxa_stats(db, start, end),
+        dump=lambda items: [item.dict() for item in items],
+        load=lambda rows: [row if isinstance(row, TenxaStats) else TenxaStats(**row) for row in rows],
     )
-    attended_map = {row.tenxa_id: row.attended_tickets for row in attended_q}
 
-    # --- Thời gian chờ trung bình ---
-    waiting_q = (
+def _compute_tenxa_stats(db: Session, start: date, end: date) -> List[TenxaStats]:
+    waiting = func.sum(TicketDailyStat.waiting_tickets)
+    attended = func.sum(TicketDailyStat.attended_tickets)
+    rows = (
         db.query(
-            Ticket.tenxa_id,
-            func.avg(func.extract("epoch", Ticket.called_at - Ticket.created_at)).label("avg_waiting_time")
+            Tenxa.id,
+            Tenxa.name,
+            func.coalesce(func.sum(TicketDailyStat.total_tickets), 0),
+            func.coalesce(attended, 0),
+            func.sum(TicketDailyStat.waiting_seconds) / func.nullif(waiting, 0),
+            func.sum(TicketDailyStat.handling_seconds) / func.nullif(attended, 0),
+            func.coalesce(func.sum(TicketDailyStat.satisfied), 0),
+            func.coalesce(func.sum(TicketDailyStat.neutral), 0),
+            func.coalesce(func.sum(TicketDailyStat.needs_improvement), 0),
         )
-        .filter(
-            Ticket.created_at.isnot(None),
-            Ticket.called_at.isnot(None),
-            func.date(Ticket.created_at).between(start, end)
+        # LEFT JOIN để xã không có vé vẫn có dòng (số liệu 0)
+        .outerjoin(
+            TicketDailyStat,
+            and_(
+                TicketDailyStat.tenxa_id == Tenxa.id,
+                TicketDailyStat.service_date.between(start, end),
+            ),
         )
-        .group_by(Ticket.tenxa_id)
+        .group_by(Tenxa.id, Tenxa.name)
         .all()
     )
-    waiting_map = {row.tenxa_id: row.avg_waiting_time for row in waiting_q}
 
-    # --- Thời gian tiếp đón trung bình ---
-    handling_q = (
-        db.query(
-            Ticket.tenxa_id,
-            func.avg(func.extract("epoch", Ticket.finished_at - Ticket.called_at)).label("avg_handling_time")
-        )
-        .filter(
-            Ticket.called_at.isnot(None),
-            Ticket.finished_at.isnot(None),
-            func.date(Ticket.created_at).between(start, end)
-        )
-        .group_by(Ticket.tenxa_id)
-        .all()
-    )
-    handling_map = {row.tenxa_id: row.avg_handling_time for row in handling_q}
-
-    # --- Rating ---
-    rating_q = (
-        db.query(
-            Ticket.tenxa_id,
-            Ticket.rating,
-            func.count().label("count")
-        )
-        .filter(
-            Ticket.rating.isnot(None),
-            Ticket.status == "done",   # 👈 chỉ lấy vé done
-            func.date(Ticket.created_at).between(start, end)
-        )
-        .group_by(Ticket.tenxa_id, Ticket.rating)
-        .all()
-    )
-
-
-    rating_map = defaultdict(lambda: {"satisfied": 0, "neutral": 0, "needs_improvement": 0})
-    for tenxa_id, rating, count in rating_q:
-        if rating in rating_map[tenxa_id]:
-            rating_map[tenxa_id][rating] += count
-
-    # --- Lấy danh sách xã ---
-    tenxa_list = db.query(Tenxa.id, Tenxa.name).all()
-
-    results = []
-    for tx_id, tx_name in tenxa_list:
-        results.append(
-            TenxaStats(
-                tenxa_id=tx_id,
-                tenxa_name=tx_name,
-                total_tickets=total_map.get(tx_id, 0),
-                attended_tickets=attended_map.get(tx_id, 0),
-                avg_waiting_time_seconds=waiting_map.get(tx_id),
-                avg_handling_time_seconds=handling_map.get(tx_id),
-                satisfied=rating_map[tx_id]["satisfied"],
-                neutral=rating_map[tx_id]["neutral"],
-                needs_improvement=rating_map[tx_id]["needs_improvement"],  # ⚠️ sửa đúng key
-            )
+    return [
+        TenxaStats(
+            tenxa_id=tx_id,
+            tenxa_name=tx_name,
+            total_tickets=total,
+            attended_tickets=attended_count,
+            avg_waiting_time_seconds=avg_waiting,
+            avg_handling_time_seconds=avg_handling,
+            satisfied=satisfied,
+            neutral=neutral,
+            needs_improvement=needs_improvement,
         )
+        for tx_id, tx_name, total, attended_count, avg_waiting, avg_handling, satisfied, neutral, needs_improvement in rows
+    ]
 
-    return results
+@router.get("/all-unit", response_model=List[TenxaStats])
+def stats_by_tenxa(
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    db: Session = Depends(get_db),
+):
+    start, end = get_date_range(start_date, end_date)
+    return compute_tenxa_stats(db, start, end)
 
 
 from fastapi import Query, Depends, APIRouter
@@ -592,7 +571,6 @@ from statistics import mean
 
 from app import database
 from app.models import Ticket, Tenxa
-#from .your_stats_file import stats_by_tenxa  # 👈 thay đúng đường dẫn file chứa stats_by_tenxa
 
 
 @router.get("/all-unit/excel")
@@ -601,8 +579,8 @@ def export_stats_excel(
     end_date: Optional[date] = Query(None),
     db: Session = Depends(get_db),
 ):
-    start, end = stats_by_tenxa.__globals__["get_date_range"](start_date, end_date)  # reuse util
-    stats = stats_by_tenxa(start_date, end_date, db)
+    start, end = get_date_range(start_date, end_date)
+    stats = compute_tenxa_stats(db, start, end)
 
     # --- Sort theo mã xã ---
     stats_sorted = sorted(stats, key=lambda r: r.tenxa_id)
@@ -763,8 +741,8 @@ def export_stats_excel1(
     end_date: Optional[date] = Query(None),
     db: Session = Depends(get_db),
 ):
-    start, end = stats_by_tenxa.__globals__["get_date_range"](start_date, end_date)  # reuse util
-    stats = stats_by_tenxa(start_date, end_date, db)
+    start, end = get_date_range(start_date, end_date)
+    stats = compute_tenxa_stats(db, start, end)
 
     # --- Sort theo mã xã ---
     stats_sorted = sorted(stats, key=lambda r: r.tenxa_id)
@@ -1,24 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-import uuid, os, subprocess
+import uuid, os, re
 from app import database, models, crud, schemas
+from app.utils.mp3_concat import concat_mp3
+from app.utils.tts_clips import clip_bank, invalidate_counter_clip, TTS_FOLDER
+from app.utils.tts_announcement import Announcement, MissingClip, get_announcement, announcement_cache, parse_announcement_id
 from sqlalchemy import func
 
 router = APIRouter()
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # endpoint/
-APP_DIR = os.path.abspath(os.path.join(BASE_DIR, "../../"))  # về tới thư mục app/
-TTS_FOLDER = os.path.join(APP_DIR, "utils", "TTS")  # app/utils/TTS
-
-PREFIX_PATH = os.path.join(TTS_FOLDER, "prefix", "prefix.mp3")
-PREFIX_PATH_TAP = os.path.join(TTS_FOLDER, "prefix", "prefix_tap.mp3")
-NUMBERS_PATH = os.path.join(TTS_FOLDER, "numbers")
+# prefix / số đọc từ clip_bank (nạp sẵn lúc khởi động), chỉ audio quầy kiểu cũ còn đọc file
 COUNTER_PATH = os.path.join(TTS_FOLDER, "counter_audio")
 
-#print("PREFIX_PATH:", PREFIX_PATH)
-#print("NUMBERS_PATH:", NUMBERS_PATH)
 #print("COUNTER_PATH:", COUNTER_PATH)
 
 class TTSRequest(BaseModel):
@@ -32,10 +27,82 @@ def get_db():
     finally:
         db.close()
 
-@router.post("/old", response_class=FileResponse)
+def read_clip(path: str) -> bytes:
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Missing audio file: {os.path.basename(path)}")
+    with open(path, "rb") as f:
+        return f.read()
+
+def require_clip(clip, name: str) -> bytes:
+    if clip is None:
+        raise HTTPException(status_code=404, detail=f"Missing audio file: {name}")
+    return clip
+
+# TV lấy lại trong vòng 1 phút thì dùng luôn, sau đó hỏi lại bằng If-None-Match (304 nếu không đổi)
+ANNOUNCEMENT_CACHE_CONTROL = "public, max-age=60"
+# audio_id chứa version audio quầy → nội dung không bao giờ đổi
+IMMUTABLE_CACHE_CONTROL = "public, max-age=86400, immutable"
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def parse_range(header: str, size: int):
+    """(start, end) của 1 khoảng "bytes=a-b"; None = trả cả file (không có / nhiều khoảng); raise 416 nếu sai"""
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        start, end = max(size - int(last), 0), size - 1  # "bytes=-n": n byte cuối
+    else:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range Not Satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def announcement_response(request: Request, announcement: Announcement, cache_control: str = ANNOUNCEMENT_CACHE_CONTROL) -> Response:
+    """Trả câu gọi số kèm ETag / Cache-Control; hỗ trợ If-None-Match (304) và Range (206)"""
+    headers = {
+        "ETag": announcement.etag,
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'inline; filename="tts_{announcement.etag[1:-1]}.mp3"',
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or announcement.etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    data = announcement.data
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == announcement.etag):
+        byte_range = parse_range(range_header, len(data))
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return Response(content=data[start:end + 1], status_code=206, media_type="audio/mpeg", headers=headers)
+    return Response(content=data, media_type="audio/mpeg", headers=headers)
+
+def load_announcement(db: Session, tenxa: str, counter_id: int, ticket_number: int) -> Announcement:
+    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+    try:
+        return get_announcement(db, tenxa_id, counter_id, ticket_number)
+    except MissingClip as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+def mp3_response(audio: bytes) -> Response:
+    """Trả file MP3 ghép trong bộ nhớ (không ghi file tạm, không ffmpeg)"""
+    filename = f"tts_{uuid.uuid4().hex}.mp3"
+    return Response(
+        content=audio,
+        media_type="audio/mpeg",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@router.post("/old", response_class=Response)
 def generate_tts(
     request: TTSRequest,
-    background_tasks: BackgroundTasks,
     tenxa: str = Query(...),
     db: Session = Depends(get_db)
 ):
@@ -51,53 +118,22 @@ def generate_tts(
         raise HTTPException(status_code=404, detail="Counter not found")
 
 
-    # Đường dẫn 3 file cần ghép
-    prefix = PREFIX_PATH
-    number = os.path.join(NUMBERS_PATH, f"{request.ticket_number}.mp3")
-    print("Number file:", number)
-    print("Exists:", os.path.exists(number))
+    prefix = require_clip(clip_bank.prefix("prefix"), "prefix.mp3")
+    number = require_clip(clip_bank.number(request.ticket_number), f"{request.ticket_number}.mp3")
     counter_file = os.path.join(COUNTER_PATH, f"Quay{request.counter_id}_xa{tenxa_id}.mp3")
-    print("Number file:", counter_file)
-    print("Exists:", os.path.exists(counter_file))
-
-    # Kiểm tra tồn tại
-    for path in [prefix, number, counter_file]:
-        if not os.path.exists(path):
-            raise HTTPException(status_code=404, detail=f"Missing audio file: {os.path.basename(path)}")
-
-    # Tạo file tạm
-    filename = f"tts_{uuid.uuid4().hex}.mp3"
 
-    # Ghép file bằng ffmpeg
-    list_path = f"temp_{uuid.uuid4().hex}.txt"
-    with open(list_path, "w", encoding="utf-8") as f:
-        f.write(f"file '{prefix}'\n")
-        f.write(f"file '{number}'\n")
-        f.write(f"file '{counter_file}'\n")
-
-    try:
-        subprocess.run(
-            ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", filename],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
-    except subprocess.CalledProcessError:
-        raise HTTPException(status_code=500, detail="Failed to generate audio")
-
-    # Dọn rác
-    background_tasks.add_task(lambda: os.remove(filename))
-    background_tasks.add_task(lambda: os.remove(list_path))
-
-    return FileResponse(filename, media_type="audio/mpeg", filename=filename)
+    # Ghép 3 đoạn trong bộ nhớ
+    audio = concat_mp3([prefix, number, read_clip(counter_file)])
+    return mp3_response(audio)
 
 from fastapi import UploadFile
-from gtts import gTTS
 from sqlalchemy import insert
 from datetime import datetime
 from app import models
 from io import BytesIO
 from fastapi.responses import StreamingResponse
+from app.utils.tts_backend import tts_backend, counter_audio_text
+from app.background.counter_audio_jobs import counter_audio_jobs, collect_items, store_counter_audio
 
 @router.post("/generate_counter_audio")
 def generate_counter_audio(
@@ -122,31 +158,9 @@ def generate_counter_audio(
     #if not counter:
     #    raise HTTPException(status_code=404, detail="Không tìm thấy quầy")
 
-    # Tạo nội dung
-    text = f"Đến quầy số {data.counter_id}: {data.name}"
-    tts = gTTS(text, lang='vi')
-
-    # Lưu vào memory (BytesIO)
-    mp3_io = BytesIO()
-    tts.write_to_fp(mp3_io)
-    mp3_io.seek(0)
-    audio_bytes = mp3_io.read()
-
-    # Xoá bản ghi cũ (nếu có)
-    db.query(models.TTSAudio).filter(
-        models.TTSAudio.tenxa_id == tenxa_id,
-        models.TTSAudio.counter_id == data.counter_id
-    ).delete(synchronize_session=False)
-
-    # Ghi bản mới vào PostgreSQL
-    new_audio = models.TTSAudio(
-        tenxa_id=tenxa_id,
-        counter_id=data.counter_id,
-        audio_data=audio_bytes,
-        created_at=datetime.utcnow()
-    )
-    db.add(new_audio)
-    db.commit()
+    # Tạo audio (TTS_BACKEND: gtts / stub) rồi thay bản cũ trong 1 transaction
+    audio_bytes = tts_backend.synthesize(counter_audio_text(data.counter_id, data.name))
+    store_counter_audio(db, tenxa_id, data.counter_id, audio_bytes)
 
     return {
         "detail": "Tạo và lưu file thành công",
@@ -154,6 +168,25 @@ def generate_counter_audio(
     }
 
 
+@router.post("/counter_audio_jobs")
+def create_counter_audio_job(data: schemas.CounterAudioJobCreate, db: Session = Depends(get_db)):
+    """Xếp hàng tạo lại audio cho nhiều quầy / nhiều xã, chạy nền; tra tiến độ bằng GET /tts/counter_audio_jobs/{job_id}"""
+    tenxa_ids = []
+    for slug in data.tenxa:
+        tenxa_id = crud.get_tenxa_id_from_slug(db, slug)
+        if tenxa_id is None:
+            raise HTTPException(status_code=404, detail=f"Không tìm thấy xã: {slug}")
+        tenxa_ids.append(tenxa_id)
+    job = counter_audio_jobs.submit(collect_items(db, tenxa_ids, data.counter_ids))
+    return job.to_dict()
+
+@router.get("/counter_audio_jobs/{job_id}")
+def get_counter_audio_job(job_id: str):
+    job = counter_audio_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    return job.to_dict()
+
 @router.get("/export_counter_audio", response_class=StreamingResponse)
 def export_counter_audio(
     tenxa: str = Query(...),
@@ -182,72 +215,50 @@ def export_counter_audio(
         }
     )
 
-@router.post("/", response_class=FileResponse)
+@router.post("/", response_class=Response)
 def generate_tts(
     request: TTSRequest,
-    background_tasks: BackgroundTasks,
+    http_request: Request,
     tenxa: str = Query(...),
     db: Session = Depends(get_db)
 ):
-    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-
-    # Lấy thông tin quầy
-    counter = db.query(models.Counter).filter(
-        models.Counter.tenxa_id == tenxa_id,
-        models.Counter.id == request.counter_id
-    ).first()
-
-    if not counter:
-        raise HTTPException(status_code=404, detail="Counter not found")
-
-    # Đường dẫn 2 file local
-    if tenxa_id in (0,):
-        prefix = PREFIX_PATH
-    else:
-        prefix = PREFIX_PATH_TAP
-
-    number = os.path.join(NUMBERS_PATH, f"{request.ticket_number}.mp3")
-
-    # Lấy audio từ DB
-    audio_record = db.query(models.TTSAudio).filter(
-        models.TTSAudio.tenxa_id == tenxa_id,
-        models.TTSAudio.counter_id == request.counter_id
-    ).order_by(models.TTSAudio.created_at.desc()).first()
-
-    if not audio_record:
-        raise HTTPException(status_code=404, detail="Missing audio file in DB for counter")
-
-    # Ghi file counter ra đĩa tạm
-    counter_file_path = f"counter_{uuid.uuid4().hex}.mp3"
-    with open(counter_file_path, "wb") as f:
-        f.write(audio_record.audio_data)
-
-    # Kiểm tra tồn tại 2 file local
-    for path in [prefix, number]:
-        if not os.path.exists(path):
-            raise HTTPException(status_code=404, detail=f"Missing audio file: {os.path.basename(path)}")
-
-    # Tạo danh sách file ghép
-    output_file = f"tts_{uuid.uuid4().hex}.mp3"
-    list_path = f"temp_{uuid.uuid4().hex}.txt"
-    with open(list_path, "w", encoding="utf-8") as f:
-        f.write(f"file '{prefix}'\n")
-        f.write(f"file '{number}'\n")
-        f.write(f"file '{counter_file_path}'\n")
+    # Không đọc DB / file: slug từ tenant_registry, clip từ clip_bank, câu đã ghép từ announcement_cache
+    announcement = load_announcement(db, tenxa, request.counter_id, request.ticket_number)
+    return announcement_response(http_request, announcement)
 
+@router.get("/announcement", response_class=Response)
+def get_announcement_audio(
+    request: Request,
+    tenxa: str = Query(...),
+    counter_id: int = Query(...),
+    ticket_number: int = Query(...),
+    db: Session = Depends(get_db)
+):
+    """Như POST /tts/ nhưng dùng GET để trình duyệt / TV cache được (ETag, Range)"""
+    announcement = load_announcement(db, tenxa, counter_id, ticket_number)
+    return announcement_response(request, announcement)
+
+@router.get("/announcement/{audio_id}", response_class=Response)
+def get_prerendered_announcement(
+    audio_id: str,
+    request: Request,
+    tenxa: str = Query(...),
+    db: Session = Depends(get_db)
+):
+    """Câu gọi số đã ghép sẵn lúc gọi vé (audio_id trong sự kiện ticket_called)"""
+    key = parse_announcement_id(audio_id)
+    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
+    if not key or key[0] != tenxa_id:
+        raise HTTPException(status_code=404, detail="Không tìm thấy audio")
+    _, counter_id, ticket_number, version = key
     try:
-        subprocess.run(
-            ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_file],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
-    except subprocess.CalledProcessError:
-        raise HTTPException(status_code=500, detail="Failed to generate audio")
-
-    # Dọn rác
-    background_tasks.add_task(lambda: os.remove(output_file))
-    background_tasks.add_task(lambda: os.remove(list_path))
-    background_tasks.add_task(lambda: os.remove(counter_file_path))
-
-    return FileResponse(output_file, media_type="audio/mpeg", filename=output_file)
+        announcement = get_announcement(db, tenxa_id, counter_id, ticket_number)
+    except MissingClip as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    # Audio quầy đã tạo lại sau lúc gọi vé: trả bản mới, không cho cache lâu
+    cache_control = IMMUTABLE_CACHE_CONTROL if announcement.version == version else ANNOUNCEMENT_CACHE_CONTROL
+    return announcement_response(request, announcement, cache_control)
+
+@router.get("/cache-metrics")
+def get_announcement_cache_metrics():
+    return announcement_cache.snapshot_metrics()
@@ -3,6 +3,8 @@ from sqlalchemy.orm import Session
 from app import crud, schemas, database, redis_client
 from typing import List, Optional
 from app.api.endpoints.realtime import notify_frontend
+from app.utils.auto_call_loop import request_auto_call_wake
+from app.utils.queue_state import queue_state
 from datetime import datetime, timedelta
 from pytz import timezone
 from app.utils.jwt_ultils import create_ticket_token, verify_ticket_token
@@ -40,9 +42,9 @@ def create_ticket(
     db: Session = Depends(get_db)
 ):
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    footer = crud.get_footer_by_tenxa(db, tenxa_id)
+    settings = crud.get_tenant_settings(db, tenxa_id)
 
-    if footer and not is_within_allowed_ranges(footer.allowed_time_ranges or []):
+    if settings and not is_within_allowed_ranges(settings.allowed_time_ranges or []):
         raise HTTPException(status_code=403, detail="Ngoài giờ làm việc, không thể tạo vé")
     if not redis_client.acquire_ticket_lock(tenxa_id, ticket.counter_id):
         raise HTTPException(status_code=429, detail="Bạn vừa lấy vé, vui lòng chờ vài giây")
@@ -67,6 +69,7 @@ def create_ticket(
             "token": token  # nếu cần cho kiosk in luôn QR
         }
     )
+    background_tasks.add_task(request_auto_call_wake, new_ticket.counter_id, tenxa_id)
 
     return {
         **new_ticket.__dict__,
@@ -81,8 +84,9 @@ def get_waiting_tickets(
     db: Session = Depends(get_db)
 ):
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    
-    return crud.get_waiting_tickets(db, tenxa_id, counter_id)
+
+    # Đọc từ hàng chờ trong bộ nhớ (app/utils/queue_state.py), không query bảng tickets
+    return queue_state.tickets(db, tenxa_id, "waiting", counter_id)
 
 @router.get("/called", response_model=List[schemas.Ticket])
 def get_called_tickets(
@@ -91,8 +95,8 @@ def get_called_tickets(
     db: Session = Depends(get_db)
 ):
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    
-    return crud.get_called_tickets(db, tenxa_id, counter_id)
+
+    return queue_state.tickets(db, tenxa_id, "called", counter_id)
 
 @router.get("/done", response_model=List[schemas.Ticket])
 def get_done_tickets(
@@ -101,8 +105,19 @@ def get_done_tickets(
     db: Session = Depends(get_db)
 ):
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
-    
-    return crud.get_done_tickets(db, tenxa_id, counter_id)
+
+    return queue_state.tickets(db, tenxa_id, "done", counter_id)
+
+@router.get("/queue-state/check")
+def check_queue_state(
+    tenxa: Optional[str] = Query(None, description="Bỏ trống để kiểm tra mọi xã"),
+    repair: bool = Query(False, description="Nạp lại từ DB các xã bị lệch"),
+    db: Session = Depends(get_db)
+):
+    """So hàng chờ trong bộ nhớ của worker này với DB"""
+    tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa) if tenxa else None
+    diffs = queue_state.check_consistency(db, tenxa_id, repair=repair)
+    return {"consistent": not diffs, "diffs": diffs}
 
 @router.put("/update_status", response_model=schemas.Ticket)
 def update_ticket_status(ticket_number: int, status_update: schemas.TicketUpdateStatus, tenxa: str = Query(...), db: Session = Depends(get_db)):
@@ -223,9 +238,7 @@ def transfer_ticket_single(
         raise HTTPException(status_code=400, detail="Chỉ có thể chuyển vé đang chờ (waiting)")
 
     # Kiểm tra quầy đích có vé waiting hoặc called không
-    waiting = crud.get_waiting_tickets(db, tenxa_id, target_counter_id)
-    called = crud.get_called_tickets(db, tenxa_id, target_counter_id)
-    if waiting or called:
+    if queue_state.is_busy(db, tenxa_id, target_counter_id):
         raise HTTPException(status_code=400, detail="Quầy đích đang bận, không thể chuyển vé")
     
     counter_name = crud.get_counter_name_from_counter_id(db, target_counter_id, tenxa_id)
@@ -246,6 +259,8 @@ def transfer_ticket_single(
     ticket.counter_id = target_counter_id
     db.commit()
     db.refresh(ticket)
+    queue_state.record_tickets(tenxa_id, [ticket])
+    background_tasks.add_task(request_auto_call_wake, target_counter_id, tenxa_id)
 
     return ticket
 
@@ -262,9 +277,7 @@ def transfer_tickets(
     tenxa_id = crud.get_tenxa_id_from_slug(db, tenxa)
 
     # Kiểm tra quầy đích có đang bận không
-    waiting = crud.get_waiting_tickets(db, tenxa_id, target_counter_id)
-    called = crud.get_called_tickets(db, tenxa_id, target_counter_id)
-    if waiting or called:
+    if queue_state.is_busy(db, tenxa_id, target_counter_id):
         raise HTTPException(status_code=400, detail="Quầy đích đang bận, không thể chuyển vé")
 
     # Lấy tên quầy đích
@@ -299,5 +312,7 @@ def transfer_tickets(
     db.commit()
     for ticket in transferred_tickets:
         db.refresh(ticket)
+    queue_state.record_tickets(tenxa_id, transferred_tickets)
+    background_tasks.add_task(request_auto_call_wake, target_counter_id, tenxa_id)
 
     return transferred_tickets
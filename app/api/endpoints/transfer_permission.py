@@ -5,6 +5,7 @@ from datetime import datetime
 from app import models, schemas, crud
 from app.auth import get_db
 from app.api.endpoints.realtime import notify_frontend
+from app.utils.queue_state import queue_state
 
 router = APIRouter()
 
@@ -123,15 +124,7 @@ def check_transfer_permission(counter_id: int, tenxa: str, db: Session = Depends
             models.Counter.id == target_id
         ).first()
         if counter:
-            queue_length = (
-                db.query(models.Ticket)
-                .filter(
-                    models.Ticket.tenxa_id == tenxa_id,
-                    models.Ticket.counter_id == target_id,
-                    models.Ticket.status == "waiting"
-                )
-                .count()
-            )
+            queue_length = queue_state.queue_length(db, tenxa_id, target_id)
             available_targets.append({
                 "counter_id": target_id,
                 "counter_name": counter.name,
@@ -1,94 +1,95 @@
 import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, time
 from app.database import SessionLocal
-from app.models import Counter, Ticket
+from app.models import Counter, Ticket, Seat
 from app.api.endpoints.realtime import notify_frontend
 from app import crud
+from app.utils.tts_announcement import announcement_audio_id, prerender_announcement
 import pytz
 
 vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
 
-async def check_and_call_next_for_counter(counter_id: int, tenxa_id: int):
+# Query/commit của auto-call là SQLAlchemy đồng bộ → chạy trên pool thread riêng,
+# không chặn event loop (WebSocket, endpoint async). Pool riêng để không tranh
+# thread với threadpool của FastAPI cho các endpoint def.
+AUTO_CALL_WORKERS = int(os.getenv("AUTO_CALL_WORKERS", "8"))
+auto_call_executor = ThreadPoolExecutor(max_workers=AUTO_CALL_WORKERS, thread_name_prefix="auto-call")
+
+
+async def check_and_call_next_for_counter(counter_id: int, tenxa_id: int) -> bool:
+    """
+    Gọi vé tiếp theo nếu quầy đủ điều kiện (có cán bộ, ghế khách trống).
+    Trả về True nếu scheduler nên hẹn kiểm tra lần sau, False để quầy nghỉ tới khi có sự kiện mới.
+    """
+    loop = asyncio.get_running_loop()
+    keep_going, event = await loop.run_in_executor(auto_call_executor, evaluate_counter, counter_id, tenxa_id)
+    if event:
+        await notify_frontend(event)
+        if event["audio_id"]:
+            # Ghép câu gọi số sau khi đã báo TV, không chờ (TV lấy sớm thì endpoint tự ghép)
+            loop.run_in_executor(
+                auto_call_executor, prerender_announcement, tenxa_id, event["counter_id"], event["ticket_number"]
+            )
+    return keep_going
+
+
+def evaluate_counter(counter_id: int, tenxa_id: int):
+    """
+    Phần đồng bộ (chạy trong auto_call_executor): kiểm tra quầy và gọi vé trong DB.
+    Trả về (keep_going, sự kiện ticket_called cần gửi hoặc None).
+    """
     db = SessionLocal()
     try:
-        now = datetime.now(vn_tz)
-        today = now.date()
-        start_of_day = datetime.combine(today, time.min, tzinfo=vn_tz)
-        end_of_day = datetime.combine(today, time.max, tzinfo=vn_tz)
-
         counter = db.query(Counter).filter(Counter.tenxa_id == tenxa_id).filter(Counter.id == counter_id).first()
         if not counter:
             print(f"❌ Không tìm thấy quầy với ID {counter_id}")
-            return
+            return False, None
         if counter.status != "active":
-            return  
+            return False, None
 
-        seats = counter.seats
-        if not seats or len(seats) < 2:
-            return
+        # Counter không có relationship seats → lấy ghế theo counter_id trong cùng xã
+        seats = db.query(Seat).filter(Seat.tenxa_id == tenxa_id, Seat.counter_id == counter_id).all()
+        if len(seats) < 2:
+            return False, None
 
         officer_seat = next((s for s in seats if s.type == 'officer'), None)
         client_seat = next((s for s in seats if s.type == 'client'), None)
 
         if officer_seat is None or client_seat is None:
-            return
-        
-        if officer_seat.tenxa_id != tenxa_id or client_seat.tenxa_id != tenxa_id:
-            print(f"❌ Seat không thuộc xã {tenxa_id}")
-            return
+            return False, None
 
         if not officer_seat.status:
             print(f"⚠️ Không có cán bộ ngồi tại quầy {counter.name} xã {tenxa_id}")
-            return
+            return False, None
 
         if officer_seat.status and not client_seat.status:
-            # 👉 Đánh dấu vé đang "called" (nếu có) thành "done"
-            current_ticket = (
-                db.query(Ticket)
-                .filter(
-                    Ticket.status == "called",
-                    Ticket.counter_id == counter.id,
-                    Ticket.tenxa_id == tenxa_id
-                )
-                .order_by(Ticket.called_at.desc())  # Ưu tiên mới nhất nếu có nhiều
-                .first()
-            )
-            if current_ticket:
-                current_ticket.status = "done"
-                current_ticket.finished_at = now  # nếu có field thời gian kết thúc
-                db.commit()
-
-            # 👉 Gọi vé tiếp theo
-            next_ticket = (
-                db.query(Ticket)
-                .filter(
-                    Ticket.status == "waiting",
-                    Ticket.counter_id == counter.id,
-                    Ticket.tenxa_id == tenxa_id
-                )
-                .filter(Ticket.created_at >= start_of_day)
-                .filter(Ticket.created_at <= end_of_day)
-                .order_by(Ticket.created_at)
-                .first()
-            )
+            # 👉 Đóng vé đang "called" và gọi vé tiếp theo trong 1 transaction (dùng chung với gọi vé thủ công)
+            next_ticket = crud.call_next_ticket(db, tenxa_id, counter.id)
 
             if next_ticket:
                 tenxa = crud.get_slug_from_tenxa_id(db, tenxa_id)
                 print(f"🎯 Gọi vé {next_ticket.number} tại quầy {counter.name} xã {tenxa}")
-                next_ticket.status = "called"
-                next_ticket.called_at = now  # nếu có field thời gian gọi
-                db.commit()
 
+                # 🔊 Chỉ tính audio_id (không ghép) để báo TV ngay; ghép ở nền sau khi gửi sự kiện
+                audio_id = announcement_audio_id(db, tenxa_id, counter.id, next_ticket.number)
                 vn_time = datetime.now(pytz.timezone("Asia/Ho_Chi_Minh")).isoformat()
-                await notify_frontend({
+                return True, {
                     "event": "ticket_called",
                     "ticket_number": next_ticket.number,
                     "counter_name": counter.name,
+                    "counter_id": counter.id,
                     "tenxa": tenxa,
-                    "timestamp": vn_time
-                })
+                    "timestamp": vn_time,
+                    "audio_id": audio_id
+                }
+
+        # Khách đang ngồi hoặc hết vé chờ → nghỉ tới khi ghế đổi / có vé mới
+        return False, None
 
     except Exception as e:
         print(f"❌ Lỗi khi auto-call cho quầy {counter_id}: {e}")
+        return True, None  # lỗi tạm thời (DB...) → thử lại lần sau
     finally:
         db.close()
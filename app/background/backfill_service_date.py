@@ -0,0 +1,46 @@
+# app/background/backfill_service_date.py
+# Điền tickets.service_date cho vé cũ (trước khi có cột). Chạy theo từng lô id, mỗi lô 1 transaction
+# ngắn để không khoá bảng tickets lâu; chạy lại nhiều lần cũng được (chỉ điền dòng còn NULL).
+#
+# Chạy tay: python -m app.background.backfill_service_date [--batch-size 20000]
+import argparse
+from sqlalchemy import text
+from app.database import engine
+from app.utils.stats_cache import stats_cache
+from app.utils.service_date import SERVICE_DATE_SQL
+
+BATCH_SIZE = 20000
+
+BACKFILL_SQL = text(
+    "UPDATE tickets SET service_date = " + SERVICE_DATE_SQL + " FROM tenxa "
+    "WHERE tenxa.id = tickets.tenxa_id AND tickets.service_date IS NULL "
+    "AND tickets.id >= :lo AND tickets.id < :hi"
+)
+
+
+def backfill_service_date(bind=engine, batch_size: int = BATCH_SIZE) -> int:
+    with bind.connect() as conn:
+        lo, hi = conn.execute(text("SELECT min(id), max(id) FROM tickets WHERE service_date IS NULL")).one()
+    if lo is None:
+        print("✅ Không còn vé nào thiếu service_date")
+        return 0
+
+    total = 0
+    for start in range(lo, hi + 1, batch_size):
+        with bind.begin() as conn:
+            total += conn.execute(BACKFILL_SQL, {"lo": start, "hi": start + batch_size}).rowcount
+        print(f"🛠️ service_date: đã điền {total} vé (tới id {min(start + batch_size, hi + 1) - 1}/{hi})")
+
+    with bind.begin() as conn:
+        conn.execute(text("ANALYZE tickets"))
+    # Số liệu ngày cũ đã đổi → bỏ cache thống kê (backend redis; memory chỉ mất khi restart worker)
+    stats_cache.clear()
+    print(f"✅ Xong, điền {total} vé")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Điền tickets.service_date cho dữ liệu cũ")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    backfill_service_date(batch_size=args.batch_size)
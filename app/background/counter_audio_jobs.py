@@ -0,0 +1,173 @@
+# app/background/counter_audio_jobs.py
+# Tạo lại audio tên quầy cho nhiều quầy / nhiều xã (VD: khi đưa 1 xã mới vào dùng, ~20 quầy).
+# Mỗi quầy là 1 việc trên pool thread giới hạn (TTS_WORKERS), lỗi thì thử lại với thời gian chờ tăng dần;
+# ghi DB theo từng quầy trong 1 transaction (xoá bản cũ + ghi bản mới), xong thì báo clip_bank bỏ bản cũ.
+#
+# API: POST /tts/counter_audio_jobs, GET /tts/counter_audio_jobs/{job_id}
+# Chạy tay: python -m app.background.counter_audio_jobs <slug> [<slug> ...]
+import os
+import sys
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy.orm import Session
+from app import database, models, crud
+from app.utils.tts_backend import tts_backend, counter_audio_text
+from app.utils.tts_clips import invalidate_counter_clip
+
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "4"))
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 1.0  # giây, nhân đôi sau mỗi lần lỗi
+KEEP_JOBS = 100      # số job giữ lại để tra trạng thái
+
+tts_executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+
+
+def store_counter_audio(db: Session, tenxa_id: int, counter_id: int, audio_bytes: bytes):
+    """Thay audio của quầy (xoá bản cũ + ghi bản mới) trong 1 transaction"""
+    db.query(models.TTSAudio).filter(
+        models.TTSAudio.tenxa_id == tenxa_id,
+        models.TTSAudio.counter_id == counter_id
+    ).delete(synchronize_session=False)
+    db.add(models.TTSAudio(
+        tenxa_id=tenxa_id,
+        counter_id=counter_id,
+        audio_data=audio_bytes,
+        created_at=datetime.utcnow()
+    ))
+    db.commit()
+    invalidate_counter_clip(tenxa_id, counter_id)
+
+
+@dataclass
+class CounterAudioItem:
+    tenxa_id: int
+    counter_id: int
+    name: str
+    status: str = "queued"  # queued | done | failed
+    attempts: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class CounterAudioJob:
+    id: str
+    items: List[CounterAudioItem]
+    backend: str = tts_backend.name  # backend đã dùng để tạo audio
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+    @property
+    def status(self) -> str:
+        if any(item.status == "queued" for item in self.items):
+            return "running"
+        return "failed" if any(item.status == "failed" for item in self.items) else "done"
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "backend": self.backend,
+            "total": len(self.items),
+            "done": sum(item.status == "done" for item in self.items),
+            "failed": [
+                {"tenxa_id": item.tenxa_id, "counter_id": item.counter_id, "attempts": item.attempts, "error": item.error}
+                for item in self.items if item.status == "failed"
+            ],
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def regenerate_item(item: CounterAudioItem, backend=None):
+    backend = backend or tts_backend
+    delay = RETRY_BACKOFF
+    while True:
+        item.attempts += 1
+        db = database.SessionLocal()
+        try:
+            audio_bytes = backend.synthesize(counter_audio_text(item.counter_id, item.name))
+            store_counter_audio(db, item.tenxa_id, item.counter_id, audio_bytes)
+            item.status, item.error = "done", None
+            return
+        except Exception as e:
+            db.rollback()
+            item.error = str(e)
+            if item.attempts >= MAX_ATTEMPTS:
+                item.status = "failed"
+                print(f"❌ Không tạo được audio quầy {item.counter_id} xã {item.tenxa_id}: {e}")
+                return
+            time.sleep(delay)
+            delay *= 2
+        finally:
+            db.close()
+
+
+class CounterAudioJobQueue:
+    def __init__(self, executor: ThreadPoolExecutor = tts_executor, backend=None):
+        self.executor = executor
+        self.backend = backend or tts_backend
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, CounterAudioJob]" = OrderedDict()
+
+    def submit(self, items: List[CounterAudioItem]) -> CounterAudioJob:
+        job = CounterAudioJob(id=uuid.uuid4().hex, items=items, backend=self.backend.name)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > KEEP_JOBS:
+                self._jobs.popitem(last=False)
+        if not items:
+            job.finished_at = datetime.utcnow()
+            return job
+
+        remaining = [len(items)]
+        lock = threading.Lock()
+
+        def on_done(_future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            # Việc cuối cùng của job vừa xong
+            job.finished_at = datetime.utcnow()
+            print(f"✅ Job audio quầy {job.id}: {job.to_dict()['done']}/{len(job.items)} quầy")
+
+        for item in items:
+            self.executor.submit(regenerate_item, item, self.backend).add_done_callback(on_done)
+        return job
+
+    def get(self, job_id: str) -> Optional[CounterAudioJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+counter_audio_jobs = CounterAudioJobQueue()
+
+
+def collect_items(db: Session, tenxa_ids: List[int], counter_ids: Optional[List[int]] = None) -> List[CounterAudioItem]:
+    """Các quầy cần tạo audio: mọi quầy của các xã, hoặc chỉ counter_ids trong các xã đó"""
+    query = db.query(models.Counter.tenxa_id, models.Counter.id, models.Counter.name).filter(
+        models.Counter.tenxa_id.in_(tenxa_ids)
+    )
+    if counter_ids is not None:
+        query = query.filter(models.Counter.id.in_(counter_ids))
+    rows = query.order_by(models.Counter.tenxa_id, models.Counter.id).all()
+    return [CounterAudioItem(tenxa_id=tenxa_id, counter_id=counter_id, name=name) for tenxa_id, counter_id, name in rows]
+
+
+if __name__ == "__main__":
+    db = database.SessionLocal()
+    try:
+        tenxa_ids = [crud.get_tenxa_id_from_slug(db, slug) for slug in sys.argv[1:]]
+        items = collect_items(db, [tenxa_id for tenxa_id in tenxa_ids if tenxa_id is not None])
+    finally:
+        db.close()
+    # Chờ 1 lần trên pool thay vì qua job queue (script không cần tra trạng thái)
+    wait([tts_executor.submit(regenerate_item, item) for item in items])
+    failed = [item for item in items if item.status == "failed"]
+    print(f"✅ Tạo audio {len(items) - len(failed)}/{len(items)} quầy")
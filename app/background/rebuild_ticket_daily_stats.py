@@ -0,0 +1,50 @@
+# app/background/rebuild_ticket_daily_stats.py
+# Tính lại bảng ticket_daily_stats từ tickets (dữ liệu lịch sử, hoặc khi nghi lệch số liệu).
+# Mỗi ngày 1 transaction: xoá các dòng của ngày rồi INSERT ... SELECT lại. Khoá bảng tổng hợp
+# trong transaction đó để trigger của vé đang ghi cùng ngày chờ, không bị cộng trùng / mất.
+#
+# Chạy tay: python -m app.background.rebuild_ticket_daily_stats [--start 2025-01-01] [--end 2025-12-31]
+# (chạy sau app.background.backfill_service_date, vé chưa có service_date không được tính)
+import argparse
+from datetime import date
+from typing import Optional
+from sqlalchemy import text
+from app.database import engine
+from app.utils.stats_cache import stats_cache
+from app.utils.ticket_daily_stats import REBUILD_SQL
+
+
+def rebuild_ticket_daily_stats(bind=engine, start: Optional[date] = None, end: Optional[date] = None) -> int:
+    start, end = start or date.min, end or date.max
+    with bind.connect() as conn:
+        # Ngày có vé, hoặc có dòng tổng hợp cũ (vé đã bị xoá hết) cần xoá đi
+        days = conn.execute(text(
+            "SELECT service_date FROM tickets WHERE service_date BETWEEN :start AND :end "
+            "UNION SELECT service_date FROM ticket_daily_stats WHERE service_date BETWEEN :start AND :end "
+            "ORDER BY 1"
+        ), {"start": start, "end": end}).scalars().all()
+    if not days:
+        print("✅ Không có ngày nào cần tính lại")
+        return 0
+
+    total = 0
+    for day in days:
+        with bind.begin() as conn:
+            conn.execute(text("LOCK TABLE ticket_daily_stats IN SHARE ROW EXCLUSIVE MODE"))
+            conn.execute(text("DELETE FROM ticket_daily_stats WHERE service_date = :day"), {"day": day})
+            rows = conn.execute(text(REBUILD_SQL), {"start": day, "end": day}).rowcount
+        total += rows
+        print(f"🛠️ ticket_daily_stats {day}: {rows} dòng")
+
+    # Số liệu ngày cũ đã đổi → bỏ cache thống kê (backend redis; memory chỉ mất khi restart worker)
+    stats_cache.clear()
+    print(f"✅ Xong, {total} dòng tổng hợp / {len(days)} ngày")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tính lại bảng ticket_daily_stats từ tickets")
+    parser.add_argument("--start", type=date.fromisoformat, default=None)
+    parser.add_argument("--end", type=date.fromisoformat, default=None)
+    args = parser.parse_args()
+    rebuild_ticket_daily_stats(start=args.start, end=args.end)
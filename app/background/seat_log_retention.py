@@ -0,0 +1,102 @@
+# app/background/seat_log_retention.py
+# Dọn bảng seat_logs (log thô mỗi lần thiết bị báo trạng thái ghế, kể cả khi không đổi).
+# Thống kê có mặt / vắng đã đọc seat_sessions nên log thô chỉ cần giữ một thời gian để tra cứu.
+#
+#   --backfill      gộp seat_logs cũ (trước khoảng seat_sessions đầu tiên của từng ghế) thành seat_sessions,
+#                   chạy 1 lần sau khi deploy, ngoài giờ làm việc
+#   --keep-days N   xoá seat_logs cũ hơn N ngày, theo lô để không khoá bảng lâu
+#
+# Chạy tay: python -m app.background.seat_log_retention [--backfill] [--keep-days 90]
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import text
+import pytz
+from app.database import engine
+
+vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
+
+KEEP_DAYS = 90
+BATCH_SIZE = 20000
+
+# Chỉ lấy các log đổi trạng thái (LAG khác trạng thái trước); khoảng cuối của lịch sử kết thúc ở
+# khoảng seat_sessions đầu tiên (cutoff) nếu có, không thì để mở (chính là trạng thái hiện tại).
+# Chạy lại không tạo trùng: lần sau cutoff của mỗi ghế đã là log cũ nhất.
+BACKFILL_SQL = text("""
+WITH first_session AS (
+    SELECT tenxa_id, seat_id, min(started_at) AS cutoff FROM seat_sessions GROUP BY tenxa_id, seat_id
+),
+logs AS (
+    SELECT
+        seat_logs.seat_id, seats.counter_id, seat_logs.tenxa_id, seat_logs.new_status, seat_logs.timestamp,
+        LAG(seat_logs.new_status) OVER (PARTITION BY seat_logs.tenxa_id, seat_logs.seat_id ORDER BY seat_logs.timestamp, seat_logs.id) AS prev_status
+    FROM seat_logs
+    -- id ghế chỉ duy nhất trong 1 xã
+    JOIN seats ON seats.id = seat_logs.seat_id AND seats.tenxa_id = seat_logs.tenxa_id
+    LEFT JOIN first_session
+        ON first_session.tenxa_id = seat_logs.tenxa_id AND first_session.seat_id = seat_logs.seat_id
+    WHERE seat_logs.new_status IS NOT NULL
+      AND (first_session.cutoff IS NULL OR seat_logs.timestamp < first_session.cutoff)
+),
+changes AS (
+    SELECT * FROM logs WHERE prev_status IS DISTINCT FROM new_status
+)
+INSERT INTO seat_sessions (seat_id, counter_id, occupied, started_at, ended_at, tenxa_id)
+SELECT
+    changes.seat_id, changes.counter_id, changes.new_status, changes.timestamp,
+    COALESCE(
+        LEAD(changes.timestamp) OVER (PARTITION BY changes.tenxa_id, changes.seat_id ORDER BY changes.timestamp),
+        first_session.cutoff
+    ),
+    changes.tenxa_id
+FROM changes
+LEFT JOIN first_session
+    ON first_session.tenxa_id = changes.tenxa_id AND first_session.seat_id = changes.seat_id
+""")
+
+PRUNE_SQL = text("""
+DELETE FROM seat_logs WHERE id IN (
+    SELECT id FROM seat_logs
+    WHERE timestamp < :before
+      -- chỉ xoá log đã được gộp vào seat_sessions (chưa chạy --backfill thì giữ lại)
+      AND EXISTS (
+          SELECT 1 FROM seat_sessions
+          WHERE seat_sessions.tenxa_id = seat_logs.tenxa_id
+            AND seat_sessions.seat_id = seat_logs.seat_id
+            AND seat_sessions.started_at <= seat_logs.timestamp
+      )
+    LIMIT :batch_size
+)
+""")
+
+
+def backfill_seat_sessions(bind=engine) -> int:
+    with bind.begin() as conn:
+        rows = conn.execute(BACKFILL_SQL).rowcount
+    print(f"✅ Gộp seat_logs cũ thành {rows} seat_sessions")
+    return rows
+
+
+def prune_seat_logs(bind=engine, keep_days: int = KEEP_DAYS, batch_size: int = BATCH_SIZE) -> int:
+    before = datetime.now(vn_tz) - timedelta(days=keep_days)
+    total = 0
+    while True:
+        with bind.begin() as conn:
+            deleted = conn.execute(PRUNE_SQL, {"before": before, "batch_size": batch_size}).rowcount
+        total += deleted
+        if deleted < batch_size:
+            break
+        print(f"🧹 seat_logs: đã xoá {total} dòng")
+    print(f"✅ Xoá {total} seat_logs trước {before:%Y-%m-%d %H:%M}")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gộp / dọn bảng seat_logs")
+    parser.add_argument("--backfill", action="store_true", help="gộp seat_logs cũ thành seat_sessions")
+    parser.add_argument("--keep-days", type=int, default=None, help="xoá seat_logs cũ hơn N ngày")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    if args.backfill:
+        backfill_seat_sessions()
+    if args.keep_days is not None:
+        prune_seat_logs(keep_days=args.keep_days, batch_size=args.batch_size)
@@ -10,22 +10,27 @@ from passlib.context import CryptContext
 #from redis_client import acquire_ticket_lock
 from fastapi import HTTPException
 from pytz import timezone
+from app.utils.tenant_cache import tenant_registry, TenantSettings
+from app.utils.queue_state import queue_state
+from app.utils.stats_cache import request_stats_invalidate
 
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 vn_tz = timezone("Asia/Ho_Chi_Minh")
 
 
+def get_tenant_settings(db: Session, tenxa_id: int) -> Optional[TenantSettings]:
+    return tenant_registry.get(db, tenxa_id)
+
 def get_feedback_timeout(db: Session, tenxa_id: int) -> int:
-    tenxa = db.query(models.Tenxa).filter(models.Tenxa.id == tenxa_id).first()
+    tenxa = tenant_registry.get(db, tenxa_id)
     return tenxa.feedback_timeout if tenxa and tenxa.feedback_timeout else 15
 
 
 def get_tenxa_id_from_slug(db: Session, slug: str) -> Optional[int]:
-    tenxa = db.query(models.Tenxa).filter(models.Tenxa.slug == slug).first()
-    return tenxa.id if tenxa else None
+    return tenant_registry.get_id(db, slug)
 
 def get_slug_from_tenxa_id(db: Session, tenxa_id: int) ->Optional[str]:
-    tenxa = db.query(models.Tenxa).filter(models.Tenxa.id == tenxa_id).first()
+    tenxa = tenant_registry.get(db, tenxa_id)
     return tenxa.slug if tenxa else None
 
 def get_counter_name_from_counter_id(db: Session, counter_id: int, tenxa_id: int) ->Optional[str]:
@@ -98,65 +103,80 @@ def create_ticket_old(db: Session, tenxa_id: int, ticket: schemas.TicketCreate)
     db.refresh(db_ticket)
     return db_ticket
 
-from datetime import datetime, time, timedelta
+from datetime import datetime, date, time, timedelta
 from pytz import timezone
+from sqlalchemy import func, update, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.utils.service_date import get_service_date, current_service_date
 
-def create_ticket(db: Session, tenxa_id: int, ticket: schemas.TicketCreate) -> models.Ticket:
-    now = datetime.now(timezone("Asia/Ho_Chi_Minh"))
+def get_ticket_reset_time(db: Session, tenxa_id: int) -> Optional[time]:
+    tenxa = tenant_registry.get(db, tenxa_id)
+    return tenxa.ticket_reset_time if tenxa else None
 
-    if tenxa_id == 300:
-        # Reset vé lúc 17:30 hôm nay
-        reset_time = datetime.combine(now.date(), time(17, 30, 0), tzinfo=timezone("Asia/Ho_Chi_Minh"))
-
-        if now < reset_time:
-            # Nếu chưa đến 17:30, thì lấy mốc reset từ hôm qua
-            start_of_range = reset_time - timedelta(days=1)
-            end_of_range = reset_time
-        else:
-            # Nếu sau 17:30, thì lấy từ 17:30 hôm nay đến 17:30 ngày mai
-            start_of_range = reset_time
-            end_of_range = reset_time + timedelta(days=1)
-    else:
-        # Xã khác: reset từ 00:00 đến 23:59 cùng ngày
-        today = now.date()
-        start_of_range = datetime.combine(today, time.min, tzinfo=timezone("Asia/Ho_Chi_Minh"))
-        end_of_range = datetime.combine(today, time.max, tzinfo=timezone("Asia/Ho_Chi_Minh"))
-
-    # Tìm vé mới nhất trong khoảng thời gian áp dụng
+def next_ticket_number(db: Session, tenxa_id: int, service_date: date) -> int:
+    """
+    Cấp số vé tiếp theo cho xã trong ngày nghiệp vụ.
+    Mốc reset của xã đã nằm trong service_date (get_service_date): qua mốc là sang bộ đếm của ngày mới.
+    Dòng bộ đếm bị khoá tới khi transaction commit nên 2 kiosk in cùng lúc không trùng số.
+    """
+    seq = models.TicketSequence.__table__
+
+    # Đã có bộ đếm của ngày → tăng và lấy số trong 1 câu lệnh
+    number = db.execute(
+        update(seq)
+        .where(seq.c.tenxa_id == tenxa_id, seq.c.service_date == service_date)
+        .values(last_number=seq.c.last_number + 1)
+        .returning(seq.c.last_number)
+    ).scalar()
+    if number is not None:
+        return number
+
+    # Vé đầu tiên của ngày: khởi tạo bộ đếm từ số lớn nhất đã in trong ngày
+    # (chỉ khác 0 khi vừa nâng cấp giữa ngày), trùng khoá thì tăng như bình thường
     latest = (
-        db.query(models.Ticket)
+        db.query(func.max(models.Ticket.number))
         .filter(models.Ticket.tenxa_id == tenxa_id)
-        .filter(models.Ticket.created_at >= start_of_range)
-        .filter(models.Ticket.created_at <= end_of_range)
-        .order_by(models.Ticket.number.desc())
-        .first()
+        .filter(models.Ticket.service_date == service_date)
+        .scalar()
     )
+    stmt = pg_insert(seq).values(tenxa_id=tenxa_id, service_date=service_date, last_number=(latest or 0) + 1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[seq.c.tenxa_id, seq.c.service_date],
+        set_={"last_number": seq.c.last_number + 1}
+    ).returning(seq.c.last_number)
+    return db.execute(stmt).scalar()
 
-    next_number = 1 if not latest else latest.number + 1
+def create_ticket(db: Session, tenxa_id: int, ticket: schemas.TicketCreate) -> models.Ticket:
+    now = datetime.now(vn_tz)
+
+    # Mốc reset cấu hình theo từng xã (Tenxa.ticket_reset_time), mặc định 00:00:
+    # vé in sau mốc thuộc ngày nghiệp vụ hôm sau → bộ đếm (tenxa_id, service_date) mới, đánh số lại từ 1
+    service_date = get_service_date(now, get_ticket_reset_time(db, tenxa_id))
+
+    # Lấy số và insert vé trong cùng 1 transaction
+    next_number = next_ticket_number(db, tenxa_id, service_date)
     #counter_name = get_counter_name_from_counter_id(db, ticket.counter_id, tenxa_id)
 
     db_ticket = models.Ticket(
         number=next_number,
         counter_id=ticket.counter_id,
-        tenxa_id=tenxa_id
+        tenxa_id=tenxa_id,
+        service_date=service_date
     )
     db.add(db_ticket)
     db.commit()
     db.refresh(db_ticket)
+    queue_state.record_tickets(tenxa_id, [db_ticket])
     return db_ticket
 
 def get_ticket(db: Session, tenxa_id: int, ticket_number: int):
     """
-    Lấy thông tin 1 ticket theo số vé (ticket_number) và xã (tenxa_id).
+    Lấy thông tin 1 ticket theo số vé (ticket_number) và xã (tenxa_id) trong ngày nghiệp vụ hiện tại.
     """
-    today = datetime.now(vn_tz).date()
-    start_of_day = datetime.combine(today, time.min, tzinfo=vn_tz)
-    end_of_day = datetime.combine(today, time.max, tzinfo=vn_tz)
     return (
         db.query(models.Ticket)
         .filter(
-            models.Ticket.created_at >= start_of_day,
-            models.Ticket.created_at <= end_of_day,
+            models.Ticket.service_date == current_service_date(db, tenxa_id),
             models.Ticket.tenxa_id == tenxa_id,
             models.Ticket.number == ticket_number
         )
@@ -164,16 +184,9 @@ def get_ticket(db: Session, tenxa_id: int, ticket_number: int):
     )
     
 def get_waiting_tickets(db: Session, tenxa_id: int, counter_id: Optional[int] = None):
-    #vn_tz = ZoneInfo("Asia/Ho_Chi_Minh")
-    today = datetime.now(vn_tz).date()
-
-    start_of_day = datetime.combine(today, time.min, tzinfo=vn_tz)
-    end_of_day = datetime.combine(today, time.max, tzinfo=vn_tz)
-
     query = db.query(models.Ticket).filter(
         models.Ticket.status == "waiting",
-        models.Ticket.created_at >= start_of_day,
-        models.Ticket.created_at <= end_of_day
+        models.Ticket.service_date == current_service_date(db, tenxa_id)
     ).filter(models.Ticket.tenxa_id == tenxa_id)
 
     if counter_id is not None:
@@ -182,16 +195,9 @@ def get_waiting_tickets(db: Session, tenxa_id: int, counter_id: Optional[int] =
     return query.order_by(models.Ticket.created_at.asc()).all()
 
 def get_called_tickets(db: Session, tenxa_id: int, counter_id: Optional[int] = None):
-    #vn_tz = ZoneInfo("Asia/Ho_Chi_Minh")
-    today = datetime.now(vn_tz).date()
-
-    start_of_day = datetime.combine(today, time.min, tzinfo=vn_tz)
-    end_of_day = datetime.combine(today, time.max, tzinfo=vn_tz)
-
     query = db.query(models.Ticket).filter(
         models.Ticket.status == "called",
-        models.Ticket.created_at >= start_of_day,
-        models.Ticket.created_at <= end_of_day
+        models.Ticket.service_date == current_service_date(db, tenxa_id)
     ).filter(models.Ticket.tenxa_id == tenxa_id)
 
     if counter_id is not None:
@@ -200,16 +206,9 @@ def get_called_tickets(db: Session, tenxa_id: int, counter_id: Optional[int] = N
     return query.order_by(models.Ticket.created_at.asc()).all()
 
 def get_done_tickets(db: Session, tenxa_id: int, counter_id: Optional[int] = None):
-    #vn_tz = ZoneInfo("Asia/Ho_Chi_Minh")
-    today = datetime.now(vn_tz).date()
-
-    start_of_day = datetime.combine(today, time.min, tzinfo=vn_tz)
-    end_of_day = datetime.combine(today, time.max, tzinfo=vn_tz)
-
     query = db.query(models.Ticket).filter(
         models.Ticket.status == "done",
-        models.Ticket.created_at >= start_of_day,
-        models.Ticket.created_at <= end_of_day
+        models.Ticket.service_date == current_service_date(db, tenxa_id)
     ).filter(models.Ticket.tenxa_id == tenxa_id)
 
     if counter_id is not None:
@@ -293,50 +292,64 @@ def get_procedures_with_counters(db: Session, tenxa_id: int, search: str = "") -
     results.sort(key=lambda x: x["score"], reverse=True)
     return results[:1]
 
+# Đóng vé đang gọi và nhận vé chờ tiếp theo của quầy trong 1 câu lệnh.
+# FOR UPDATE SKIP LOCKED: vé đang bị transaction khác giữ (chuyển quầy, gọi vé) sẽ bị bỏ qua thay vì chờ.
+# Trả về cả vé vừa gọi lẫn các vé vừa đóng (để cập nhật hàng chờ trong bộ nhớ).
+CALL_NEXT_SQL = text("""
+WITH active_counter AS (
+    SELECT 1 FROM counters
+    WHERE id = :counter_id AND tenxa_id = :tenxa_id AND status = 'active'
+),
+closed AS (
+    UPDATE tickets SET status = 'done', finished_at = :now
+    WHERE tenxa_id = :tenxa_id AND counter_id = :counter_id AND status = 'called'
+      AND EXISTS (SELECT 1 FROM active_counter)
+    RETURNING tickets.*
+),
+next_ticket AS (
+    SELECT id FROM tickets
+    WHERE tenxa_id = :tenxa_id AND counter_id = :counter_id AND status = 'waiting'
+      AND service_date = :service_date
+      AND EXISTS (SELECT 1 FROM active_counter)
+    ORDER BY created_at
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+),
+called AS (
+    UPDATE tickets SET status = 'called', called_at = :now
+    FROM next_ticket
+    WHERE tickets.id = next_ticket.id
+    RETURNING tickets.*
+)
+SELECT * FROM called
+UNION ALL
+SELECT * FROM closed
+""")
+
 def call_next_ticket(db: Session, tenxa_id: int, counter_id: int) -> Optional[Ticket]:
-    # Kiểm tra xem quầy có tồn tại không
+    """
+    Gọi vé tiếp theo cho quầy: đóng vé đang "called" và chuyển vé "waiting" sớm nhất sang "called"
+    trong cùng 1 transaction. Dùng chung cho gọi vé thủ công và auto-call.
+    """
     now = datetime.now(vn_tz)
-    today = now.date()
-    start_of_day = datetime.combine(today, time.min, tzinfo=vn_tz)
-    end_of_day = datetime.combine(today, time.max, tzinfo=vn_tz)
-    counter = db.query(Counter).filter(Counter.id == counter_id).filter(Counter.tenxa_id == tenxa_id).first()
-    if not counter:
-        return None
-    if counter.status != "active":
-        return None 
-    
-    current_ticket = (
-        db.query(Ticket)
-        .filter(Ticket.tenxa_id == tenxa_id)
-        .filter(Ticket.counter_id == counter_id)
-        .filter(Ticket.status == "called")
-        .order_by(Ticket.created_at)
-        .first()
-    )
-    if current_ticket:
-        current_ticket.status = "done"
-        current_ticket.finished_at = now
-        db.commit()
+    service_date = get_service_date(now, get_ticket_reset_time(db, tenxa_id))
+
+    # Khoá theo quầy tới hết transaction: 2 lần gọi cùng lúc trên 1 quầy (thủ công + auto-call,
+    # hoặc 2 worker) chạy lần lượt, lần sau thấy được kết quả của lần trước
+    db.execute(text("SELECT pg_advisory_xact_lock(:tenxa_id, :counter_id)"), {"tenxa_id": tenxa_id, "counter_id": counter_id})
 
-    # Lấy vé tiếp theo theo quầy đó (giả định: theo thứ tự created_at)
-    next_ticket = (
+    changed = (
         db.query(Ticket)
-        .filter(Ticket.tenxa_id == tenxa_id)
-        .filter(Ticket.counter_id == counter_id)
-        .filter(Ticket.status == "waiting")
-        .filter(Ticket.created_at >= start_of_day)
-        .filter(Ticket.created_at <= end_of_day)
-        .order_by(Ticket.created_at)
-        .first()
+        .from_statement(CALL_NEXT_SQL)
+        .params(tenxa_id=tenxa_id, counter_id=counter_id, now=now, service_date=service_date)
+        .all()
     )
-
-    if next_ticket:
-        next_ticket.status = "called"
-        next_ticket.called_at = now
-        db.commit()
-        return next_ticket
-
-    return None
+    # Tách khỏi session để commit không expire → không phải SELECT lại vé
+    for ticket in changed:
+        db.expunge(ticket)
+    db.commit()
+    queue_state.record_tickets(tenxa_id, changed)
+    return next((ticket for ticket in changed if ticket.status == "called"), None)
 
 def update_ticket_status_old(db: Session, tenxa_id: int, ticket_number: int, status_update: schemas.TicketUpdateStatus):
     ticket = db.query(models.Ticket).filter(models.Ticket.tenxa_id == tenxa_id).filter(models.Ticket.number == ticket_number).first()
@@ -346,6 +359,7 @@ def update_ticket_status_old(db: Session, tenxa_id: int, ticket_number: int, sta
     ticket.status = status_update.status
     db.commit()
     db.refresh(ticket)
+    queue_state.record_tickets(tenxa_id, [ticket])
     return ticket
 
 def update_ticket_status(
@@ -376,6 +390,7 @@ def update_ticket_status(
 
     db.commit()
     db.refresh(ticket)
+    queue_state.record_tickets(tenxa_id, [ticket])
     return ticket
 
 def pause_counter(db: Session, tenxa_id: int, counter_id: int, reason: str):
@@ -487,6 +502,7 @@ def upsert_footer(db: Session, tenxa_id: int, work_time: str, hotline: str, head
         footer = models.Footer(tenxa_id=tenxa_id, work_time=work_time, hotline=hotline, header=header, allowed_time_ranges=allowed_time_ranges)
         db.add(footer)
     db.commit()
+    tenant_registry.invalidate(tenxa_id)
     db.refresh(footer)
     return footer
 
@@ -497,16 +513,15 @@ def update_ticket_rating(
     rating_update: schemas.TicketRatingUpdate,
     timeout_minutes: int
 ):
-    today = datetime.now(vn_tz).date()
-    start_of_day = datetime.combine(today, time.min, tzinfo=vn_tz)
-    end_of_day = datetime.combine(today, time.max, tzinfo=vn_tz)
-    
+    # Vé vừa xong ngay trước mốc reset vẫn đánh giá được sau mốc → xét cả ngày nghiệp vụ trước, lấy vé mới nhất
+    service_date = current_service_date(db, tenxa_id)
     ticket = (
         db.query(models.Ticket)
         .filter(models.Ticket.tenxa_id == tenxa_id)
         .filter(models.Ticket.number == ticket_number)
-        .filter(Ticket.created_at >= start_of_day)
-        .filter(Ticket.created_at <= end_of_day)
+        .filter(Ticket.service_date >= service_date - timedelta(days=1))
+        .filter(Ticket.service_date <= service_date)
+        .order_by(Ticket.id.desc())
         .first()
     )
 
@@ -535,8 +550,112 @@ def update_ticket_rating(
 
     db.commit()
     db.refresh(ticket)
+    request_stats_invalidate(ticket.tenxa_id)
     return ticket
 
+def record_seat_session(db: Session, seat: models.Seat, occupied: bool, now: datetime):
+    """
+    Gộp trạng thái ghế vào seat_sessions (chưa commit, commit cùng SeatLog):
+    cùng trạng thái với khoảng đang mở thì giữ nguyên, khác thì đóng khoảng cũ và mở khoảng mới.
+    Gọi khi đang giữ khoá dòng ghế (SELECT ... FOR UPDATE) để không mở 2 khoảng cùng lúc.
+    """
+    current = (
+        db.query(models.SeatSession)
+        .filter(
+            models.SeatSession.tenxa_id == seat.tenxa_id,
+            models.SeatSession.seat_id == seat.id,
+            models.SeatSession.ended_at.is_(None),
+        )
+        .first()
+    )
+    if current is not None:
+        if current.occupied == occupied:
+            return current
+        current.ended_at = now
+
+    session = models.SeatSession(
+        seat_id=seat.id,
+        counter_id=seat.counter_id,
+        occupied=occupied,
+        started_at=now,
+        tenxa_id=seat.tenxa_id,
+    )
+    db.add(session)
+    # Đóng khoảng cũ trước khi thêm khoảng mới (index unique trên khoảng đang mở)
+    db.flush()
+    return session
+
+# Cập nhật trạng thái nhiều ghế trong 1 câu lệnh: chỉ ghi ghế thật sự đổi (IS DISTINCT FROM),
+# trả về cả ghế đổi lẫn ghế không đổi (để biết ghế nào tồn tại). {values} do apply_seat_states sinh ra.
+# prev: dòng ghế trước khi UPDATE (ghế đã bị khoá FOR UPDATE từ câu trước nên không đổi giữa chừng)
+# → old_status là giá trị thật, kể cả NULL, để ghi seat_logs.
+SEAT_BATCH_SQL = """
+WITH v (id, status) AS (VALUES {values}),
+changed AS (
+    UPDATE seats
+    SET status = v.status,
+        last_empty_time = CASE WHEN v.status = false AND seats.status = true THEN :now ELSE seats.last_empty_time END
+    FROM v JOIN seats AS prev ON prev.id = v.id
+    WHERE seats.tenxa_id = :tenxa_id AND seats.id = v.id AND prev.id = seats.id
+      AND seats.status IS DISTINCT FROM v.status
+    RETURNING seats.id, seats.counter_id, seats.type::text AS type, v.status, prev.status AS old_status, true AS changed
+)
+SELECT * FROM changed
+UNION ALL
+SELECT seats.id, seats.counter_id, seats.type::text, v.status, seats.status, false
+FROM seats JOIN v ON seats.id = v.id
+WHERE seats.tenxa_id = :tenxa_id AND seats.status IS NOT DISTINCT FROM v.status
+"""
+
+def apply_seat_states(db: Session, tenxa_id: int, states: dict, now: datetime) -> list:
+    """
+    Ghi trạng thái nhiều ghế {seat_id: status} (chưa commit). Ghế đổi trạng thái: UPDATE seats,
+    1 lệnh INSERT nhiều dòng seat_logs, đóng / mở seat_sessions.
+    Trả về các dòng (id, counter_id, type, status, old_status, changed).
+    """
+    if not states:
+        return []
+    # Khoá các ghế như PUT /seats/{id} (with_for_update), theo thứ tự id để 2 batch chồng nhau không deadlock:
+    # đóng / mở seat_sessions bên dưới luôn thấy khoảng đang mở mới nhất của ghế
+    db.query(models.Seat.id).filter(
+        models.Seat.tenxa_id == tenxa_id,
+        models.Seat.id.in_(list(states)),
+    ).order_by(models.Seat.id).with_for_update().all()
+    params = {"tenxa_id": tenxa_id, "now": now}
+    values = []
+    for i, (seat_id, status) in enumerate(states.items()):
+        values.append(f"(CAST(:id{i} AS INTEGER), CAST(:status{i} AS BOOLEAN))")
+        params[f"id{i}"], params[f"status{i}"] = seat_id, status
+    rows = db.execute(text(SEAT_BATCH_SQL.format(values=", ".join(values))), params).all()
+
+    changed = [row for row in rows if row.changed]
+    if changed:
+        db.execute(models.SeatLog.__table__.insert(), [
+            {"seat_id": row.id, "old_status": row.old_status, "new_status": row.status,
+             "timestamp": now, "tenxa_id": tenxa_id}
+            for row in changed
+        ])
+        # seat_sessions: đóng khoảng đang mở rồi mở khoảng mới cho các ghế vừa đổi
+        db.query(models.SeatSession).filter(
+            models.SeatSession.tenxa_id == tenxa_id,
+            models.SeatSession.seat_id.in_([row.id for row in changed]),
+            models.SeatSession.ended_at.is_(None),
+        ).update({models.SeatSession.ended_at: now}, synchronize_session=False)
+        sessions = models.SeatSession.__table__
+        db.execute(
+            # Phòng hờ: đã có khoảng đang mở (ux_seat_sessions_open) thì giữ, không làm hỏng cả batch
+            pg_insert(sessions).on_conflict_do_nothing(
+                index_elements=[sessions.c.tenxa_id, sessions.c.seat_id],
+                index_where=sessions.c.ended_at.is_(None),
+            ),
+            [
+                {"seat_id": row.id, "counter_id": row.counter_id, "occupied": row.status,
+                 "started_at": now, "tenxa_id": tenxa_id}
+                for row in changed
+            ],
+        )
+    return rows
+
 def update_tenxa_config(db: Session, tenxa_id: int, config_data: schemas.TenXaConfigUpdate):
     tenxa = db.query(models.Tenxa).filter(models.Tenxa.id == tenxa_id).first()
     if not tenxa:
@@ -544,6 +663,9 @@ def update_tenxa_config(db: Session, tenxa_id: int, config_data: schemas.TenXaCo
 
     tenxa.feedback_timeout = config_data.feedback_timeout
     tenxa.qr_rating = config_data.qr_rating
+    if config_data.auto_call is not None:
+        tenxa.auto_call = config_data.auto_call
     db.commit()
+    tenant_registry.invalidate(tenxa_id)
     db.refresh(tenxa)
     return tenxa
@@ -5,28 +5,46 @@ from contextlib import asynccontextmanager
 import asyncio
 from app.api.endpoints import procedures, tickets, seats, counters, users, realtime, text_to_speech, stats, footer, tv_groups, transfer_permission, dossiers
 from app.database import engine, Base, SessionLocal
+from app.migrations import run_migrations
 #from app.background.auto_call import check_and_call_next
 from app.models import Counter, Tenxa
-from app.utils.auto_call_loop import auto_call_loop_for_counter
+from app.utils.auto_call_loop import auto_call_scheduler
+from app.utils.realtime_bus import bus
+from app.utils.queue_state import queue_state, queue_state_reconciler
+from app.utils.seat_debounce import seat_debounce_sweeper
+from app.utils.tts_clips import clip_bank
 
 # ✅ Khởi tạo DB
 Base.metadata.create_all(bind=engine)
+run_migrations()
 
 # ✅ Khai báo lifespan thay cho on_event("startup")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Bus realtime (memory hoặc Redis pub/sub) phải chạy trước khi có sự kiện
+    await bus.start()
     db = SessionLocal()
     try:
-        # 🔍 Truy vấn tất cả counter_id từ database
-        counter_info = db.query(Counter.id, Counter.tenxa_id).join(Tenxa, Counter.tenxa_id == Tenxa.id).filter(Tenxa.auto_call == True).all()
+        # 📋 Hàng chờ hôm nay của mọi xã vào bộ nhớ
+        queue_state.hydrate_all(db)
+        # 🔍 1 scheduler cho mọi quầy của các xã bật auto_call
+        auto_call_scheduler.load(db)
     finally:
         db.close()
-    tasks = [asyncio.create_task(auto_call_loop_for_counter(counter_id, tenxa_id)) for counter_id, tenxa_id in counter_info]
+    auto_call_scheduler.start()
+    # 🔊 Clip prefix / số đọc vào bộ nhớ 1 lần
+    clip_bank.load()
+    # 🪑 Ghi các trạng thái ghế đã ổn định đủ thời gian debounce
+    seat_debounce_sweeper.start()
+    # 📋 Định kỳ so hàng chờ trong bộ nhớ với DB, xã lệch thì nạp lại
+    queue_state_reconciler.start()
 
     yield
 
-    for task in tasks:
-        task.cancel()
+    await queue_state_reconciler.stop()
+    await seat_debounce_sweeper.stop()
+    await auto_call_scheduler.stop()
+    await bus.stop()
 
 # ✅ Khởi tạo FastAPI với lifecycle
 app = FastAPI(lifespan=lifespan)
@@ -0,0 +1,157 @@
+# app/migrations.py
+# Nâng cấp schema cho DB đang chạy. Base.metadata.create_all chỉ tạo bảng mới,
+# không ALTER bảng cũ, nên các thay đổi cột/index được khai báo ở đây.
+#
+# Chạy tay: python -m app.migrations
+import re
+from datetime import date, datetime, timedelta
+from sqlalchemy import text
+from app.database import engine
+from app.utils.service_date import SERVICE_DATE_SQL, get_service_date, vn_tz
+from app.utils import ticket_daily_stats
+
+
+def _recent_params() -> dict:
+    """Các migration chỉ xử lý dữ liệu gần đây (phần cũ có job riêng): từ 2 ngày nghiệp vụ trước (giờ VN)"""
+    start = get_service_date(datetime.now(vn_tz)) - timedelta(days=2)
+    return {"start": start, "end": date.max}
+
+
+class Concurrently(list):
+    """
+    Migration chạy ngoài transaction (autocommit), dùng cho CREATE INDEX CONCURRENTLY trên bảng lớn:
+    index được dựng trong khi vẫn in / gọi vé bình thường, không khoá ghi bảng tới hết lúc dựng.
+    """
+
+# ✅ Danh sách migration theo thứ tự, mỗi version chỉ chạy 1 lần (lưu trong bảng schema_migrations).
+# Câu lệnh nên viết idempotent (IF NOT EXISTS) vì DB mới tạo bằng create_all đã có sẵn cột/index.
+MIGRATIONS = [
+    ("0001_ticket_reset_time", [
+        "ALTER TABLE tenxa ADD COLUMN IF NOT EXISTS ticket_reset_time TIME",
+        # Xã 300 trước đây reset số vé lúc 17:30 (hard-code trong crud.create_ticket)
+        "UPDATE tenxa SET ticket_reset_time = '17:30' WHERE id = 300 AND ticket_reset_time IS NULL",
+    ]),
+    ("0002_ticket_hot_query_indexes", Concurrently([
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tickets_tenxa_counter_status_created ON tickets (tenxa_id, counter_id, status, created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tickets_tenxa_created ON tickets (tenxa_id, created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tickets_tenxa_number_created ON tickets (tenxa_id, number, created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tickets_active_queue ON tickets (tenxa_id, counter_id, created_at) "
+        "WHERE status IN ('waiting', 'called')",
+        "ANALYZE tickets",
+    ])),
+    ("0003_ticket_service_date", [
+        "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS service_date DATE",
+        # Chỉ điền vé 2 ngày gần nhất ở đây (hàng chờ hôm nay cần ngay, dùng index created_at);
+        # dữ liệu cũ cho thống kê chạy: python -m app.background.backfill_service_date
+        "UPDATE tickets SET service_date = " + SERVICE_DATE_SQL + " FROM tenxa "
+        "WHERE tenxa.id = tickets.tenxa_id AND tickets.service_date IS NULL "
+        "AND tickets.created_at >= now() - interval '2 days'",
+    ]),
+    ("0003_ticket_service_date_indexes", Concurrently([
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tickets_tenxa_service_date ON tickets (tenxa_id, service_date)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tickets_service_date ON tickets (service_date)",
+    ])),
+    ("0004_ticket_daily_stats", [
+        "CREATE TABLE IF NOT EXISTS ticket_daily_stats ("
+        " tenxa_id INTEGER NOT NULL, counter_id INTEGER NOT NULL, service_date DATE NOT NULL,"
+        " total_tickets INTEGER NOT NULL DEFAULT 0, attended_tickets INTEGER NOT NULL DEFAULT 0,"
+        " handling_seconds DOUBLE PRECISION NOT NULL DEFAULT 0, waiting_tickets INTEGER NOT NULL DEFAULT 0,"
+        " waiting_seconds DOUBLE PRECISION NOT NULL DEFAULT 0, satisfied INTEGER NOT NULL DEFAULT 0,"
+        " neutral INTEGER NOT NULL DEFAULT 0, needs_improvement INTEGER NOT NULL DEFAULT 0,"
+        " PRIMARY KEY (tenxa_id, counter_id, service_date))",
+        "CREATE INDEX IF NOT EXISTS ix_ticket_daily_stats_service_date ON ticket_daily_stats (service_date)",
+        ticket_daily_stats.APPLY_FUNCTION_SQL,
+        ticket_daily_stats.TRIGGER_FUNCTION_SQL,
+        # CREATE TRIGGER khoá ghi bảng tickets tới hết migration → không sót vé giữa lúc tạo trigger và lúc tính
+        *ticket_daily_stats.CREATE_TRIGGER_SQL,
+        # Chỉ tính vài ngày gần nhất; lịch sử: python -m app.background.rebuild_ticket_daily_stats
+        ("DELETE FROM ticket_daily_stats WHERE service_date >= :start", _recent_params),
+        (ticket_daily_stats.REBUILD_SQL, _recent_params),
+    ]),
+    ("0005_seat_sessions", [
+        "CREATE TABLE IF NOT EXISTS seat_sessions ("
+        " id SERIAL PRIMARY KEY, seat_id INTEGER NOT NULL, counter_id INTEGER NOT NULL,"
+        " occupied BOOLEAN NOT NULL, started_at TIMESTAMPTZ NOT NULL, ended_at TIMESTAMPTZ,"
+        " tenxa_id INTEGER NOT NULL REFERENCES tenxa (id))",
+        "CREATE INDEX IF NOT EXISTS ix_seat_sessions_tenxa_started ON seat_sessions (tenxa_id, started_at)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_seat_sessions_open ON seat_sessions (tenxa_id, seat_id) WHERE ended_at IS NULL",
+        # Lịch sử từ seat_logs: python -m app.background.seat_log_retention --backfill
+    ]),
+    ("0006_seat_debounce", [
+        "ALTER TABLE seats ADD COLUMN IF NOT EXISTS debounce_seconds INTEGER",
+    ]),
+    ("0007_ticket_version", [
+        # Hằng số DEFAULT → PostgreSQL 11+ không ghi lại bảng
+        "ALTER TABLE tickets ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0",
+        "CREATE OR REPLACE FUNCTION tickets_bump_version() RETURNS trigger AS $$ "
+        "BEGIN NEW.version := OLD.version + 1; RETURN NEW; END; $$ LANGUAGE plpgsql",
+        "DROP TRIGGER IF EXISTS tickets_bump_version ON tickets",
+        "CREATE TRIGGER tickets_bump_version BEFORE UPDATE ON tickets "
+        "FOR EACH ROW EXECUTE PROCEDURE tickets_bump_version()",
+    ]),
+]
+
+# Khoá advisory để nhiều worker khởi động cùng lúc không chạy migration chồng nhau
+MIGRATION_LOCK_ID = 720_001
+
+_INDEX_NAME = re.compile(r"CREATE (?:UNIQUE )?INDEX CONCURRENTLY IF NOT EXISTS (\w+)")
+
+
+def _execute(conn, stmt):
+    # (sql, params) khi câu lệnh cần tham số; params là hàm khi phải tính lúc chạy (vd ngày hiện tại)
+    sql, params = stmt if isinstance(stmt, tuple) else (stmt, {})
+    if callable(params):
+        params = params()
+    conn.execute(text(sql), params)
+
+
+def _drop_invalid_indexes(conn, statements):
+    """CREATE INDEX CONCURRENTLY bị ngắt giữa chừng để lại index INVALID, IF NOT EXISTS sẽ bỏ qua → xoá để dựng lại"""
+    names = [m.group(1) for stmt in statements if (m := _INDEX_NAME.match(stmt if isinstance(stmt, str) else stmt[0]))]
+    if not names:
+        return
+    invalid = conn.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE NOT i.indisvalid AND c.relname = ANY(:names)"
+    ), {"names": names}).scalars().all()
+    for name in invalid:
+        print(f"🛠️ Xoá index dựng dở {name}")
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+def run_migrations(bind=engine):
+    # Khoá mức session (không phải xact): migration Concurrently chạy ngoài transaction.
+    # Kết nối giữ khoá để autocommit, không giữ snapshot mở làm CREATE INDEX CONCURRENTLY phải chờ.
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            with bind.begin() as conn:
+                conn.execute(text(
+                    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                    " version VARCHAR(100) PRIMARY KEY,"
+                    " applied_at TIMESTAMP NOT NULL DEFAULT now())"
+                ))
+                applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+            for version, statements in MIGRATIONS:
+                if version in applied:
+                    continue
+                print(f"🛠️ Chạy migration {version}")
+                if isinstance(statements, Concurrently):
+                    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                        _drop_invalid_indexes(conn, statements)
+                        for stmt in statements:
+                            _execute(conn, stmt)
+                        conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:v)"), {"v": version})
+                else:
+                    # Mỗi migration 1 transaction: lỗi giữa chừng thì không ghi version, lần sau chạy lại
+                    with bind.begin() as conn:
+                        for stmt in statements:
+                            _execute(conn, stmt)
+                        conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:v)"), {"v": version})
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+
+if __name__ == "__main__":
+    run_migrations()
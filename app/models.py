@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint, DateTime, func, Boolean, Text, Enum, ForeignKeyConstraint, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint, DateTime, func, Boolean, Text, Enum, ForeignKeyConstraint, JSON, Date, Time, Index, text, Float
 from sqlalchemy.orm import relationship
 from app.database import Base
 from sqlalchemy.dialects.postgresql import ARRAY
@@ -44,6 +44,11 @@ class Ticket(Base):
     feedback = Column(Text, nullable=True)
     rated_at = Column(DateTime, nullable=True)
     tenxa_id = Column(Integer, ForeignKey("tenxa.id"), nullable=False)
+    # Ngày nghiệp vụ (giờ VN + mốc reset của xã), gán lúc in vé — xem app/utils/service_date.py
+    service_date = Column(Date, nullable=True)
+    # Tăng 1 mỗi lần UPDATE (trigger tickets_bump_version, migration 0007) → hàng chờ trong bộ nhớ
+    # bỏ các bản chụp vé cũ hơn bản đang giữ (app/utils/queue_state.py)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     
     #__table_args__ = (
     #    ForeignKeyConstraint(
@@ -51,6 +56,20 @@ class Ticket(Base):
     #        ["counters.id", "counters.tenxa_id"]
     #    ),
     #)
+    # ✅ Index cho các truy vấn nóng: hàng chờ theo quầy, gọi vé, tra vé theo số, quầy rảnh.
+    # DB đang chạy được tạo index qua app/migrations.py (create_all không thêm index vào bảng cũ).
+    __table_args__ = (
+        Index("ix_tickets_tenxa_counter_status_created", "tenxa_id", "counter_id", "status", "created_at"),
+        Index("ix_tickets_tenxa_created", "tenxa_id", "created_at"),
+        Index("ix_tickets_tenxa_number_created", "tenxa_id", "number", "created_at"),
+        Index(
+            "ix_tickets_active_queue", "tenxa_id", "counter_id", "created_at",
+            postgresql_where=text("status IN ('waiting', 'called')")
+        ),
+        # Thống kê / hàng chờ lọc theo ngày nghiệp vụ
+        Index("ix_tickets_tenxa_service_date", "tenxa_id", "service_date"),
+        Index("ix_tickets_service_date", "service_date"),
+    )
     
 
     #counter = relationship("Counter", back_populates="tickets")
@@ -106,6 +125,25 @@ class SeatLog(Base):
 
     seat = relationship("Seat", back_populates="logs")
     tenxa = relationship("Tenxa")
+class SeatSession(Base):
+    __tablename__ = "seat_sessions"
+
+    # Khoảng thời gian ghế giữ nguyên 1 trạng thái (có người / trống), gộp từ các lần cập nhật ghế.
+    # ended_at = NULL: khoảng đang mở (trạng thái hiện tại). Thống kê có mặt / vắng đọc bảng này.
+    id = Column(Integer, primary_key=True, index=True)
+    seat_id = Column(Integer, nullable=False)  # seats.id (id ghế theo từng xã)
+    counter_id = Column(Integer, nullable=False)
+    occupied = Column(Boolean, nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    ended_at = Column(DateTime(timezone=True), nullable=True)
+    tenxa_id = Column(Integer, ForeignKey("tenxa.id"), nullable=False)
+
+    __table_args__ = (
+        Index("ix_seat_sessions_tenxa_started", "tenxa_id", "started_at"),
+        # Mỗi ghế chỉ có 1 khoảng đang mở
+        Index("ux_seat_sessions_open", "tenxa_id", "seat_id", unique=True, postgresql_where=text("ended_at IS NULL")),
+    )
+
 class Seat(Base):
     __tablename__ = "seats"
 
@@ -116,6 +154,7 @@ class Seat(Base):
     status = Column(Boolean, default=False)  # True = Có người, False = Trống
     last_empty_time = Column(DateTime, nullable=True)
     tenxa_id = Column(Integer, ForeignKey("tenxa.id"), nullable=False)
+    debounce_seconds = Column(Integer, nullable=True)  # None = theo SEAT_DEBOUNCE_SECONDS, 0 = tắt
 
     #counter = relationship("Counter", back_populates="seats")
     logs = relationship("SeatLog", back_populates="seat")
@@ -168,6 +207,36 @@ class Tenxa(Base):
     qr_rating = Column(Boolean, default=True, nullable=False)
     postfix = Column(String(50), nullable=False, default="default")
     password = Column(String(255), nullable=False, default="123456")
+    ticket_reset_time = Column(Time, nullable=True)  # mốc reset số vé trong ngày, None = 00:00
+
+class TicketSequence(Base):
+    __tablename__ = "ticket_sequences"
+
+    # Bộ đếm số vé theo xã và ngày nghiệp vụ, tăng bằng UPSERT ... RETURNING
+    tenxa_id = Column(Integer, ForeignKey("tenxa.id"), primary_key=True)
+    service_date = Column(Date, primary_key=True)
+    last_number = Column(Integer, nullable=False, default=0)
+
+class TicketDailyStat(Base):
+    __tablename__ = "ticket_daily_stats"
+
+    # Số liệu cộng dồn theo xã / quầy / ngày nghiệp vụ cho các API thống kê.
+    # Cập nhật bằng trigger trên bảng tickets (app/utils/ticket_daily_stats.py), không ghi tay từ code.
+    tenxa_id = Column(Integer, primary_key=True)
+    counter_id = Column(Integer, primary_key=True)
+    service_date = Column(Date, primary_key=True)
+    total_tickets = Column(Integer, nullable=False, server_default="0")
+    attended_tickets = Column(Integer, nullable=False, server_default="0")  # có called_at và finished_at
+    handling_seconds = Column(Float, nullable=False, server_default="0")    # tổng finished_at - called_at
+    waiting_tickets = Column(Integer, nullable=False, server_default="0")   # có called_at
+    waiting_seconds = Column(Float, nullable=False, server_default="0")     # tổng called_at - created_at
+    satisfied = Column(Integer, nullable=False, server_default="0")         # rating của vé đã done
+    neutral = Column(Integer, nullable=False, server_default="0")
+    needs_improvement = Column(Integer, nullable=False, server_default="0")
+
+    __table_args__ = (
+        Index("ix_ticket_daily_stats_service_date", "service_date"),
+    )
     
 from sqlalchemy import Column, Integer, LargeBinary, DateTime
 from sqlalchemy.sql import func
@@ -1,5 +1,6 @@
 import os
 import redis
+import redis.asyncio as aioredis
 from urllib.parse import urlparse
 
 #redis_url = os.getenv("REDIS_URL")
@@ -13,6 +14,15 @@ r = redis.Redis(
     decode_responses=True
 )
 
+# Client async dùng cho pub/sub realtime (app/utils/realtime_bus.py), cùng cấu hình với r
+ar = aioredis.Redis(
+    host=url.hostname,
+    port=url.port,
+    password=url.password,
+    ssl=url.scheme == "rediss",
+    decode_responses=True
+)
+
 def acquire_ticket_lock(tenxa_id: int, counter_id: int, cooldown: int = 2) -> bool:
     """
     Trả về True nếu lock thành công (nghĩa là cho phép tạo vé).
@@ -59,9 +59,13 @@ class SeatCreate(SeatBase):
 class SeatUpdate(BaseModel):
     status: bool
 
+class SeatDebounceUpdate(BaseModel):
+    debounce_seconds: Optional[int] = None  # None = theo cấu hình chung, 0 = tắt
+
 class Seat(SeatBase):
     id: int
     last_empty_time: Optional[datetime]
+    debounce_seconds: Optional[int] = None
 
     class Config:
         orm_mode = True
@@ -74,6 +78,20 @@ class SeatPublic(BaseModel):
 
     class Config:
         orm_mode = True
+
+class SeatBatchItem(BaseModel):
+    seat_id: int
+    status: bool
+
+class SeatBatchUpdate(BaseModel):
+    # Toàn bộ trạng thái ghế của 1 quầy / 1 phòng do thiết bị gửi lên
+    seats: List[SeatBatchItem]
+
+class SeatBatchResult(BaseModel):
+    received: int
+    changed: List[SeatPublic]
+    unknown_seat_ids: List[int] = []
+    pending_seat_ids: List[int] = []  # đang chờ ổn định (debounce), sẽ được ghi sau
 class CalledTicket(BaseModel):
     number: int
     counter_name: str
@@ -108,6 +126,10 @@ class CounterUpsertRequestTTS(BaseModel):
 
     class Config:
         orm_mode = True
+
+class CounterAudioJobCreate(BaseModel):
+    tenxa: List[str]                         # slug các xã cần tạo lại audio quầy
+    counter_ids: Optional[List[int]] = None  # None = mọi quầy của các xã trên
         
 class Role(str, Enum):
     admin = "admin"
@@ -197,10 +219,12 @@ class TvGroupResponse(TvGroupBase):
 class TenXaConfigUpdate(BaseModel):
     feedback_timeout: int
     qr_rating: bool
+    auto_call: Optional[bool] = None  # None = giữ nguyên
 
 class TenXaConfigResponse(BaseModel):
     feedback_timeout: int
     qr_rating: bool
+    auto_call: Optional[bool] = None
 
     class Config:
         orm_mode = True
@@ -0,0 +1,142 @@
+# app/utils/auto_call_cluster.py
+# Chia quầy auto-call cho nhiều worker uvicorn / instance:
+#   - mỗi worker heartbeat vào ZSET auto_call:workers, worker quá LEASE_TTL không heartbeat coi như chết
+#   - consistent hashing trên danh sách worker sống → quầy nào do worker nào phụ trách
+#   - quyền gọi vé thật sự là lease Redis theo quầy (SET NX PX + gia hạn), mỗi quầy chỉ 1 worker giữ
+# Worker chết thì lease hết hạn sau tối đa LEASE_TTL giây, worker mới phụ trách quầy tự nhận lại.
+# Bật bằng AUTO_CALL_CLUSTER=redis (cần REALTIME_BUS=redis để mọi worker nhận sự kiện auto-call).
+import os
+import time
+import uuid
+import bisect
+import socket
+import asyncio
+import hashlib
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+CounterKey = Tuple[int, int]  # (counter_id, tenxa_id)
+
+LEASE_TTL = 15           # giây, hạn lease quầy và hạn heartbeat của worker
+HEARTBEAT_INTERVAL = 5   # giây, phải nhỏ hơn LEASE_TTL nhiều lần
+VNODES = 64              # số điểm ảo / worker trên vòng hash, càng nhiều càng chia đều
+
+# Chỉ gia hạn / xoá lease nếu vẫn là của mình (so value = worker_id)
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[str], vnodes: int = VNODES):
+        self._points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self._hashes = [point[0] for point in self._points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._points)
+        return self._points[index][1]
+
+
+class AutoCallCluster:
+    WORKERS_KEY = "auto_call:workers"
+
+    def __init__(self, redis, worker_id: Optional[str] = None, lease_ttl: int = LEASE_TTL,
+                 heartbeat_interval: int = HEARTBEAT_INTERVAL):
+        self.redis = redis
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_ttl = lease_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self._owned: Dict[CounterKey, float] = {}  # quầy đang giữ lease → hạn lease (monotonic)
+        self._renew = redis.register_script(RENEW_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def lease_key(key: CounterKey) -> str:
+        return f"auto_call:lease:{key[1]}:{key[0]}"
+
+    def is_owner(self, key: CounterKey) -> bool:
+        """Worker này đang giữ lease còn hạn của quầy (tính theo đồng hồ local, không gọi Redis)"""
+        until = self._owned.get(key)
+        return until is not None and until > time.monotonic()
+
+    async def heartbeat(self, counters: Iterable[CounterKey]):
+        """1 nhịp: báo còn sống, tính lại vòng hash, nhận / gia hạn / nhả lease từng quầy"""
+        now = time.time()
+        await self.redis.zadd(self.WORKERS_KEY, {self.worker_id: now})
+        await self.redis.zremrangebyscore(self.WORKERS_KEY, "-inf", now - self.lease_ttl)
+        ring = HashRing(await self.redis.zrange(self.WORKERS_KEY, 0, -1))
+        ttl_ms = int(self.lease_ttl * 1000)
+
+        counters = set(counters)
+        for key in counters:
+            lease = self.lease_key(key)
+            if ring.owner(f"{key[1]}:{key[0]}") != self.worker_id:
+                if key in self._owned:
+                    # Vòng hash đổi (có worker mới) → nhả cho worker phụ trách mới
+                    await self._drop(key)
+                continue
+
+            started = time.monotonic()
+            ok = await self._renew(keys=[lease], args=[self.worker_id, ttl_ms]) \
+                or await self.redis.set(lease, self.worker_id, nx=True, px=ttl_ms)
+            if ok:
+                if key not in self._owned:
+                    print(f"👑 Worker {self.worker_id} nhận auto-call quầy {key[0]} xã {key[1]}")
+                self._owned[key] = started + self.lease_ttl
+            elif self._owned.pop(key, None) is not None:
+                print(f"⚠️ Worker {self.worker_id} mất lease quầy {key[0]} xã {key[1]}")
+
+        # Quầy đã bỏ khỏi auto-call
+        for key in [k for k in self._owned if k not in counters]:
+            await self._drop(key)
+
+    async def _drop(self, key: CounterKey):
+        self._owned.pop(key, None)
+        await self._release(keys=[self.lease_key(key)], args=[self.worker_id])
+
+    async def run(self, counters: Callable[[], List[CounterKey]]):
+        while True:
+            try:
+                await self.heartbeat(counters())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Không gia hạn được thì is_owner tự hết hạn theo LEASE_TTL, không gọi vé chồng
+                print(f"⚠️ Heartbeat auto-call lỗi: {e}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    def start(self, counters: Callable[[], List[CounterKey]]):
+        self._task = asyncio.create_task(self.run(counters))
+
+    async def stop(self):
+        """Nhả hết lease và rời cluster để worker khác nhận ngay, không phải chờ hết hạn"""
+        if self._task:
+            self._task.cancel()
+        try:
+            for key in list(self._owned):
+                await self._drop(key)
+            await self.redis.zrem(self.WORKERS_KEY, self.worker_id)
+        except Exception as e:
+            print(f"⚠️ Không nhả được lease auto-call: {e}")
+
+
+def create_cluster() -> Optional[AutoCallCluster]:
+    if os.getenv("AUTO_CALL_CLUSTER", "off") == "redis":
+        from app.redis_client import ar
+        return AutoCallCluster(ar)
+    return None
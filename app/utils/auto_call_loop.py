@@ -1,33 +1,198 @@
 import asyncio
+import heapq
+import os
 from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
 import pytz
+from starlette.concurrency import run_in_threadpool
 from app.background.auto_call import check_and_call_next_for_counter
+from app.database import SessionLocal
+from app.models import Counter, Tenxa
+from app.utils.auto_call_cluster import AutoCallCluster, create_cluster
+from app.utils.realtime_bus import bus
 
 vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
 
-# Dict lưu reset_event cho từng quầy
-reset_events: dict[int, asyncio.Event] = {}
+AUTO_CALL_INTERVAL = 60  # giây: quầy không có thay đổi trong khoảng này thì mới tự gọi vé
+# Số quầy được kiểm tra cùng lúc; nhiều quầy đến hạn 1 lúc thì phần còn lại xếp hàng
+AUTO_CALL_MAX_IN_FLIGHT = int(os.getenv("AUTO_CALL_MAX_IN_FLIGHT", "16"))
 
-async def auto_call_loop_for_counter(counter_id: int, tenxa_id: int):
-    #event = reset_events.setdefault(counter_id, tenxa_id, asyncio.Event())
-    event = reset_events.setdefault((counter_id, tenxa_id), asyncio.Event())
+CounterKey = Tuple[int, int]  # (counter_id, tenxa_id)
 
-    while True:
+
+class AutoCallScheduler:
+    """
+    1 task duy nhất cho mọi quầy auto-call, thay cho 1 vòng lặp 60s / quầy.
+    Mỗi quầy hoặc đang "chờ hạn" (có deadline trong heap), hoặc đang "nghỉ" (không có deadline):
+      - đến hạn → kiểm tra & gọi vé; gọi được thì hẹn lần tiếp, không thì nghỉ
+      - đang nghỉ chỉ được đánh thức bởi sự kiện (ghế thay đổi, vé mới, gọi vé, mở lại quầy)
+    Chạy nhiều worker (cluster != None): worker nào cũng giữ lịch của mọi quầy (sự kiện đến qua bus),
+    nhưng chỉ worker đang giữ lease của quầy mới thật sự kiểm tra & gọi vé.
+    """
+    def __init__(self, interval: int = AUTO_CALL_INTERVAL, max_in_flight: int = AUTO_CALL_MAX_IN_FLIGHT,
+                 cluster: Optional[AutoCallCluster] = None):
+        self.interval = interval
+        self.cluster = cluster
+        self._heap: List[Tuple[float, int, int]] = []
+        self._deadlines: Dict[CounterKey, float] = {}   # deadline hiện hành, entry khác trong heap là cũ
+        self._registered: Set[CounterKey] = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._in_flight: Set[CounterKey] = set()
+
+    # ---- đăng ký quầy ----
+    def register(self, counter_id: int, tenxa_id: int):
+        key = (counter_id, tenxa_id)
+        if key in self._registered:
+            return
+        self._registered.add(key)
+        self._schedule(key)
+        print(f"➕ Auto-call theo dõi quầy {counter_id} xã {tenxa_id}")
+
+    def unregister(self, counter_id: int, tenxa_id: int):
+        key = (counter_id, tenxa_id)
+        self._registered.discard(key)
+        self._deadlines.pop(key, None)  # entry trong heap bị bỏ qua khi tới lượt
+
+    def load(self, db):
+        """Nạp toàn bộ quầy của các xã bật auto_call (gọi trong lifespan, lúc event loop đã chạy)"""
+        for counter_id, tenxa_id in self._query_counters(db):
+            self.register(counter_id, tenxa_id)
+
+    async def sync_tenxa(self, tenxa_id: int):
+        """Đồng bộ lại danh sách quầy của 1 xã sau khi bật/tắt auto_call, thêm/xoá quầy"""
+        wanted = set(await run_in_threadpool(self._load_tenxa_counters, tenxa_id))
+        for key in [k for k in self._registered if k[1] == tenxa_id and k not in wanted]:
+            self.unregister(*key)
+            print(f"➖ Auto-call bỏ quầy {key[0]} xã {tenxa_id}")
+        for counter_id, _ in wanted:
+            self.register(counter_id, tenxa_id)
+
+    def _load_tenxa_counters(self, tenxa_id: int) -> List[CounterKey]:
+        db = SessionLocal()
         try:
-            # Chờ 60 giây hoặc bị reset
-            await asyncio.wait_for(event.wait(), timeout=60)
-            event.clear()
+            return self._query_counters(db, tenxa_id)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _query_counters(db, tenxa_id: Optional[int] = None) -> List[CounterKey]:
+        query = db.query(Counter.id, Counter.tenxa_id)\
+                  .join(Tenxa, Counter.tenxa_id == Tenxa.id)\
+                  .filter(Tenxa.auto_call == True)
+        if tenxa_id is not None:
+            query = query.filter(Counter.tenxa_id == tenxa_id)
+        return [(counter_id, tenxa_id) for counter_id, tenxa_id in query.all()]
+
+    # ---- sự kiện ----
+    def reset(self, counter_id: int, tenxa_id: int):
+        """Trạng thái quầy vừa đổi (khách rời ghế, vừa gọi vé): đếm lại từ đầu"""
+        key = (counter_id, tenxa_id)
+        if key in self._registered:
+            self._schedule(key)
+
+    def wake(self, counter_id: int, tenxa_id: int):
+        """Có việc mới cho quầy (vé mới, cán bộ vào ghế): quầy đang nghỉ thì hẹn kiểm tra, đang chờ hạn thì giữ nguyên"""
+        key = (counter_id, tenxa_id)
+        if key in self._registered and key not in self._deadlines:
+            self._schedule(key)
+
+    def _schedule(self, key: CounterKey):
+        deadline = asyncio.get_running_loop().time() + self.interval
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key[0], key[1]))
+        self._wakeup.set()
+
+    # ---- vòng lặp ----
+    def start(self):
+        if self.cluster:
+            self.cluster.start(lambda: list(self._registered))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self.cluster:
+            await self.cluster.stop()
 
-            # Nếu là reset thủ công → không làm gì, chỉ reset thời gian
-            continue  # bỏ qua gọi check lần này
+    def _pop_stale(self):
+        while self._heap:
+            deadline, counter_id, tenxa_id = self._heap[0]
+            if self._deadlines.get((counter_id, tenxa_id)) == deadline:
+                return
+            heapq.heappop(self._heap)
 
-        except asyncio.TimeoutError:
-            # Timeout bình thường sau 60s → mới gọi check
-            try:
-                print(f"⏱️ [Quầy {counter_id}] xã {tenxa_id} Auto-call tick lúc {datetime.now(vn_tz).strftime('%Y-%m-%d %H:%M:%S')}")
-                await check_and_call_next_for_counter(counter_id, tenxa_id)
-            except Exception as e:
-                print(f"[auto_call_loop {counter_id}] Lỗi khi gọi: {e}")
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            self._pop_stale()
+            timeout = self._heap[0][0] - loop.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
 
+            _, counter_id, tenxa_id = heapq.heappop(self._heap)
+            key = (counter_id, tenxa_id)
+            del self._deadlines[key]
+            if key in self._in_flight:
+                # Lần kiểm tra trước của quầy chưa xong → hẹn lại, không chạy chồng
+                self._schedule(key)
+                continue
+            if self.cluster and not self.cluster.is_owner(key):
+                # Quầy do worker khác giữ lease: chỉ giữ lịch, worker đó chết thì mình nhận tiếp
+                self._schedule(key)
+                continue
+            # Hết slot thì chờ ở đây: các quầy đến hạn sau xếp hàng trong heap
+            await self._slots.acquire()
+            self._in_flight.add(key)
+            asyncio.create_task(self._evaluate(key))
+
+    async def _evaluate(self, key: CounterKey):
+        counter_id, tenxa_id = key
+        try:
+            print(f"⏱️ [Quầy {counter_id}] xã {tenxa_id} Auto-call tick lúc {datetime.now(vn_tz).strftime('%Y-%m-%d %H:%M:%S')}")
+            keep_going = await check_and_call_next_for_counter(counter_id, tenxa_id)
         except Exception as e:
-            print(f"[auto_call_loop {counter_id}] Lỗi khác: {e}")
+            print(f"[auto_call {counter_id}] Lỗi khi gọi: {e}")
+            keep_going = True
+        finally:
+            self._in_flight.discard(key)
+            self._slots.release()
+        # Trong lúc kiểm tra có thể đã có sự kiện hẹn lại quầy → không ghi đè
+        if keep_going and key in self._registered and key not in self._deadlines:
+            self._schedule(key)
+
+
+auto_call_scheduler = AutoCallScheduler(cluster=create_cluster())
+
+
+# Các yêu cầu đi qua bus để worker đang giữ scheduler cũng nhận được
+async def request_auto_call_reset(counter_id: int, tenxa_id: int):
+    """Yêu cầu reset bộ đếm auto-call của quầy (khách rời ghế, vừa gọi vé, mở lại quầy)"""
+    await bus.publish("auto_call_reset", {"counter_id": counter_id, "tenxa_id": tenxa_id})
+
+async def request_auto_call_wake(counter_id: int, tenxa_id: int):
+    """Báo quầy có việc mới (vé mới / vé chuyển tới, cán bộ vào ghế)"""
+    await bus.publish("auto_call_wake", {"counter_id": counter_id, "tenxa_id": tenxa_id})
+
+async def request_auto_call_sync(tenxa_id: int):
+    """Báo danh sách quầy auto-call của xã đã đổi (bật/tắt auto_call, thêm/xoá quầy)"""
+    await bus.publish("auto_call_sync", {"tenxa_id": tenxa_id})
+
+async def on_auto_call_reset(payload: dict):
+    auto_call_scheduler.reset(payload["counter_id"], payload["tenxa_id"])
+
+async def on_auto_call_wake(payload: dict):
+    auto_call_scheduler.wake(payload["counter_id"], payload["tenxa_id"])
+
+async def on_auto_call_sync(payload: dict):
+    await auto_call_scheduler.sync_tenxa(payload["tenxa_id"])
+
+bus.subscribe("auto_call_reset", on_auto_call_reset)
+bus.subscribe("auto_call_wake", on_auto_call_wake)
+bus.subscribe("auto_call_sync", on_auto_call_sync)
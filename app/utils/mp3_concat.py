@@ -0,0 +1,102 @@
+# app/utils/mp3_concat.py
+# Ghép nhiều file MP3 ngay trong bộ nhớ (thay cho ffmpeg -f concat -c copy):
+#   - bỏ tag ID3v2 đầu file, ID3v1 / APE cuối file
+#   - đọc header từng frame để cắt đúng ranh giới frame, bỏ rác giữa các frame
+#   - bỏ frame Xing/Info/VBRI (frame thông tin VBR, số frame/độ dài trong đó sai khi ghép)
+# Các đoạn nối tiếp nhau frame-by-frame, không giải mã lại, không subprocess, không ghi file.
+from typing import Iterable, Optional
+
+# kbps theo [version][layer][index]; version: 1 = MPEG1, 2 = MPEG2 / 2.5
+BITRATES = {
+    1: {
+        1: (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        2: (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    },
+    2: {
+        1: (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        3: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    },
+}
+SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG1
+    2: (22050, 24000, 16000),  # MPEG2
+    0: (11025, 12000, 8000),   # MPEG2.5
+}
+
+
+def frame_length(header: bytes) -> Optional[int]:
+    """Độ dài frame (byte) từ 4 byte header, None nếu không phải header MP3 hợp lệ"""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version_bits = (header[1] >> 3) & 0x03
+    layer_bits = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None  # version/layer dự trữ, bitrate "free" hoặc lỗi
+
+    layer = 4 - layer_bits
+    bitrate = BITRATES[1 if version_bits == 3 else 2][layer][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version_bits][rate_index]
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4
+    if layer == 3 and version_bits != 3:
+        return 72 * bitrate // sample_rate + padding  # MPEG2/2.5 layer III: 576 mẫu / frame
+    return 144 * bitrate // sample_rate + padding
+
+
+def _is_vbr_info_frame(frame: bytes) -> bool:
+    # "Xing"/"Info" nằm sau side info (vị trí tuỳ version / mono-stereo), "VBRI" cố định ở byte 36
+    mpeg1 = (frame[1] >> 3) & 0x03 == 3
+    mono = (frame[3] >> 6) == 3
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    tag = frame[4 + side_info: 8 + side_info]
+    return tag in (b"Xing", b"Info") or frame[36:40] == b"VBRI"
+
+
+def _audio_range(data: bytes):
+    """(start, end) của phần audio sau khi bỏ tag ID3v2 đầu file và ID3v1 / APE cuối file"""
+    start, end = 0, len(data)
+    while data[start:start + 3] == b"ID3" and end - start >= 10:
+        size = ((data[start + 6] & 0x7F) << 21) | ((data[start + 7] & 0x7F) << 14) \
+            | ((data[start + 8] & 0x7F) << 7) | (data[start + 9] & 0x7F)
+        footer = 10 if data[start + 5] & 0x10 else 0
+        start += 10 + size + footer
+    if end - start >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    if end - start >= 32 and data[end - 32:end - 24] == b"APETAGEX":
+        ape_size = int.from_bytes(data[end - 20:end - 16], "little")
+        end -= ape_size + (32 if data[end - 9] & 0x80 else 0)  # + header nếu có
+    return start, max(start, end)
+
+
+def iter_frames(data: bytes):
+    """Các frame audio (memoryview) của 1 file MP3, bỏ tag và frame thông tin VBR"""
+    view = memoryview(data)
+    pos, end = _audio_range(data)
+    first = True
+    while pos + 4 <= end:
+        length = frame_length(data[pos:pos + 4])
+        if length is None or pos + length > end:
+            # Rác / frame cụt: dò tới byte sync tiếp theo
+            pos = data.find(b"\xff", pos + 1, end)
+            if pos < 0:
+                break
+            continue
+        frame = view[pos:pos + length]
+        if not (first and _is_vbr_info_frame(data[pos:pos + 40])):
+            yield frame
+        first = False
+        pos += length
+
+
+def concat_mp3(clips: Iterable[bytes]) -> bytes:
+    """Ghép các đoạn MP3 thành 1 file MP3 (bytes)"""
+    out = bytearray()
+    for clip in clips:
+        for frame in iter_frames(clip):
+            out += frame
+    return bytes(out)
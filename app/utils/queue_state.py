@@ -0,0 +1,334 @@
+# app/utils/queue_state.py
+# Trạng thái hàng chờ của ngày nghiệp vụ hiện tại (tickets.service_date) của từng xã, giữ trong bộ nhớ process:
+#   quầy → vé đang chờ (theo created_at), vé đang gọi, vé đã xong.
+# Các API TV poll liên tục (/tickets/waiting, /called, /done, quầy rảnh, độ dài hàng chờ)
+# đọc thẳng từ đây thay vì quét bảng tickets mỗi lần.
+#
+# - Nạp từ DB lúc khởi động (hydrate_all) hoặc lần đầu đọc 1 xã / sang ngày mới
+# - Cập nhật sau commit ở các đường ghi (tạo vé, gọi vé, đổi trạng thái, chuyển quầy, xoá quầy),
+#   rồi phát qua bus "queue_state" để worker khác cùng cập nhật
+# - Mỗi bản chụp vé mang tickets.version (tăng mỗi lần UPDATE): 2 đường ghi chạy song song hoặc sự kiện
+#   bus đến lệch thứ tự thì bản cũ hơn bản đang giữ bị bỏ, không đè "called" lên "done"
+# - check_consistency so với DB, repair=True thì nạp lại; QueueStateReconciler chạy định kỳ
+import asyncio
+import bisect
+import os
+import threading
+import uuid
+from dataclasses import dataclass, asdict
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional, Iterable
+import pytz
+from sqlalchemy.orm import Session
+from app import database, models
+from app.utils.realtime_bus import bus
+from app.utils.service_date import current_service_date
+
+vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
+
+# Giây giữa 2 lần so hàng chờ trong bộ nhớ với DB và nạp lại xã bị lệch (0 = tắt)
+QUEUE_STATE_RECONCILE_SECONDS = int(os.getenv("QUEUE_STATE_RECONCILE_SECONDS", "300"))
+
+STATUSES = ("waiting", "called", "done")
+
+# Đánh dấu sự kiện do chính process này phát, để bỏ qua khi bus gửi ngược lại
+ORIGIN = uuid.uuid4().hex
+
+
+@dataclass
+class TicketView:
+    """Bản sao gọn của 1 vé (đủ trường cho schemas.Ticket)"""
+    id: int
+    number: int
+    counter_id: int
+    created_at: datetime
+    status: str
+    called_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    service_date: Optional[date] = None
+    version: int = 0
+
+    @classmethod
+    def from_ticket(cls, ticket) -> "TicketView":
+        return cls(
+            id=ticket.id,
+            number=ticket.number,
+            counter_id=ticket.counter_id,
+            created_at=ticket.created_at,
+            status=ticket.status,
+            called_at=ticket.called_at,
+            finished_at=ticket.finished_at,
+            service_date=ticket.service_date,
+            version=ticket.version or 0,
+        )
+
+    def to_payload(self) -> dict:
+        return {k: v.isoformat() if isinstance(v, (datetime, date)) else v for k, v in asdict(self).items()}
+
+    @classmethod
+    def from_payload(cls, data: dict) -> "TicketView":
+        data = dict(data)
+        for field in ("created_at", "called_at", "finished_at"):
+            if data.get(field):
+                data[field] = datetime.fromisoformat(data[field])
+        if data.get("service_date"):
+            data["service_date"] = date.fromisoformat(data["service_date"])
+        return cls(**data)
+
+
+def _order(view: TicketView):
+    return (view.created_at, view.id)
+
+
+class TenantQueue:
+    """Hàng chờ 1 ngày nghiệp vụ của 1 xã. Mỗi danh sách theo quầy luôn sắp theo created_at như query cũ."""
+    def __init__(self, day):
+        self.day = day
+        self.tickets: Dict[int, TicketView] = {}
+        self.by_status: Dict[str, Dict[int, List[TicketView]]] = {status: {} for status in STATUSES}
+
+    def upsert(self, view: TicketView):
+        old = self.tickets.get(view.id)
+        if old is not None and old.version > view.version:
+            return  # bản chụp cũ hơn bản đang giữ
+        self.remove(view.id)
+        if view.status not in STATUSES:
+            return
+        self.tickets[view.id] = view
+        bisect.insort(self.by_status[view.status].setdefault(view.counter_id, []), view, key=_order)
+
+    def remove(self, ticket_id: int):
+        old = self.tickets.pop(ticket_id, None)
+        if old is None:
+            return
+        queue = self.by_status[old.status].get(old.counter_id, [])
+        # Vé bị lấy ra hầu như luôn là vé đầu hàng (gọi vé) → thường là O(1)
+        for index, view in enumerate(queue):
+            if view.id == ticket_id:
+                del queue[index]
+                break
+        if not queue:
+            self.by_status[old.status].pop(old.counter_id, None)
+
+    def drop_counter(self, counter_id: int):
+        for view in [v for v in self.tickets.values() if v.counter_id == counter_id]:
+            self.remove(view.id)
+
+    def list(self, status: str, counter_id: Optional[int] = None) -> List[TicketView]:
+        queues = self.by_status[status]
+        if counter_id is not None:
+            return list(queues.get(counter_id, ()))
+        return sorted((view for queue in queues.values() for view in queue), key=_order)
+
+    def count(self, status: str, counter_id: int) -> int:
+        return len(self.by_status[status].get(counter_id, ()))
+
+    def busy_counter_ids(self) -> set:
+        return set(self.by_status["waiting"]) | set(self.by_status["called"])
+
+
+class QueueStateRegistry:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tenants: Dict[int, TenantQueue] = {}
+        # Xã đang nạp từ DB → các thay đổi đến trong lúc đó, áp lại sau khi nạp xong
+        self._pending: Dict[int, List[TicketView]] = {}
+
+    # ---- nạp từ DB ----
+    def hydrate_all(self, db: Session):
+        """Nạp hàng chờ hiện tại của mọi xã bằng 1 query (gọi lúc khởi động)"""
+        today = datetime.now(vn_tz).date()
+        # Xã có mốc reset đã qua mốc thì ngày nghiệp vụ là ngày mai
+        rows = self._query(db).filter(models.Ticket.service_date.between(today, today + timedelta(days=1))).all()
+        tenants: Dict[int, TenantQueue] = {}
+        for ticket in rows:
+            state = tenants.get(ticket.tenxa_id)
+            if state is None:
+                state = tenants[ticket.tenxa_id] = TenantQueue(current_service_date(db, ticket.tenxa_id))
+            if ticket.service_date == state.day:
+                state.upsert(TicketView.from_ticket(ticket))
+        with self._lock:
+            self._tenants = tenants
+        print(f"📋 Nạp hàng chờ hôm nay: {sum(len(t.tickets) for t in tenants.values())} vé / {len(tenants)} xã")
+
+    def hydrate(self, db: Session, tenxa_id: int) -> TenantQueue:
+        day = current_service_date(db, tenxa_id)
+        with self._lock:
+            self._pending.setdefault(tenxa_id, [])
+        try:
+            rows = self._query(db).filter(
+                models.Ticket.tenxa_id == tenxa_id,
+                models.Ticket.service_date == day,
+            ).all()
+            state = TenantQueue(day)
+            for ticket in rows:
+                state.upsert(TicketView.from_ticket(ticket))
+        finally:
+            with self._lock:
+                pending = self._pending.pop(tenxa_id, [])
+        with self._lock:
+            for view in pending:
+                if view.service_date == day:
+                    state.upsert(view)
+            self._tenants[tenxa_id] = state
+        return state
+
+    @staticmethod
+    def _query(db: Session):
+        return db.query(models.Ticket).filter(models.Ticket.status.in_(STATUSES))
+
+    def _tenant(self, db: Session, tenxa_id: int) -> TenantQueue:
+        with self._lock:
+            state = self._tenants.get(tenxa_id)
+        if state is None or state.day != current_service_date(db, tenxa_id):
+            state = self.hydrate(db, tenxa_id)
+        return state
+
+    # ---- đọc ----
+    def tickets(self, db: Session, tenxa_id: int, status: str, counter_id: Optional[int] = None) -> List[TicketView]:
+        state = self._tenant(db, tenxa_id)
+        with self._lock:
+            return state.list(status, counter_id)
+
+    def queue_length(self, db: Session, tenxa_id: int, counter_id: int) -> int:
+        state = self._tenant(db, tenxa_id)
+        with self._lock:
+            return state.count("waiting", counter_id)
+
+    def is_busy(self, db: Session, tenxa_id: int, counter_id: int) -> bool:
+        state = self._tenant(db, tenxa_id)
+        with self._lock:
+            return bool(state.count("waiting", counter_id) or state.count("called", counter_id))
+
+    def busy_counter_ids(self, db: Session, tenxa_id: int) -> set:
+        state = self._tenant(db, tenxa_id)
+        with self._lock:
+            return state.busy_counter_ids()
+
+    # ---- ghi ----
+    def apply(self, tenxa_id: int, views: Iterable[TicketView] = (), drop_counter: Optional[int] = None):
+        with self._lock:
+            if tenxa_id in self._pending:
+                self._pending[tenxa_id].extend(views)
+            state = self._tenants.get(tenxa_id)
+            # Xã chưa nạp thì thôi: lần đọc đầu sẽ nạp từ DB (đã có thay đổi này)
+            if state is None:
+                return
+            if drop_counter is not None:
+                state.drop_counter(drop_counter)
+            for view in views:
+                # Vé của ngày nghiệp vụ khác (sang ngày mới) → lần đọc tới sẽ nạp lại
+                if view.service_date == state.day:
+                    state.upsert(view)
+
+    def record_tickets(self, tenxa_id: int, tickets: Iterable):
+        """Gọi sau khi commit thay đổi vé (tạo, gọi, đổi trạng thái, chuyển quầy)"""
+        views = [TicketView.from_ticket(ticket) for ticket in tickets]
+        if not views:
+            return
+        self.apply(tenxa_id, views)
+        bus.publish_threadsafe("queue_state", {
+            "origin": ORIGIN,
+            "tenxa_id": tenxa_id,
+            "tickets": [view.to_payload() for view in views],
+        })
+
+    def record_counter_deleted(self, tenxa_id: int, counter_id: int):
+        self.apply(tenxa_id, drop_counter=counter_id)
+        bus.publish_threadsafe("queue_state", {"origin": ORIGIN, "tenxa_id": tenxa_id, "drop_counter": counter_id})
+
+    # ---- kiểm tra ----
+    def check_consistency(self, db: Session, tenxa_id: Optional[int] = None, repair: bool = False) -> List[dict]:
+        """
+        So trạng thái trong bộ nhớ với DB (ngày nghiệp vụ đang giữ của từng xã), trả về danh sách vé lệch.
+        repair=True: nạp lại các xã bị lệch từ DB.
+        Xã chưa nạp vào bộ nhớ thì bỏ qua (lần đọc tới sẽ nạp từ DB).
+        """
+        with self._lock:
+            tenant_ids = [tenxa_id] if tenxa_id is not None else list(self._tenants)
+            memory = {
+                tid: (self._tenants[tid].day, dict(self._tenants[tid].tickets))
+                for tid in tenant_ids if tid in self._tenants
+            }
+
+        diffs = []
+        for tid, (day, in_memory) in memory.items():
+            in_db = {
+                ticket.id: TicketView.from_ticket(ticket)
+                for ticket in self._query(db).filter(
+                    models.Ticket.tenxa_id == tid,
+                    models.Ticket.service_date == day,
+                )
+            }
+            for ticket_id in set(in_db) | set(in_memory):
+                a, b = in_memory.get(ticket_id), in_db.get(ticket_id)
+                if a and b and (a.status, a.counter_id, a.version) == (b.status, b.counter_id, b.version):
+                    continue
+                diffs.append({
+                    "tenxa_id": tid,
+                    "ticket_id": ticket_id,
+                    "number": (a or b).number,
+                    "memory": {"status": a.status, "counter_id": a.counter_id, "version": a.version} if a else None,
+                    "db": {"status": b.status, "counter_id": b.counter_id, "version": b.version} if b else None,
+                })
+
+        if repair:
+            for tid in {diff["tenxa_id"] for diff in diffs}:
+                print(f"🔧 Hàng chờ xã {tid} lệch DB, nạp lại")
+                self.hydrate(db, tid)
+        return diffs
+
+
+queue_state = QueueStateRegistry()
+
+
+def reconcile_queue_state() -> List[dict]:
+    """So mọi xã đang giữ trong bộ nhớ với DB và nạp lại xã bị lệch (chạy trong thread, có session DB riêng)"""
+    db = database.SessionLocal()
+    try:
+        return queue_state.check_consistency(db, repair=True)
+    finally:
+        db.close()
+
+
+class QueueStateReconciler:
+    """
+    Lưới an toàn cho hàng chờ trong bộ nhớ: sự kiện bus bị mất (Redis ngắt), ghi thẳng DB không qua
+    record_tickets... không phải đợi tới khi sang ngày mới mới được sửa.
+    """
+    def __init__(self, interval: int = QUEUE_STATE_RECONCILE_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                diffs = await loop.run_in_executor(None, reconcile_queue_state)
+                if diffs:
+                    print(f"🔧 Đối soát hàng chờ: {len(diffs)} vé lệch DB, đã nạp lại")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Lỗi đối soát hàng chờ: {e}")
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+
+queue_state_reconciler = QueueStateReconciler()
+
+
+async def on_queue_state(payload: dict):
+    if payload.get("origin") == ORIGIN:
+        return
+    views = [TicketView.from_payload(data) for data in payload.get("tickets", ())]
+    queue_state.apply(payload["tenxa_id"], views, drop_counter=payload.get("drop_counter"))
+
+bus.subscribe("queue_state", on_queue_state)
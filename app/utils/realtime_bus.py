@@ -0,0 +1,110 @@
+# app/utils/realtime_bus.py
+# Bus sự kiện realtime giữa các worker uvicorn.
+#   - InMemoryBus: 1 process (mặc định, chạy local / test)
+#   - RedisBus: publish lên Redis pub/sub, mọi worker subscribe và tự đẩy xuống WebSocket của mình
+# Chọn bằng biến môi trường REALTIME_BUS=memory|redis
+import os
+import json
+import asyncio
+from collections import defaultdict
+from typing import Callable, Awaitable, Dict, List, Optional
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class InMemoryBus:
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+        self._seq: Dict[str, int] = defaultdict(int)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def next_seq(self, key: str) -> Optional[int]:
+        """Số thứ tự tăng dần của sự kiện theo key (slug xã)"""
+        self._seq[key] += 1
+        return self._seq[key]
+
+    def subscribe(self, topic: str, handler: Handler):
+        self._handlers[topic].append(handler)
+
+    async def publish(self, topic: str, payload: dict):
+        await self._dispatch(topic, payload)
+
+    def publish_threadsafe(self, topic: str, payload: dict):
+        """Publish từ code đồng bộ (endpoint def trong threadpool, executor auto-call), không chờ kết quả"""
+        if self._loop is None:
+            return  # bus chưa start (script, migration...) → không có ai nghe
+        asyncio.run_coroutine_threadsafe(self.publish(topic, payload), self._loop)
+
+    async def _dispatch(self, topic: str, payload: dict):
+        for handler in self._handlers.get(topic, ()):
+            try:
+                await handler(payload)
+            except Exception as e:
+                print(f"⚠️ Lỗi xử lý sự kiện {topic}: {e}")
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        pass
+
+
+class RedisBus(InMemoryBus):
+    CHANNEL = "realtime:events"
+
+    def __init__(self, redis):
+        super().__init__()
+        self.redis = redis
+        self._task = None
+
+    async def next_seq(self, key: str) -> Optional[int]:
+        # Dùng chung bộ đếm trên Redis để mọi worker đánh số giống nhau
+        try:
+            return await self.redis.incr(f"realtime:seq:{key}")
+        except Exception as e:
+            print(f"⚠️ Không lấy được seq từ Redis: {e}")
+            return None
+
+    async def publish(self, topic: str, payload: dict):
+        message = json.dumps({"topic": topic, "payload": payload})
+        try:
+            await self.redis.publish(self.CHANNEL, message)
+        except Exception as e:
+            # Redis lỗi thì ít nhất client của worker này vẫn nhận được
+            print(f"⚠️ Không publish được lên Redis, gửi cục bộ: {e}")
+            await self._dispatch(topic, payload)
+
+    async def start(self):
+        await super().start()
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                await pubsub.subscribe(self.CHANNEL)
+                print(f"📡 Đã subscribe kênh {self.CHANNEL}")
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = json.loads(message["data"])
+                    await self._dispatch(data["topic"], data["payload"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Mất kết nối Redis pub/sub, thử lại sau 2s: {e}")
+                await asyncio.sleep(2)
+
+
+def create_bus():
+    if os.getenv("REALTIME_BUS", "memory") == "redis":
+        from app.redis_client import ar
+        return RedisBus(ar)
+    return InMemoryBus()
+
+
+bus = create_bus()
@@ -0,0 +1,191 @@
+# app/utils/seat_debounce.py
+# Lọc nhiễu trạng thái ghế (thiết bị báo có người / trống / có người trong vài giây).
+# Trạng thái mới chỉ được ghi (seat_logs, seat_sessions, reset auto-call...) khi giữ nguyên đủ
+# debounce_seconds; quay lại trạng thái cũ trước đó thì coi là 1 lần nhiễu bị chặn (đếm theo ghế).
+# Thiết bị chỉ báo khi đổi thì không có lần báo thứ 2 → sweeper tự ghi các trạng thái đã đủ thời gian.
+#
+# Số giây: seats.debounce_seconds của từng ghế, không đặt thì lấy SEAT_DEBOUNCE_SECONDS (mặc định 0 = tắt).
+import os
+import time
+import asyncio
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import pytz
+from sqlalchemy.orm import Session
+from app import database, models, crud
+from app.utils.seat_state import seat_state, record_seat_states
+
+vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
+
+SEAT_DEBOUNCE_SECONDS = int(os.getenv("SEAT_DEBOUNCE_SECONDS", "0"))
+SWEEP_INTERVAL = 1       # giây
+CONFIG_TTL = 60          # giây, cache debounce_seconds của các ghế trong 1 xã
+
+SeatKey = Tuple[int, int]  # (tenxa_id, seat_id)
+
+
+@dataclass
+class Candidate:
+    status: bool
+    since: float     # monotonic, lần đầu thấy trạng thái này
+    seconds: int
+
+
+class SeatDebouncer:
+    def __init__(self, default_seconds: int = SEAT_DEBOUNCE_SECONDS):
+        self.default_seconds = default_seconds
+        self._lock = threading.Lock()
+        self._pending: Dict[SeatKey, Candidate] = {}
+        self._config: Dict[int, Tuple[float, Dict[int, int]]] = {}
+        self.suppressed: Dict[SeatKey, int] = defaultdict(int)
+
+    # ---- cấu hình ----
+    def seconds(self, seat_seconds: Optional[int]) -> int:
+        return self.default_seconds if seat_seconds is None else seat_seconds
+
+    def seat_seconds(self, db: Session, tenxa_id: int) -> Dict[int, int]:
+        """debounce_seconds đã cấu hình riêng của các ghế trong xã (cache CONFIG_TTL giây)"""
+        entry = self._config.get(tenxa_id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        rows = db.query(models.Seat.id, models.Seat.debounce_seconds).filter(
+            models.Seat.tenxa_id == tenxa_id,
+            models.Seat.debounce_seconds.isnot(None),
+        ).all()
+        config = {seat_id: seconds for seat_id, seconds in rows}
+        self._config[tenxa_id] = (time.monotonic() + CONFIG_TTL, config)
+        return config
+
+    def invalidate_config(self, tenxa_id: int):
+        self._config.pop(tenxa_id, None)
+
+    # ---- trạng thái đang lưu ----
+    def committed_states(self, db: Session, tenxa_id: int, seat_ids) -> Dict[int, Optional[bool]]:
+        """
+        Trạng thái đang lưu của các ghế: lấy từ seat_state (không hết hạn), ghế chưa biết thì đọc DB 1 lần.
+        Ghế không tồn tại → None.
+        """
+        states = {seat_id: seat_state.committed(tenxa_id, seat_id) for seat_id in seat_ids}
+        unknown = [seat_id for seat_id, status in states.items() if status is None]
+        if unknown:
+            rows = db.query(models.Seat.id, models.Seat.status).filter(
+                models.Seat.tenxa_id == tenxa_id,
+                models.Seat.id.in_(unknown),
+            ).all()
+            loaded = {seat_id: bool(status) for seat_id, status in rows}
+            seat_state.set_many(tenxa_id, loaded)
+            states.update(loaded)
+        return states
+
+    # ---- lọc ----
+    def observe(self, tenxa_id: int, seat_id: int, committed: Optional[bool], status: bool, seconds: int) -> bool:
+        """
+        1 lần thiết bị báo trạng thái. committed: trạng thái đang lưu (None = chưa biết).
+        True = ghi ngay được (không đổi, không debounce, hoặc đã ổn định đủ lâu); False = đang chờ.
+        """
+        key = (tenxa_id, seat_id)
+        now = time.monotonic()
+        with self._lock:
+            candidate = self._pending.get(key)
+            if committed is not None and status == committed:
+                if candidate is not None:
+                    # Đổi rồi đổi lại trước khi đủ thời gian → nhiễu
+                    del self._pending[key]
+                    self.suppressed[key] += 1
+                return True
+            if seconds <= 0:
+                self._pending.pop(key, None)
+                return True
+            if candidate is None or candidate.status != status:
+                if candidate is not None:
+                    self.suppressed[key] += 1
+                self._pending[key] = Candidate(status, now, seconds)
+                return False
+            if now - candidate.since >= candidate.seconds:
+                del self._pending[key]
+                return True
+            return False
+
+    def due(self) -> List[Tuple[int, int, bool]]:
+        """Lấy ra các trạng thái đã chờ đủ thời gian (để sweeper ghi)"""
+        now = time.monotonic()
+        with self._lock:
+            keys = [key for key, c in self._pending.items() if now - c.since >= c.seconds]
+            return [(key[0], key[1], self._pending.pop(key).status) for key in keys]
+
+    def metrics(self, tenxa_id: int) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "default_seconds": self.default_seconds,
+                "suppressed_flaps": {seat_id: n for (tid, seat_id), n in self.suppressed.items() if tid == tenxa_id},
+                "pending": [
+                    {"seat_id": seat_id, "status": c.status, "stable_seconds": round(now - c.since, 1), "debounce_seconds": c.seconds}
+                    for (tid, seat_id), c in self._pending.items() if tid == tenxa_id
+                ],
+            }
+
+
+seat_debouncer = SeatDebouncer()
+
+
+def commit_seat_states(tenxa_id: int, states: Dict[int, bool]) -> list:
+    """Ghi trạng thái ghế đã ổn định (chạy trong thread, có session DB riêng). Trả về các ghế thật sự đổi."""
+    db = database.SessionLocal()
+    try:
+        rows = crud.apply_seat_states(db, tenxa_id, states, datetime.now(vn_tz))
+        db.commit()
+    finally:
+        db.close()
+    record_seat_states(tenxa_id, {row.id: row.status for row in rows})
+    return [row for row in rows if row.changed]
+
+
+class SeatDebounceSweeper:
+    def __init__(self, debouncer: SeatDebouncer, interval: float = SWEEP_INTERVAL):
+        self.debouncer = debouncer
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def sweep(self):
+        by_tenxa: Dict[int, Dict[int, bool]] = defaultdict(dict)
+        for tenxa_id, seat_id, status in self.debouncer.due():
+            by_tenxa[tenxa_id][seat_id] = status
+        loop = asyncio.get_running_loop()
+        for tenxa_id, states in by_tenxa.items():
+            changed = await loop.run_in_executor(None, commit_seat_states, tenxa_id, states)
+            await notify_auto_call(tenxa_id, changed)
+
+    async def run(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Lỗi ghi trạng thái ghế đã ổn định: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+
+seat_debounce_sweeper = SeatDebounceSweeper(seat_debouncer)
+
+
+async def notify_auto_call(tenxa_id: int, changed: list):
+    """Mỗi quầy chỉ báo auto-call 1 lần: ghế khách đổi → reset, ghế cán bộ đổi → wake"""
+    from app.utils.auto_call_loop import request_auto_call_reset, request_auto_call_wake
+    reset_counters = {row.counter_id for row in changed if row.type == "client"}
+    wake_counters = {row.counter_id for row in changed if row.type != "client"} - reset_counters
+    for counter_id in reset_counters:
+        await request_auto_call_reset(counter_id, tenxa_id)
+    for counter_id in wake_counters:
+        await request_auto_call_wake(counter_id, tenxa_id)
@@ -0,0 +1,79 @@
+# app/utils/seat_state.py
+# Trạng thái ghế (có người / trống) gần nhất đã biết, giữ trong bộ nhớ process.
+# POST /seats/batch so trạng thái thiết bị gửi lên với đây, ghế không đổi thì bỏ qua luôn (không đụng DB).
+# Mỗi lần ghế đổi trạng thái (batch hoặc PUT /seats/{id}) phát qua bus "seat_state" để worker khác
+# cập nhật theo; thêm TTL để lỡ có lệch (ghi từ nơi khác) thì tự hết sau ít giây.
+# Riêng trạng thái đã ghi gần nhất (committed) giữ không hết hạn cho bộ lọc nhiễu (app/utils/seat_debounce.py):
+# ghế đứng yên lâu hơn TTL vẫn biết trạng thái đang lưu, không bị coi là vừa đổi.
+import time
+import uuid
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from app.utils.realtime_bus import bus
+
+SEAT_STATE_TTL = 30  # giây
+
+ORIGIN = uuid.uuid4().hex
+
+
+class SeatStateCache:
+    def __init__(self, ttl: int = SEAT_STATE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._states: Dict[Tuple[int, int], Tuple[float, bool]] = {}
+        self._committed: Dict[Tuple[int, int], bool] = {}
+
+    def get(self, tenxa_id: int, seat_id: int) -> Optional[bool]:
+        with self._lock:
+            entry = self._states.get((tenxa_id, seat_id))
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def committed(self, tenxa_id: int, seat_id: int) -> Optional[bool]:
+        """Trạng thái đã ghi gần nhất mà process này biết (không hết hạn), None = chưa biết"""
+        with self._lock:
+            return self._committed.get((tenxa_id, seat_id))
+
+    def set_many(self, tenxa_id: int, states: Dict[int, bool]):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for seat_id, status in states.items():
+                self._states[(tenxa_id, seat_id)] = (expires, status)
+                self._committed[(tenxa_id, seat_id)] = status
+
+    def forget(self, tenxa_id: int, seat_ids: Iterable[int]):
+        with self._lock:
+            for seat_id in seat_ids:
+                self._states.pop((tenxa_id, seat_id), None)
+                self._committed.pop((tenxa_id, seat_id), None)
+
+    def changed(self, tenxa_id: int, states: Dict[int, bool]) -> Dict[int, bool]:
+        """Các ghế có trạng thái khác trạng thái đã biết (hoặc chưa biết)"""
+        return {
+            seat_id: status for seat_id, status in states.items()
+            if self.get(tenxa_id, seat_id) != status
+        }
+
+
+seat_state = SeatStateCache()
+
+
+def record_seat_states(tenxa_id: int, states: Dict[int, bool]):
+    """Gọi sau khi commit trạng thái ghế mới"""
+    if not states:
+        return
+    seat_state.set_many(tenxa_id, states)
+    bus.publish_threadsafe("seat_state", {
+        "origin": ORIGIN,
+        "tenxa_id": tenxa_id,
+        "seats": {str(seat_id): status for seat_id, status in states.items()},
+    })
+
+
+async def on_seat_state(payload: dict):
+    if payload.get("origin") == ORIGIN:
+        return
+    seat_state.set_many(payload["tenxa_id"], {int(k): v for k, v in payload["seats"].items()})
+
+bus.subscribe("seat_state", on_seat_state)
@@ -0,0 +1,40 @@
+# app/utils/service_date.py
+# Ngày nghiệp vụ (service_date) của vé: ngày theo giờ VN, có tính mốc reset số vé của từng xã.
+# Lưu sẵn vào cột tickets.service_date lúc in vé để thống kê / hàng chờ lọc bằng so sánh bằng
+# hoặc khoảng trên index (tenxa_id, service_date), không phải bọc created_at trong func.date().
+from datetime import datetime, date, time, timedelta
+from typing import Optional
+import pytz
+from sqlalchemy.orm import Session
+from app.utils.tenant_cache import tenant_registry
+
+vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
+
+
+def get_service_date(now: datetime, reset_time: Optional[time] = None) -> date:
+    """
+    Ngày nghiệp vụ của một thời điểm (giờ VN).
+    Nếu xã có mốc reset (vd 17:30) thì vé in sau mốc đó được tính sang ngày hôm sau.
+    """
+    now = now.astimezone(vn_tz)
+    if reset_time and now.time() >= reset_time:
+        return now.date() + timedelta(days=1)
+    return now.date()
+
+def current_service_date(db: Session, tenxa_id: int) -> date:
+    """Ngày nghiệp vụ hiện tại của xã (theo mốc reset cấu hình trong bảng tenxa)"""
+    tenxa = tenant_registry.get(db, tenxa_id)
+    return get_service_date(datetime.now(vn_tz), tenxa.ticket_reset_time if tenxa else None)
+
+
+# Cùng công thức cho SQL (migration, job backfill): đổi created_at sang giờ VN (cột là timestamptz;
+# nếu là timestamp thường thì ::timestamptz hiểu theo TimeZone của session) rồi cộng 1 ngày nếu qua mốc reset.
+SERVICE_DATE_SQL = """
+(
+    (tickets.created_at::timestamptz AT TIME ZONE 'Asia/Ho_Chi_Minh')::date
+    + CASE WHEN tenxa.ticket_reset_time IS NOT NULL
+                AND (tickets.created_at::timestamptz AT TIME ZONE 'Asia/Ho_Chi_Minh')::time
+                    >= tenxa.ticket_reset_time
+           THEN 1 ELSE 0 END
+)
+"""
@@ -0,0 +1,170 @@
+# app/utils/stats_cache.py
+# Cache kết quả các API thống kê (app/api/endpoints/stats.py), key = endpoint + xã + khoảng ngày + bộ lọc.
+#   - Khoảng ngày đã qua hẳn (end < ngày "đã chốt"): số liệu không đổi nữa → cache lâu dài trong backend
+#     chính (LRU trong process, hoặc Redis dùng chung mọi worker)
+#   - Khoảng có chứa hôm nay: chỉ cache trong process, TTL ngắn, key kèm "thế hệ" của xã — mỗi sự kiện vé
+#     (bus "queue_state", đánh giá vé) tăng thế hệ nên lần đọc sau tính lại ngay
+# Chọn backend bằng STATS_CACHE=memory|redis|off (mặc định memory).
+import os
+import json
+import time
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+import pytz
+from app.utils.realtime_bus import bus
+
+vn_tz = pytz.timezone("Asia/Ho_Chi_Minh")
+
+STATS_CACHE_SIZE = int(os.getenv("STATS_CACHE_SIZE", "512"))      # số kết quả tối đa / process
+STATS_CACHE_LIVE_TTL = int(os.getenv("STATS_CACHE_LIVE_TTL", "30"))  # giây, kết quả có hôm nay
+STATS_CACHE_PAST_TTL = 30 * 24 * 3600  # giây, kết quả ngày cũ trên Redis (giới hạn bộ nhớ Redis)
+# Vé vừa xong lúc gần nửa đêm vẫn được đánh giá sau 0h → coi ngày hôm qua là "đã chốt" sau mốc này
+SETTLE_DELAY = timedelta(hours=1)
+
+
+class LRUBackend:
+    def __init__(self, size: int = STATS_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl if ttl else None, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class RedisBackend:
+    PREFIX = "stats_cache:"
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self.redis.get(self.PREFIX + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        self.redis.set(self.PREFIX + key, json.dumps(value, default=str), ex=ttl or STATS_CACHE_PAST_TTL)
+
+    def clear(self):
+        for key in self.redis.scan_iter(self.PREFIX + "*"):
+            self.redis.delete(key)
+
+
+class StatsCache:
+    def __init__(self, backend=None, live_ttl: int = STATS_CACHE_LIVE_TTL):
+        self.backend = backend          # None = tắt cache
+        self.live = LRUBackend()        # kết quả có hôm nay, luôn trong process
+        self.live_ttl = live_ttl
+        self._generations: Dict[Optional[int], int] = defaultdict(int)
+        self.metrics: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0, "errors": 0})
+
+    @staticmethod
+    def settled_before() -> date:
+        """Ngày nhỏ hơn mốc này coi như đã chốt số liệu"""
+        return (datetime.now(vn_tz) - SETTLE_DELAY).date()
+
+    def invalidate(self, tenxa_id: Optional[int] = None):
+        """Tăng thế hệ của xã (và của thống kê toàn tỉnh) → kết quả 'hôm nay' cũ không được dùng nữa"""
+        if tenxa_id is not None:
+            self._generations[tenxa_id] += 1
+        self._generations[None] += 1
+
+    def clear(self):
+        """Xoá hết (sau khi rebuild/backfill dữ liệu cũ). Backend memory chỉ xoá được trong process hiện tại."""
+        self.live.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def get_or_compute(self, endpoint: str, tenxa_id: Optional[int], start: date, end: date,
+                       filters: dict, compute: Callable[[], Any], dump: Callable[[Any], Any],
+                       load: Callable[[Any], Any]):
+        """
+        compute(): tính kết quả khi miss. dump/load: đổi kết quả sang dạng lưu được (JSON) và ngược lại.
+        """
+        if self.backend is None:
+            return compute()
+
+        base = f"{endpoint}:{tenxa_id}:{start}:{end}:{json.dumps(filters, sort_keys=True, default=str)}"
+        if end < self.settled_before():
+            backend, key, ttl = self.backend, base, None
+        else:
+            backend, key, ttl = self.live, f"{base}:g{self._generations[tenxa_id]}", self.live_ttl
+
+        metrics = self.metrics[endpoint]
+        try:
+            cached = backend.get(key)
+        except Exception as e:
+            print(f"⚠️ Không đọc được cache thống kê: {e}")
+            metrics["errors"] += 1
+            cached = None
+        if cached is not None:
+            metrics["hits"] += 1
+            return load(cached)
+
+        metrics["misses"] += 1
+        result = compute()
+        try:
+            backend.set(key, dump(result), ttl)
+        except Exception as e:
+            print(f"⚠️ Không ghi được cache thống kê: {e}")
+            metrics["errors"] += 1
+        return result
+
+    def snapshot_metrics(self) -> dict:
+        total_hits = sum(m["hits"] for m in self.metrics.values())
+        total_misses = sum(m["misses"] for m in self.metrics.values())
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else "off",
+            "hits": total_hits,
+            "misses": total_misses,
+            "hit_ratio": round(total_hits / (total_hits + total_misses), 3) if total_hits + total_misses else None,
+            "endpoints": {name: dict(m) for name, m in self.metrics.items()},
+        }
+
+
+def create_stats_cache() -> StatsCache:
+    mode = os.getenv("STATS_CACHE", "memory")
+    if mode == "redis":
+        from app.redis_client import r
+        return StatsCache(RedisBackend(r))
+    if mode == "off":
+        return StatsCache(None)
+    return StatsCache(LRUBackend())
+
+
+stats_cache = create_stats_cache()
+
+
+def request_stats_invalidate(tenxa_id: int):
+    """Gọi sau khi ghi thay đổi vé không đi qua queue_state (vd đánh giá) → mọi worker bỏ kết quả 'hôm nay'"""
+    bus.publish_threadsafe("stats_invalidate", {"tenxa_id": tenxa_id})
+
+
+async def on_ticket_event(payload: dict):
+    stats_cache.invalidate(payload.get("tenxa_id"))
+
+# Mọi thay đổi vé (tạo, gọi, xong, chuyển quầy, xoá quầy) đã được phát qua "queue_state"
+bus.subscribe("queue_state", on_ticket_event)
+bus.subscribe("stats_invalidate", on_ticket_event)
@@ -0,0 +1,104 @@
+# app/utils/tenant_cache.py
+# Cache trong process cho slug → tenxa_id và cấu hình của từng xã (bảng tenxa + footers).
+# Hầu như endpoint nào cũng tra slug, cache này bỏ được 1–3 query mỗi request.
+import threading
+import time as _time
+from dataclasses import dataclass
+from datetime import time
+from typing import Optional, Dict, Tuple
+from sqlalchemy.orm import Session
+from app import models
+
+TENANT_CACHE_TTL = 300  # giây, hết hạn thì đọc lại DB (worker khác sửa cấu hình cũng sẽ thấy)
+
+
+@dataclass(frozen=True)
+class TenantSettings:
+    id: int
+    slug: str
+    name: str
+    auto_call: bool
+    feedback_timeout: int
+    qr_rating: bool
+    postfix: str
+    password: str
+    ticket_reset_time: Optional[time]
+    # Từ bảng footers (has_footer=False nếu xã chưa cấu hình footer)
+    has_footer: bool
+    work_time: Optional[str]
+    hotline: Optional[str]
+    header: Optional[str]
+    allowed_time_ranges: Optional[list]  # chỉ đọc, không sửa trực tiếp
+
+
+class TenantRegistry:
+    def __init__(self, ttl: int = TENANT_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._by_id: Dict[int, Tuple[float, TenantSettings]] = {}
+        self._slug_to_id: Dict[str, Tuple[float, int]] = {}
+
+    def get_id(self, db: Session, slug: str) -> Optional[int]:
+        with self._lock:
+            entry = self._slug_to_id.get(slug)
+        if entry and entry[0] > _time.monotonic():
+            return entry[1]
+        settings = self._load(db, models.Tenxa.slug == slug)
+        return settings.id if settings else None
+
+    def get(self, db: Session, tenxa_id: int) -> Optional[TenantSettings]:
+        with self._lock:
+            entry = self._by_id.get(tenxa_id)
+        if entry and entry[0] > _time.monotonic():
+            return entry[1]
+        return self._load(db, models.Tenxa.id == tenxa_id)
+
+    def invalidate(self, tenxa_id: Optional[int] = None):
+        """
+        Xoá cache của 1 xã (gọi sau khi ghi cấu hình), hoặc toàn bộ nếu không truyền tenxa_id.
+        """
+        with self._lock:
+            if tenxa_id is None:
+                self._by_id.clear()
+                self._slug_to_id.clear()
+                return
+            entry = self._by_id.pop(tenxa_id, None)
+            if entry:
+                self._slug_to_id.pop(entry[1].slug, None)
+
+    def _load(self, db: Session, condition) -> Optional[TenantSettings]:
+        # Không cache slug không tồn tại để xã mới tạo dùng được ngay
+        row = (
+            db.query(models.Tenxa, models.Footer)
+            .outerjoin(models.Footer, models.Footer.tenxa_id == models.Tenxa.id)
+            .filter(condition)
+            .first()
+        )
+        if not row:
+            return None
+
+        tenxa, footer = row
+        settings = TenantSettings(
+            id=tenxa.id,
+            slug=tenxa.slug,
+            name=tenxa.name,
+            auto_call=bool(tenxa.auto_call),
+            feedback_timeout=tenxa.feedback_timeout,
+            qr_rating=tenxa.qr_rating,
+            postfix=tenxa.postfix,
+            password=tenxa.password,
+            ticket_reset_time=tenxa.ticket_reset_time,
+            has_footer=footer is not None,
+            work_time=footer.work_time if footer else None,
+            hotline=footer.hotline if footer else None,
+            header=footer.header if footer else None,
+            allowed_time_ranges=footer.allowed_time_ranges if footer else None,
+        )
+        expires_at = _time.monotonic() + self.ttl
+        with self._lock:
+            self._by_id[settings.id] = (expires_at, settings)
+            self._slug_to_id[settings.slug] = (expires_at, settings.id)
+        return settings
+
+
+tenant_registry = TenantRegistry()
@@ -0,0 +1,98 @@
+# app/utils/ticket_daily_stats.py
+# Bảng tổng hợp ticket_daily_stats (xã, quầy, service_date) cho các API thống kê theo quầy.
+# Trigger trên tickets cộng/trừ phần đóng góp của vé cũ (OLD) và vé mới (NEW) mỗi khi vé được
+# in, gọi, xong, đánh giá, chuyển quầy hay xoá → mọi đường ghi (crud, chuyển quầy, SQL tay) đều khớp.
+# Dữ liệu lịch sử / sửa lệch: python -m app.background.rebuild_ticket_daily_stats
+#
+# Cùng điều kiện như các query cũ trên bảng tickets:
+#   attended: called_at và finished_at khác NULL (handling = finished_at - called_at)
+#   waiting:  called_at khác NULL (waiting = called_at - created_at)
+#   rating:   chỉ tính vé status = 'done'
+
+APPLY_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION ticket_daily_stats_apply(t tickets, sign integer) RETURNS void AS $$
+BEGIN
+    IF t.service_date IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO ticket_daily_stats AS s (
+        tenxa_id, counter_id, service_date, total_tickets,
+        attended_tickets, handling_seconds, waiting_tickets, waiting_seconds,
+        satisfied, neutral, needs_improvement
+    ) VALUES (
+        t.tenxa_id, t.counter_id, t.service_date, sign,
+        CASE WHEN t.called_at IS NOT NULL AND t.finished_at IS NOT NULL THEN sign ELSE 0 END,
+        CASE WHEN t.called_at IS NOT NULL AND t.finished_at IS NOT NULL
+             THEN sign * extract(epoch FROM t.finished_at - t.called_at) ELSE 0 END,
+        CASE WHEN t.created_at IS NOT NULL AND t.called_at IS NOT NULL THEN sign ELSE 0 END,
+        CASE WHEN t.created_at IS NOT NULL AND t.called_at IS NOT NULL
+             THEN sign * extract(epoch FROM t.called_at - t.created_at) ELSE 0 END,
+        CASE WHEN t.status = 'done' AND t.rating = 'satisfied' THEN sign ELSE 0 END,
+        CASE WHEN t.status = 'done' AND t.rating = 'neutral' THEN sign ELSE 0 END,
+        CASE WHEN t.status = 'done' AND t.rating = 'needs_improvement' THEN sign ELSE 0 END
+    )
+    ON CONFLICT (tenxa_id, counter_id, service_date) DO UPDATE SET
+        total_tickets = s.total_tickets + EXCLUDED.total_tickets,
+        attended_tickets = s.attended_tickets + EXCLUDED.attended_tickets,
+        handling_seconds = s.handling_seconds + EXCLUDED.handling_seconds,
+        waiting_tickets = s.waiting_tickets + EXCLUDED.waiting_tickets,
+        waiting_seconds = s.waiting_seconds + EXCLUDED.waiting_seconds,
+        satisfied = s.satisfied + EXCLUDED.satisfied,
+        neutral = s.neutral + EXCLUDED.neutral,
+        needs_improvement = s.needs_improvement + EXCLUDED.needs_improvement;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+TRIGGER_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION ticket_daily_stats_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        -- Chỉ đổi feedback / rated_at ... thì không ảnh hưởng số liệu
+        IF (OLD.tenxa_id, OLD.counter_id, OLD.service_date, OLD.status,
+            OLD.created_at, OLD.called_at, OLD.finished_at, OLD.rating)
+           IS NOT DISTINCT FROM
+           (NEW.tenxa_id, NEW.counter_id, NEW.service_date, NEW.status,
+            NEW.created_at, NEW.called_at, NEW.finished_at, NEW.rating) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM ticket_daily_stats_apply(OLD, -1);
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        PERFORM ticket_daily_stats_apply(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+CREATE_TRIGGER_SQL = [
+    "DROP TRIGGER IF EXISTS trg_ticket_daily_stats ON tickets",
+    "CREATE TRIGGER trg_ticket_daily_stats AFTER INSERT OR UPDATE OR DELETE ON tickets "
+    "FOR EACH ROW EXECUTE PROCEDURE ticket_daily_stats_trigger()",
+]
+
+# Tính lại từ bảng tickets cho một khoảng ngày (migration, job rebuild)
+REBUILD_SQL = """
+INSERT INTO ticket_daily_stats (
+    tenxa_id, counter_id, service_date, total_tickets,
+    attended_tickets, handling_seconds, waiting_tickets, waiting_seconds,
+    satisfied, neutral, needs_improvement
+)
+SELECT
+    tenxa_id, counter_id, service_date, count(*),
+    count(*) FILTER (WHERE called_at IS NOT NULL AND finished_at IS NOT NULL),
+    coalesce(sum(extract(epoch FROM finished_at - called_at))
+             FILTER (WHERE called_at IS NOT NULL AND finished_at IS NOT NULL), 0),
+    count(*) FILTER (WHERE created_at IS NOT NULL AND called_at IS NOT NULL),
+    coalesce(sum(extract(epoch FROM called_at - created_at))
+             FILTER (WHERE created_at IS NOT NULL AND called_at IS NOT NULL), 0),
+    count(*) FILTER (WHERE status = 'done' AND rating = 'satisfied'),
+    count(*) FILTER (WHERE status = 'done' AND rating = 'neutral'),
+    count(*) FILTER (WHERE status = 'done' AND rating = 'needs_improvement')
+FROM tickets
+WHERE service_date BETWEEN :start AND :end
+GROUP BY tenxa_id, counter_id, service_date
+"""
@@ -0,0 +1,140 @@
+# app/utils/tts_announcement.py
+# Câu gọi số hoàn chỉnh (prefix + số + tên quầy) đã ghép, giữ trong LRU giới hạn theo dung lượng.
+# Nhiều TV trong 1 tv_group cùng lấy 1 câu gọi → ghép 1 lần, các lần sau chỉ copy bytes / trả 304.
+# Khoá gồm version audio quầy nên quầy tạo lại audio thì tự ra khoá mới (bản cũ bị đẩy ra dần).
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from sqlalchemy.orm import Session
+from app import database
+from app.utils.mp3_concat import concat_mp3
+from app.utils.tts_clips import clip_bank
+
+ANNOUNCEMENT_CACHE_MB = int(os.getenv("ANNOUNCEMENT_CACHE_MB", "32"))
+
+AnnouncementKey = Tuple[int, int, int, int]  # (tenxa_id, counter_id, ticket_number, version audio quầy)
+
+
+class MissingClip(Exception):
+    """Thiếu 1 đoạn để ghép (file số, prefix, hoặc audio quầy chưa tạo)"""
+
+
+@dataclass(frozen=True)
+class Announcement:
+    etag: str   # strong ETag (hash nội dung, đã có dấu ")
+    data: bytes
+    version: int  # version audio quầy đã dùng để ghép
+
+
+class AnnouncementCache:
+    def __init__(self, max_bytes: int = ANNOUNCEMENT_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[AnnouncementKey, Announcement]" = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: AnnouncementKey) -> Optional[Announcement]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: AnnouncementKey, announcement: Announcement):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._size -= len(old.data)
+            self._entries[key] = announcement
+            self._size += len(announcement.data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.data)
+
+    def snapshot_metrics(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+
+announcement_cache = AnnouncementCache()
+
+
+def prefix_name(tenxa_id: int) -> str:
+    return "prefix" if tenxa_id in (0,) else "prefix_tap"
+
+
+def get_announcement(db: Session, tenxa_id: int, counter_id: int, ticket_number: int) -> Announcement:
+    """Câu gọi số đã ghép (lấy từ cache nếu có). Thiếu đoạn nào thì raise MissingClip."""
+    counter_clip = clip_bank.counter(db, tenxa_id, counter_id)
+    if not counter_clip:
+        raise MissingClip("Missing audio file in DB for counter")
+    key = (tenxa_id, counter_id, ticket_number, counter_clip.version)
+    announcement = announcement_cache.get(key)
+    if announcement:
+        return announcement
+
+    name = prefix_name(tenxa_id)
+    prefix = clip_bank.prefix(name)
+    if prefix is None:
+        raise MissingClip(f"Missing audio file: {name}.mp3")
+    number = clip_bank.number(ticket_number)
+    if number is None:
+        raise MissingClip(f"Missing audio file: {ticket_number}.mp3")
+
+    data = concat_mp3([prefix, number, counter_clip.data])
+    announcement = Announcement(
+        etag=f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"', data=data, version=counter_clip.version
+    )
+    announcement_cache.set(key, announcement)
+    return announcement
+
+
+def announcement_id(tenxa_id: int, counter_id: int, ticket_number: int, version: int) -> str:
+    """Mã câu gọi số gửi kèm sự kiện ticket_called, TV lấy audio qua GET /tts/announcement/{audio_id}"""
+    return f"{tenxa_id}-{counter_id}-{ticket_number}-{version}"
+
+
+def parse_announcement_id(audio_id: str) -> Optional[AnnouncementKey]:
+    parts = audio_id.split("-")
+    if len(parts) != 4 or not all(p.isdigit() for p in parts):
+        return None
+    tenxa_id, counter_id, ticket_number, version = map(int, parts)
+    return tenxa_id, counter_id, ticket_number, version
+
+
+def announcement_audio_id(db: Session, tenxa_id: int, counter_id: int, ticket_number: int) -> Optional[str]:
+    """
+    audio_id của câu gọi số, chỉ cần version audio quầy (có sẵn trong clip_bank) nên không phải ghép.
+    None nếu quầy chưa có audio (TV vẫn gọi POST /tts/ như cũ).
+    """
+    counter_clip = clip_bank.counter(db, tenxa_id, counter_id)
+    if not counter_clip:
+        return None
+    return announcement_id(tenxa_id, counter_id, ticket_number, counter_clip.version)
+
+
+def prerender_announcement(tenxa_id: int, counter_id: int, ticket_number: int, db: Optional[Session] = None):
+    """
+    Ghép sẵn câu gọi số ở nền, sau khi đã gửi ticket_called, để TV lấy là có ngay.
+    TV lấy trước khi ghép xong thì GET /tts/announcement/{audio_id} tự ghép (cache miss).
+    """
+    own_session = db is None
+    if own_session:
+        db = database.SessionLocal()
+    try:
+        get_announcement(db, tenxa_id, counter_id, ticket_number)
+    except MissingClip as e:
+        print(f"⚠️ Không ghép sẵn được câu gọi vé {ticket_number} quầy {counter_id} xã {tenxa_id}: {e}")
+    except Exception as e:
+        print(f"❌ Lỗi khi ghép sẵn câu gọi vé {ticket_number} quầy {counter_id} xã {tenxa_id}: {e}")
+    finally:
+        if own_session:
+            db.close()
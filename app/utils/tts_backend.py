@@ -0,0 +1,44 @@
+# app/utils/tts_backend.py
+# Bộ tổng hợp giọng nói dùng để tạo audio tên quầy, chọn bằng biến môi trường TTS_BACKEND:
+#   gtts (mặc định) - Google TTS, cần mạng
+#   stub            - MP3 im lặng dài theo độ dài câu, không cần mạng (chạy thử / máy dev)
+import os
+from io import BytesIO
+
+TTS_BACKEND = os.getenv("TTS_BACKEND", "gtts")
+
+
+class GTTSBackend:
+    name = "gtts"
+
+    def synthesize(self, text: str) -> bytes:
+        from gtts import gTTS
+        mp3_io = BytesIO()
+        gTTS(text, lang='vi').write_to_fp(mp3_io)
+        return mp3_io.getvalue()
+
+
+class StubBackend:
+    name = "stub"
+    # Frame MPEG2 layer III 64 kbps 24 kHz mono (cùng định dạng gTTS), side info = 0 → im lặng
+    FRAME = b"\xff\xf3\x84\xc4" + bytes(188)
+    FRAMES_PER_CHAR = 3  # ~0.07 s / ký tự
+
+    def synthesize(self, text: str) -> bytes:
+        return self.FRAME * max(1, len(text) * self.FRAMES_PER_CHAR)
+
+
+BACKENDS = {"gtts": GTTSBackend, "stub": StubBackend}
+
+
+def get_tts_backend(name: str = TTS_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"TTS_BACKEND không hợp lệ: {name} (chọn: {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
+
+
+tts_backend = get_tts_backend()
+
+
+def counter_audio_text(counter_id: int, name: str) -> str:
+    return f"Đến quầy số {counter_id}: {name}"
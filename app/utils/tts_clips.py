@@ -0,0 +1,173 @@
+# app/utils/tts_clips.py
+# Kho clip âm thanh dùng để ghép câu gọi số, giữ sẵn trong bộ nhớ:
+#   - prefix/*.mp3 và numbers/{n}.mp3 đọc 1 lần lúc khởi động (bytes, không sửa)
+#   - audio tên quầy (bảng tts_audio) nạp lần đầu cần tới, giữ theo (tenxa_id, counter_id)
+# /tts/generate_counter_audio ghi bản mới thì xoá bản cũ của quầy đó (qua bus "tts_clip" cho mọi worker).
+#
+# Số không có file thu sẵn (numbers/ chỉ có 1–400) được ghép từ clip số 1–99 / "X trăm" đã thu
+# và vài clip từ nối trong words/ ("không", "linh", "trăm", "nghìn"), ví dụ
+#   523  = 5 + trăm + 23          401 = 400 + linh + 1
+#   2005 = 2 + nghìn + không + trăm + linh + 5
+# ("mươi", "mốt", "lăm" đã nằm trong clip 1–99). Tạo words/: python Gen_TTS/generate_number_words.py
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+from sqlalchemy.orm import Session
+from app import models
+from app.utils.mp3_concat import concat_mp3
+from app.utils.realtime_bus import bus
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+TTS_FOLDER = os.path.join(UTILS_DIR, "TTS")  # app/utils/TTS
+PREFIX_DIR = os.path.join(TTS_FOLDER, "prefix")
+NUMBERS_DIR = os.path.join(TTS_FOLDER, "numbers")
+WORDS_DIR = os.path.join(TTS_FOLDER, "words")
+
+# Tên file (không dấu) → từ cần đọc, dùng cho Gen_TTS/generate_number_words.py
+NUMBER_WORDS = {"khong": "không", "linh": "linh", "tram": "trăm", "nghin": "nghìn"}
+COMPOSED_CACHE_SIZE = 5000  # số đã ghép giữ lại (mỗi số ~10–20 KB)
+
+
+def compose_number(n: int, recorded) -> List[Union[int, str]]:
+    """
+    Các đoạn để đọc số n: int = clip số thu sẵn, str = clip từ nối trong words/.
+    recorded: tập các số có file thu sẵn.
+    """
+    if n in recorded or n <= 0:
+        return [n]
+    if n >= 1000:
+        thousands, rest = divmod(n, 1000)
+        parts = compose_number(thousands, recorded) + ["nghin"]
+        if rest == 0:
+            return parts
+        if rest < 100:
+            return parts + ["khong", "tram"] + _below_hundred(rest)
+        return parts + compose_number(rest, recorded)
+    if n >= 100:
+        hundreds, rest = divmod(n, 100)
+        # "X trăm" thu sẵn (100, 200...) nghe liền hơn ghép X + trăm
+        parts = [hundreds * 100] if hundreds * 100 in recorded else compose_number(hundreds, recorded) + ["tram"]
+        return parts + _below_hundred(rest)
+    return [n]
+
+
+def _below_hundred(rest: int) -> List[Union[int, str]]:
+    if rest == 0:
+        return []
+    if rest < 10:
+        return ["linh", rest]  # 105 = một trăm linh năm
+    return [rest]
+
+
+@dataclass(frozen=True)
+class CounterClip:
+    version: int  # tts_audio.id, mỗi lần tạo lại là 1 dòng mới
+    data: bytes
+
+
+class ClipBank:
+    def __init__(self, prefix_dir: str = PREFIX_DIR, numbers_dir: str = NUMBERS_DIR, words_dir: str = WORDS_DIR):
+        self.prefix_dir = prefix_dir
+        self.numbers_dir = numbers_dir
+        self.words_dir = words_dir
+        self._lock = threading.Lock()
+        self._prefixes: Dict[str, bytes] = {}
+        self._numbers: Dict[int, bytes] = {}
+        self._words: Dict[str, bytes] = {}
+        self._composed: Dict[int, bytes] = {}
+        self._counters: Dict[Tuple[int, int], CounterClip] = {}
+        self._loaded = False
+
+    def load(self):
+        prefixes = self._read_folder(self.prefix_dir)
+        numbers = {int(stem): data for stem, data in self._read_folder(self.numbers_dir).items() if stem.isdigit()}
+        words = self._read_folder(self.words_dir) if os.path.isdir(self.words_dir) else {}
+        with self._lock:
+            self._prefixes, self._numbers, self._words = prefixes, numbers, words
+            self._composed = {}
+            self._loaded = True
+        size = sum(map(len, prefixes.values())) + sum(map(len, numbers.values())) + sum(map(len, words.values()))
+        print(f"✅ Nạp {len(prefixes)} prefix + {len(numbers)} số + {len(words)} từ nối TTS vào bộ nhớ ({size // 1024} KB)")
+        missing = NUMBER_WORDS.keys() - words.keys()
+        if missing:
+            print(f"⚠️ Thiếu clip từ nối {sorted(missing)}: số > {max(numbers, default=0)} có thể không đọc được")
+
+    @staticmethod
+    def _read_folder(folder: str) -> Dict[str, bytes]:
+        clips = {}
+        for filename in os.listdir(folder):
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() != ".mp3":
+                continue
+            with open(os.path.join(folder, filename), "rb") as f:
+                clips[stem] = f.read()
+        return clips
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def prefix(self, name: str) -> Optional[bytes]:
+        self._ensure_loaded()
+        return self._prefixes.get(name)
+
+    def number(self, n: int) -> Optional[bytes]:
+        """Clip đọc số n: file thu sẵn, hoặc ghép từ các clip nhỏ (giữ lại cho lần sau). None nếu thiếu clip."""
+        self._ensure_loaded()
+        clip = self._numbers.get(n)
+        if clip is not None:
+            return clip
+        with self._lock:
+            clip = self._composed.get(n)
+        if clip is not None:
+            return clip
+
+        clips = []
+        for part in compose_number(n, self._numbers):
+            clips.append(self._words.get(part) if isinstance(part, str) else self._numbers.get(part))
+        if not clips or any(c is None for c in clips):
+            return None
+        clip = concat_mp3(clips)
+        with self._lock:
+            if len(self._composed) >= COMPOSED_CACHE_SIZE:
+                self._composed.pop(next(iter(self._composed)))  # bỏ số ghép sớm nhất
+            self._composed[n] = clip
+        return clip
+
+    def counter(self, db: Session, tenxa_id: int, counter_id: int) -> Optional[CounterClip]:
+        """Audio tên quầy mới nhất; chỉ đọc DB lần đầu (hoặc sau khi quầy được tạo lại audio)"""
+        key = (tenxa_id, counter_id)
+        with self._lock:
+            clip = self._counters.get(key)
+        if clip:
+            return clip
+        record = db.query(models.TTSAudio.id, models.TTSAudio.audio_data).filter(
+            models.TTSAudio.tenxa_id == tenxa_id,
+            models.TTSAudio.counter_id == counter_id
+        ).order_by(models.TTSAudio.created_at.desc()).first()
+        if not record:
+            return None  # không cache: quầy tạo audio xong dùng được ngay
+        clip = CounterClip(version=record.id, data=bytes(record.audio_data))
+        with self._lock:
+            self._counters[key] = clip
+        return clip
+
+    def forget_counter(self, tenxa_id: int, counter_id: int):
+        with self._lock:
+            self._counters.pop((tenxa_id, counter_id), None)
+
+
+clip_bank = ClipBank()
+
+
+def invalidate_counter_clip(tenxa_id: int, counter_id: int):
+    """Gọi sau khi commit audio mới của quầy"""
+    clip_bank.forget_counter(tenxa_id, counter_id)
+    bus.publish_threadsafe("tts_clip", {"tenxa_id": tenxa_id, "counter_id": counter_id})
+
+
+async def on_tts_clip(payload: dict):
+    clip_bank.forget_counter(payload["tenxa_id"], payload["counter_id"])
+
+bus.subscribe("tts_clip", on_tts_clip)
@@ -0,0 +1,96 @@
+# benchmarks/auto_call_event_loop.py
+# Độ trễ phát sự kiện WebSocket khi hàng trăm quầy auto-call đến hạn cùng lúc.
+# Phần DB của 1 lần kiểm tra quầy (evaluate_counter) được thay bằng time.sleep(--db-ms) để không cần DB thật;
+# client WebSocket là socket giả ghi lại thời điểm nhận tin.
+#   --mode inline: kiểm tra quầy chạy thẳng trên event loop (cách cũ, trước auto_call_executor)
+#   --mode pool:   check_and_call_next_for_counter hiện tại (auto_call_executor, AUTO_CALL_MAX_IN_FLIGHT)
+#
+#   python -m benchmarks.auto_call_event_loop --mode inline --counters 300 --db-ms 50
+#   python -m benchmarks.auto_call_event_loop --mode pool --counters 300 --db-ms 50
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from app.api.endpoints import realtime
+from app.background import auto_call
+from app.utils import auto_call_loop
+from app.utils.realtime_bus import bus
+
+PROBE_TENXA = "bench"
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.latencies = []
+
+    async def send_text(self, message: str):
+        data = json.loads(message)
+        self.latencies.append(time.perf_counter() - data["sent_at"])
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def run(mode: str, counters: int, db_ms: float, interval: float, duration: float, probe_ms: float):
+    def fake_evaluate(counter_id, tenxa_id):
+        time.sleep(db_ms / 1000)   # giả lập query + commit đồng bộ
+        return True, None          # luôn hẹn lần sau → quầy tick liên tục
+
+    auto_call.evaluate_counter = fake_evaluate
+    if mode == "inline":
+        async def check_inline(counter_id, tenxa_id):
+            keep_going, _ = fake_evaluate(counter_id, tenxa_id)
+            return keep_going
+        auto_call_loop.check_and_call_next_for_counter = check_inline
+
+    await bus.start()
+    websocket = RecordingWebSocket()
+    sub = realtime.Subscription(websocket, PROBE_TENXA)
+    sub.start()
+    realtime.hub.add(sub)
+
+    scheduler = auto_call_loop.AutoCallScheduler(interval=interval, cluster=None)
+    for counter_id in range(1, counters + 1):
+        scheduler.register(counter_id, 1)
+    scheduler.start()
+
+    ticks = 0
+    loop = asyncio.get_running_loop()
+    end = loop.time() + duration
+    due = time.perf_counter()
+    while loop.time() < end:
+        # sent_at = lúc tin lẽ ra được phát (hết giờ ngủ): event loop bị chặn thì độ trễ tính cả lúc bị chặn
+        await realtime.notify_frontend({"event": "probe", "tenxa": PROBE_TENXA, "sent_at": due})
+        ticks += 1
+        due = time.perf_counter() + probe_ms / 1000
+        await asyncio.sleep(probe_ms / 1000)
+    await asyncio.sleep(0.5)
+    await scheduler.stop()
+    sub.stop()
+
+    latencies = sorted(lat * 1000 for lat in websocket.latencies)
+    if not latencies:
+        print("Không nhận được tin nào")
+        return
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"mode={mode} counters={counters} db={db_ms}ms interval={interval}s")
+    print(f"  probes sent={ticks} received={len(latencies)}")
+    print(f"  latency ms: p50={statistics.median(latencies):.2f} p99={p99:.2f} max={latencies[-1]:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Độ trễ WebSocket khi nhiều quầy auto-call cùng tick")
+    parser.add_argument("--mode", choices=["inline", "pool"], default="pool")
+    parser.add_argument("--counters", type=int, default=300)
+    parser.add_argument("--db-ms", type=float, default=50, help="thời gian giả lập 1 lần kiểm tra quầy trong DB")
+    parser.add_argument("--interval", type=float, default=2, help="AUTO_CALL_INTERVAL rút ngắn cho bench")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--probe-ms", type=float, default=20, help="khoảng cách giữa 2 tin thăm dò")
+    args = parser.parse_args()
+    asyncio.run(run(args.mode, args.counters, args.db_ms, args.interval, args.duration, args.probe_ms))
+
+
+if __name__ == "__main__":
+    main()
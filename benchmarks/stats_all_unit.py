@@ -0,0 +1,141 @@
+# benchmarks/stats_all_unit.py
+# So /stats/all-unit cũ (5 query GROUP BY trên tickets rồi ghép dict) với compute_tenxa_stats
+# (1 query gộp trên ticket_daily_stats): thời gian mỗi lần gọi và kết quả phải giống nhau.
+#
+#   python -m benchmarks.stats_all_unit --database-url postgresql://... --seed   # seed 100 xã x 365 ngày x 30 vé
+#   python -m benchmarks.stats_all_unit --database-url postgresql://... --repeat 20
+# --seed ghi vé thật (trigger ticket_daily_stats cập nhật bảng tổng hợp) → chỉ chạy trên DB thử nghiệm.
+import argparse
+import math
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.api.endpoints.stats import compute_tenxa_stats
+
+SEED_TENXA_SQL = """
+INSERT INTO tenxa (id, name, slug, auto_call, feedback_timeout, qr_rating, postfix, password)
+SELECT g, 'Xã ' || g, 'xa' || g, false, 15, true, 'default', '123456'
+FROM generate_series(1, :communes) g
+ON CONFLICT DO NOTHING
+"""
+
+SEED_TICKETS_SQL = """
+INSERT INTO tickets (number, counter_id, created_at, status, called_at, finished_at, rating, tenxa_id, service_date)
+SELECT n, n % 6 + 1, t.ts, 'done', t.ts + interval '7 minutes', t.ts + interval '19 minutes',
+       (ARRAY['satisfied', 'neutral', 'needs_improvement'])[n % 3 + 1]::rating_enum, x, :end_date - d
+FROM generate_series(1, :communes) x, generate_series(0, :days - 1) d, generate_series(1, :per_day) n,
+     LATERAL (SELECT (:end_date - d) + time '07:30' + interval '9 minutes' * n AS ts) t
+"""
+
+# Cách tính cũ của stats_by_tenxa (trước compute_tenxa_stats): 5 lượt quét tickets
+LEGACY_QUERIES = {
+    "total": "SELECT tenxa_id, count(*) FROM tickets WHERE service_date BETWEEN :start AND :end GROUP BY tenxa_id",
+    "attended": "SELECT tenxa_id, count(*) FROM tickets WHERE called_at IS NOT NULL AND finished_at IS NOT NULL "
+                "AND service_date BETWEEN :start AND :end GROUP BY tenxa_id",
+    "waiting": "SELECT tenxa_id, avg(extract(epoch FROM called_at - created_at)) FROM tickets "
+               "WHERE created_at IS NOT NULL AND called_at IS NOT NULL AND service_date BETWEEN :start AND :end "
+               "GROUP BY tenxa_id",
+    "handling": "SELECT tenxa_id, avg(extract(epoch FROM finished_at - called_at)) FROM tickets "
+                "WHERE called_at IS NOT NULL AND finished_at IS NOT NULL AND service_date BETWEEN :start AND :end "
+                "GROUP BY tenxa_id",
+    "rating": "SELECT tenxa_id, rating, count(*) FROM tickets WHERE rating IS NOT NULL AND status = 'done' "
+              "AND service_date BETWEEN :start AND :end GROUP BY tenxa_id, rating",
+}
+
+
+def legacy_stats(db: Session, start: date, end: date) -> dict:
+    params = {"start": start, "end": end}
+    maps = {name: {} for name in ("total", "attended", "waiting", "handling")}
+    for name in maps:
+        maps[name] = dict(db.execute(text(LEGACY_QUERIES[name]), params).all())
+    ratings = {}
+    for tenxa_id, rating, count in db.execute(text(LEGACY_QUERIES["rating"]), params):
+        ratings.setdefault(tenxa_id, {})[rating] = count
+    result = {}
+    for tenxa_id, name in db.execute(text("SELECT id, name FROM tenxa")):
+        rating = ratings.get(tenxa_id, {})
+        result[tenxa_id] = (
+            maps["total"].get(tenxa_id, 0), maps["attended"].get(tenxa_id, 0),
+            maps["waiting"].get(tenxa_id), maps["handling"].get(tenxa_id),
+            rating.get("satisfied", 0), rating.get("neutral", 0), rating.get("needs_improvement", 0),
+        )
+    return result
+
+
+def new_stats(db: Session, start: date, end: date) -> dict:
+    return {
+        row.tenxa_id: (
+            row.total_tickets, row.attended_tickets, row.avg_waiting_time_seconds, row.avg_handling_time_seconds,
+            row.satisfied, row.neutral, row.needs_improvement,
+        )
+        for row in compute_tenxa_stats(db, start, end)
+    }
+
+
+def same(a: dict, b: dict) -> bool:
+    if a.keys() != b.keys():
+        return False
+    for key in a:
+        for x, y in zip(a[key], b[key]):
+            if x is None or y is None:
+                if x is not y:
+                    return False
+            elif not math.isclose(float(x), float(y), rel_tol=1e-9, abs_tol=1e-6):
+                return False
+    return True
+
+
+def timed(fn, db, start, end, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        result = fn(db, start, end)
+        samples.append(time.perf_counter() - began)
+        db.rollback()
+    samples.sort()
+    return result, samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /stats/all-unit: 5 query cũ so với 1 query gộp")
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--seed", action="store_true")
+    parser.add_argument("--communes", type=int, default=100)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--per-day", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    end = date.today()
+    start = end - timedelta(days=args.days - 1)
+
+    if args.seed:
+        with engine.begin() as conn:
+            conn.execute(text(SEED_TENXA_SQL), {"communes": args.communes})
+            conn.execute(text(SEED_TICKETS_SQL), {
+                "communes": args.communes, "days": args.days, "per_day": args.per_day, "end_date": end,
+            })
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("ANALYZE tickets"))
+            conn.execute(text("ANALYZE ticket_daily_stats"))
+
+    with Session(engine) as db:
+        tickets = db.execute(text("SELECT count(*) FROM tickets WHERE service_date BETWEEN :s AND :e"),
+                             {"s": start, "e": end}).scalar()
+        old, old_time = timed(legacy_stats, db, start, end, args.repeat)
+        new, new_time = timed(new_stats, db, start, end, args.repeat)
+
+    print(f"{tickets} vé, {len(new)} xã, {start} → {end}, median của {args.repeat} lần")
+    print(f"  5 query trên tickets:           {old_time * 1000:.1f} ms")
+    print(f"  compute_tenxa_stats (rollup):   {new_time * 1000:.1f} ms")
+    print(f"  kết quả giống nhau: {same(old, new)}")
+    if not same(old, new):
+        raise SystemExit("❌ Kết quả khác nhau")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# benchmarks/ticket_sequence.py
+# Bắn song song hàng nghìn lượt in vé rồi kiểm tra không có số vé trùng trong cùng xã / ngày nghiệp vụ
+# (bộ đếm ticket_sequences, UPSERT ... RETURNING trong crud.next_ticket_number).
+# Ghi vé thật → chỉ chạy trên DB thử nghiệm.
+#
+#   Gọi thẳng crud.create_ticket, mỗi lượt 1 session riêng:
+#     python -m benchmarks.ticket_sequence --database-url postgresql://... --tenxa-id 1 --tenxa-id 2 --counter-id 1
+#   Qua HTTP (POST /tickets/), server đang chạy; mỗi quầy có cooldown 2s (redis_client.acquire_ticket_lock)
+#   nên truyền nhiều quầy, lượt bị 429 được đếm riêng:
+#     python -m benchmarks.ticket_sequence --url http://localhost:8000 --tenxa xa1 --counter-id 1 --counter-id 2 ...
+import argparse
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle, islice
+
+
+def run_db(database_url, tenxa_ids, counter_ids, total, workers):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app import crud, schemas
+    from app.database import engine
+
+    bind = create_engine(database_url, pool_size=workers, max_overflow=0) if database_url else engine
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=bind)
+
+    def one(job):
+        tenxa_id, counter_id = job
+        db = Session()
+        try:
+            ticket = crud.create_ticket(db, tenxa_id, schemas.TicketCreate(counter_id=counter_id))
+            return tenxa_id, ticket.service_date, ticket.number
+        finally:
+            db.close()
+
+    jobs = list(islice(cycle([(t, c) for t in tenxa_ids for c in counter_ids]), total))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(one, jobs)), 0
+
+
+def run_http(url, slugs, counter_ids, total, workers):
+    import requests
+
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+
+    def one(job):
+        slug, counter_id = job
+        resp = session.post(f"{url}/tickets/", params={"tenxa": slug}, json={"counter_id": counter_id}, timeout=30)
+        if resp.status_code == 429:
+            return None
+        resp.raise_for_status()
+        body = resp.json()
+        return slug, body.get("service_date"), body["number"]
+
+    jobs = list(islice(cycle([(s, c) for s in slugs for c in counter_ids]), total))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(one, jobs))
+    return [r for r in results if r is not None], sum(r is None for r in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra trùng số vé khi in song song")
+    parser.add_argument("--database-url", help="mặc định dùng engine trong app/database.py")
+    parser.add_argument("--tenxa-id", type=int, action="append", help="chế độ gọi crud trực tiếp")
+    parser.add_argument("--url", help="chế độ HTTP, vd http://localhost:8000")
+    parser.add_argument("--tenxa", action="append", help="slug xã cho chế độ HTTP")
+    parser.add_argument("--counter-id", type=int, action="append", required=True)
+    parser.add_argument("--total", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.url:
+        results, throttled = run_http(args.url.rstrip("/"), args.tenxa or [], args.counter_id, args.total, args.workers)
+    else:
+        results, throttled = run_db(args.database_url, args.tenxa_id or [], args.counter_id, args.total, args.workers)
+    elapsed = time.perf_counter() - started
+
+    numbers = defaultdict(list)
+    for tenant, service_date, number in results:
+        numbers[(tenant, service_date)].append(number)
+
+    duplicates = 0
+    for key, values in sorted(numbers.items(), key=lambda item: str(item[0])):
+        dup = {n: c for n, c in Counter(values).items() if c > 1}
+        duplicates += sum(c - 1 for c in dup.values())
+        print(f"{key[0]} {key[1]}: {len(values)} vé, số {min(values)}..{max(values)}, trùng {len(dup)} số")
+
+    print(f"{len(results)} vé trong {elapsed:.2f}s ({len(results) / elapsed:.0f} vé/s), 429: {throttled}")
+    if duplicates:
+        raise SystemExit(f"❌ {duplicates} số vé bị trùng")
+    print("✅ Không có số vé trùng")
+
+
+if __name__ == "__main__":
+    main()
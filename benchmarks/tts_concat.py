@@ -0,0 +1,71 @@
+# benchmarks/tts_concat.py
+# So cách ghép câu gọi số cũ của /tts (ghi file tạm + danh sách concat, gọi ffmpeg -c copy, đọc file ra, xoá)
+# với concat_mp3 trong bộ nhớ, trên clip prefix + số + tên quầy có sẵn trong app/utils/TTS.
+#
+#   python -m benchmarks.tts_concat --repeat 50 [--ffmpeg /usr/bin/ffmpeg]
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from app.utils.mp3_concat import concat_mp3, iter_frames
+
+TTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "app", "utils", "TTS")
+PREFIX = os.path.join(TTS_DIR, "prefix", "prefix.mp3")
+NUMBER = os.path.join(TTS_DIR, "numbers", "123.mp3")
+COUNTER = os.path.join(TTS_DIR, "counter_audio", "Quay1_xa2.mp3")
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def ffmpeg_path(ffmpeg: str, counter_audio: bytes) -> bytes:
+    # Như /tts cũ: audio quầy lấy từ DB ghi ra file tạm, danh sách concat, ffmpeg ghi file kết quả
+    with tempfile.TemporaryDirectory() as workdir:
+        counter_file = os.path.join(workdir, "counter.mp3")
+        with open(counter_file, "wb") as f:
+            f.write(counter_audio)
+        list_path = os.path.join(workdir, "list.txt")
+        with open(list_path, "w") as f:
+            for path in (PREFIX, NUMBER, counter_file):
+                f.write(f"file '{os.path.abspath(path)}'\n")
+        out = os.path.join(workdir, "out.mp3")
+        subprocess.run([ffmpeg, "-loglevel", "error", "-y", "-f", "concat", "-safe", "0", "-i", list_path,
+                        "-c", "copy", out], check=True)
+        return read(out)
+
+
+def timed(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - began)
+    return result, statistics.median(samples) * 1000, max(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ghép MP3: ffmpeg subprocess so với concat_mp3 trong bộ nhớ")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--ffmpeg", default=shutil.which("ffmpeg"))
+    args = parser.parse_args()
+    if not args.ffmpeg:
+        raise SystemExit("Không tìm thấy ffmpeg, truyền --ffmpeg")
+
+    prefix, number, counter = read(PREFIX), read(NUMBER), read(COUNTER)
+    old, old_median, old_max = timed(lambda: ffmpeg_path(args.ffmpeg, counter), args.repeat)
+    new, new_median, new_max = timed(lambda: concat_mp3([prefix, number, counter]), args.repeat)
+
+    print(f"prefix + số 123 + tên quầy, {args.repeat} lần")
+    print(f"  ffmpeg (file tạm + subprocess): median {old_median:.2f} ms, max {old_max:.2f} ms")
+    print(f"  concat_mp3 (bộ nhớ):            median {new_median:.3f} ms, max {new_max:.3f} ms")
+    print(f"  frame audio giống nhau: {b''.join(iter_frames(old)) == new}")
+
+
+if __name__ == "__main__":
+    main()
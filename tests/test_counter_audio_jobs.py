@@ -0,0 +1,91 @@
+# tests/test_counter_audio_jobs.py
+# Tạo lại audio tên quầy theo job (app/background/counter_audio_jobs.py) với backend giả, không cần mạng.
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.background import counter_audio_jobs
+from app.background.counter_audio_jobs import CounterAudioItem, CounterAudioJobQueue, regenerate_item
+from app.utils.tts_backend import StubBackend
+
+TENXA_ID = 9201
+
+
+class FlakyBackend(StubBackend):
+    """Lỗi `failures` lần đầu cho mỗi câu rồi mới trả MP3; câu chứa "hỏng" thì lỗi mãi"""
+    name = "flaky"
+
+    def __init__(self, failures: int = 1):
+        self.failures = failures
+        self.calls = {}
+
+    def synthesize(self, text: str) -> bytes:
+        self.calls[text] = self.calls.get(text, 0) + 1
+        if "hỏng" in text or self.calls[text] <= self.failures:
+            raise ConnectionError("TTS không phản hồi")
+        return super().synthesize(text)
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(counter_audio_jobs, "RETRY_BACKOFF", 0)
+
+
+@pytest.fixture
+def old_audio(session_local):
+    from sqlalchemy import text
+
+    with session_local() as db:
+        db.execute(text("DELETE FROM tts_audio WHERE tenxa_id = :t"), {"t": TENXA_ID})
+        db.execute(text("INSERT INTO tts_audio (tenxa_id, counter_id, audio_data) VALUES (:t, 1, 'cu'), (:t, 2, 'cu')"),
+                   {"t": TENXA_ID})
+        db.commit()
+    return b"cu"
+
+
+def stored_audio(session_local, counter_id: int):
+    from sqlalchemy import text
+
+    with session_local() as db:
+        rows = db.execute(text("SELECT audio_data FROM tts_audio WHERE tenxa_id = :t AND counter_id = :c"),
+                          {"t": TENXA_ID, "c": counter_id}).scalars().all()
+    return [bytes(row) for row in rows]
+
+
+def test_retry_then_replace_old_row(session_local, old_audio, no_backoff):
+    backend = FlakyBackend(failures=1)
+    item = CounterAudioItem(tenxa_id=TENXA_ID, counter_id=1, name="Một cửa")
+
+    regenerate_item(item, backend)
+
+    assert (item.status, item.attempts, item.error) == ("done", 2, None)
+    assert stored_audio(session_local, 1) == [backend.synthesize("Đến quầy số 1: Một cửa")]
+
+
+def test_failed_after_max_attempts_keeps_old_row(session_local, old_audio, no_backoff):
+    item = CounterAudioItem(tenxa_id=TENXA_ID, counter_id=1, name="Quầy hỏng")
+
+    regenerate_item(item, FlakyBackend())
+
+    assert (item.status, item.attempts) == ("failed", counter_audio_jobs.MAX_ATTEMPTS)
+    assert "TTS không phản hồi" in item.error
+    assert stored_audio(session_local, 1) == [old_audio]
+
+
+def test_job_reports_done_and_failed(session_local, old_audio, no_backoff):
+    executor = ThreadPoolExecutor(max_workers=2)
+    queue = CounterAudioJobQueue(executor=executor, backend=FlakyBackend(failures=1))
+    job = queue.submit([
+        CounterAudioItem(tenxa_id=TENXA_ID, counter_id=1, name="Một cửa"),
+        CounterAudioItem(tenxa_id=TENXA_ID, counter_id=2, name="Quầy hỏng"),
+    ])
+    executor.shutdown(wait=True)
+
+    result = queue.get(job.id).to_dict()
+    assert result["status"] == "failed"
+    assert result["backend"] == "flaky"
+    assert (result["total"], result["done"]) == (2, 1)
+    assert [(f["counter_id"], f["attempts"]) for f in result["failed"]] == [(2, counter_audio_jobs.MAX_ATTEMPTS)]
+    assert result["finished_at"] is not None
+    assert stored_audio(session_local, 1) != [old_audio]
+    assert stored_audio(session_local, 2) == [old_audio]
@@ -0,0 +1,84 @@
+# tests/test_mp3_concat.py
+# Ghép MP3 trong bộ nhớ (app/utils/mp3_concat.py) trên các clip có sẵn trong app/utils/TTS.
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from app.utils.mp3_concat import concat_mp3, frame_length, iter_frames
+
+TTS_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "app", "utils", "TTS")
+CLIPS = [
+    os.path.join(TTS_DIR, "prefix", "prefix.mp3"),
+    os.path.join(TTS_DIR, "numbers", "123.mp3"),
+    os.path.join(TTS_DIR, "counter_audio", "Quay1_xa2.mp3"),
+]
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def walk_frames(data: bytes) -> int:
+    """Đi từ đầu tới cuối theo độ dài frame, trả về số frame; lỗi nếu gặp byte không phải header"""
+    pos = count = 0
+    while pos < len(data):
+        length = frame_length(data[pos:pos + 4])
+        assert length, f"không phải header MP3 ở byte {pos}"
+        pos += length
+        count += 1
+    assert pos == len(data), "frame cuối bị cụt"
+    return count
+
+
+def ffmpeg_exe():
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except ImportError:
+        return shutil.which("ffmpeg")
+
+
+@pytest.mark.parametrize("path", CLIPS)
+def test_clip_frames_have_valid_headers(path):
+    frames = list(iter_frames(read(path)))
+    assert frames
+    for frame in frames:
+        assert frame_length(bytes(frame[:4])) == len(frame)
+
+
+def test_tags_and_info_frame_are_stripped():
+    data = read(CLIPS[0])
+    assert data[:3] == b"ID3"
+    audio = b"".join(iter_frames(data))
+    assert audio[:1] == b"\xff"
+    assert b"Xing" not in audio[:64] and b"Info" not in audio[:64]
+
+
+def test_concat_is_a_clean_frame_stream():
+    clips = [read(path) for path in CLIPS]
+    out = concat_mp3(clips)
+
+    assert len(out) == sum(len(frame) for clip in clips for frame in iter_frames(clip))
+    assert walk_frames(out) == sum(len(list(iter_frames(clip))) for clip in clips)
+    # Đoạn sau nối ngay sau frame cuối của đoạn trước
+    first = b"".join(iter_frames(clips[0]))
+    assert out.startswith(first)
+
+
+def test_concat_matches_ffmpeg(tmp_path):
+    ffmpeg = ffmpeg_exe()
+    if not ffmpeg:
+        pytest.skip("không có ffmpeg")
+    list_path = tmp_path / "list.txt"
+    list_path.write_text("".join(f"file '{os.path.abspath(path)}'\n" for path in CLIPS))
+    out_path = tmp_path / "out.mp3"
+    subprocess.run(
+        [ffmpeg, "-loglevel", "error", "-y", "-f", "concat", "-safe", "0", "-i", str(list_path), "-c", "copy", str(out_path)],
+        check=True,
+    )
+    # ffmpeg thêm ID3 và frame Info mới; phần audio phải giống hệt
+    ffmpeg_audio = b"".join(iter_frames(out_path.read_bytes()))
+    assert ffmpeg_audio == concat_mp3(read(path) for path in CLIPS)
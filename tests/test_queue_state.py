@@ -0,0 +1,71 @@
+# tests/test_queue_state.py
+# Hàng chờ trong bộ nhớ: bản chụp vé cũ hơn (version nhỏ hơn) không được đè bản mới.
+from datetime import date, datetime
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("pytz")
+
+from app.utils.queue_state import TenantQueue, TicketView  # noqa: E402
+
+DAY = date(2026, 10, 18)
+
+
+def view(status: str, version: int, counter_id: int = 1) -> TicketView:
+    return TicketView(
+        id=7, number=12, counter_id=counter_id, created_at=datetime(2026, 10, 18, 8, 0),
+        status=status, service_date=DAY, version=version,
+    )
+
+
+def test_older_snapshot_is_dropped():
+    queue = TenantQueue(DAY)
+    queue.upsert(view("waiting", 0))
+    queue.upsert(view("done", 2))
+    # "called" (version 1) đến sau "done" (version 2), vd sự kiện bus lệch thứ tự
+    queue.upsert(view("called", 1))
+
+    assert queue.tickets[7].status == "done"
+    assert queue.list("called", 1) == []
+    assert [v.id for v in queue.list("done", 1)] == [7]
+
+
+def test_newer_snapshot_moves_ticket():
+    queue = TenantQueue(DAY)
+    queue.upsert(view("waiting", 0))
+    queue.upsert(view("waiting", 1, counter_id=3))
+
+    assert queue.list("waiting", 1) == []
+    assert [v.counter_id for v in queue.list("waiting", 3)] == [3]
+
+
+def test_payload_round_trip_keeps_version():
+    original = view("called", 4)
+    assert TicketView.from_payload(original.to_payload()) == original
+
+
+def test_ticket_version_bumped_on_update(engine):
+    from sqlalchemy import text
+    from sqlalchemy.orm import Session
+    from app import models
+
+    with Session(engine) as db:
+        db.execute(text("INSERT INTO tenxa (id, name, slug, postfix, password, qr_rating) "
+                        "VALUES (9001, 'Xã test', 'xa-test-9001', 'default', '123456', true) ON CONFLICT DO NOTHING"))
+        ticket = models.Ticket(number=1, counter_id=1, tenxa_id=9001, service_date=DAY)
+        db.add(ticket)
+        db.commit()
+        db.refresh(ticket)
+        assert ticket.version == 0
+
+        ticket.status = "called"
+        db.commit()
+        db.refresh(ticket)
+        assert ticket.version == 1
+
+        # Đường ghi bằng SQL (gọi vé, chuyển quầy...) cũng tăng version
+        version = db.execute(text("UPDATE tickets SET status = 'done' WHERE id = :id RETURNING version"),
+                             {"id": ticket.id}).scalar()
+        assert version == 2
+        db.rollback()
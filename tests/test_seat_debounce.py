@@ -0,0 +1,40 @@
+# tests/test_seat_debounce.py
+# Bộ lọc nhiễu trạng thái ghế: so với trạng thái đang lưu, kể cả khi seat_state (có TTL) đã hết hạn.
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from app.utils.seat_debounce import SeatDebouncer  # noqa: E402
+from app.utils.seat_state import seat_state  # noqa: E402
+
+TENXA_ID = 9201
+
+
+@pytest.fixture
+def expired_seat(monkeypatch):
+    # Ghế đã ghi "có người" nhưng đứng yên lâu hơn TTL
+    monkeypatch.setattr(seat_state, "ttl", -1)
+    seat_state.set_many(TENXA_ID, {1: True})
+    yield 1
+    seat_state.forget(TENXA_ID, [1])
+
+
+def test_committed_state_outlives_ttl(expired_seat):
+    assert seat_state.get(TENXA_ID, expired_seat) is None
+    # Đã biết trong bộ nhớ → không cần đọc DB
+    assert SeatDebouncer().committed_states(None, TENXA_ID, [expired_seat]) == {expired_seat: True}
+
+
+def test_unchanged_seat_is_not_a_flap(expired_seat):
+    debouncer = SeatDebouncer(default_seconds=5)
+    committed = debouncer.committed_states(None, TENXA_ID, [expired_seat])[expired_seat]
+
+    assert debouncer.observe(TENXA_ID, expired_seat, committed, True, 5) is True
+    assert debouncer.metrics(TENXA_ID) == {"default_seconds": 5, "suppressed_flaps": {}, "pending": []}
+
+
+def test_flap_back_to_committed_is_counted(expired_seat):
+    debouncer = SeatDebouncer(default_seconds=5)
+    assert debouncer.observe(TENXA_ID, expired_seat, True, False, 5) is False   # bắt đầu chờ "trống"
+    assert debouncer.observe(TENXA_ID, expired_seat, True, True, 5) is True     # quay lại → nhiễu
+    assert debouncer.metrics(TENXA_ID)["suppressed_flaps"] == {expired_seat: 1}
@@ -0,0 +1,96 @@
+# tests/test_seat_states.py
+# Ghi trạng thái ghế theo lô (crud.apply_seat_states) trên PostgreSQL: seat_sessions, seat_logs.
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+
+TENXA_ID = 9101
+SEAT_ID = 910101
+
+
+@pytest.fixture
+def seat(engine):
+    from sqlalchemy import text
+
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO tenxa (id, name, slug, postfix, password, qr_rating) "
+                          "VALUES (:id, 'Xã ghế', 'xa-ghe-9101', 'default', '123456', true) ON CONFLICT DO NOTHING"),
+                     {"id": TENXA_ID})
+        conn.execute(text("DELETE FROM seat_sessions WHERE tenxa_id = :t"), {"t": TENXA_ID})
+        conn.execute(text("DELETE FROM seat_logs WHERE tenxa_id = :t"), {"t": TENXA_ID})
+        conn.execute(text("DELETE FROM seats WHERE tenxa_id = :t"), {"t": TENXA_ID})
+        conn.execute(text("INSERT INTO seats (id, name, counter_id, type, status, tenxa_id) "
+                          "VALUES (:id, 'Ghế khách', 1, 'client', false, :t)"), {"id": SEAT_ID, "t": TENXA_ID})
+    return SEAT_ID
+
+
+def open_sessions(engine):
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT occupied FROM seat_sessions WHERE tenxa_id = :t AND ended_at IS NULL"),
+                            {"t": TENXA_ID}).scalars().all()
+
+
+def test_batch_closes_and_opens_sessions(engine, seat):
+    from sqlalchemy.orm import Session
+    from app import crud
+
+    with Session(engine) as db:
+        rows = crud.apply_seat_states(db, TENXA_ID, {seat: True}, datetime.now())
+        db.commit()
+        assert [(row.id, row.changed) for row in rows] == [(seat, True)]
+
+        # Báo lại đúng trạng thái: không ghi gì thêm
+        rows = crud.apply_seat_states(db, TENXA_ID, {seat: True}, datetime.now())
+        db.commit()
+        assert [(row.id, row.changed) for row in rows] == [(seat, False)]
+
+        crud.apply_seat_states(db, TENXA_ID, {seat: False}, datetime.now())
+        db.commit()
+
+    assert open_sessions(engine) == [False]
+
+
+def test_batch_and_put_paths_race_without_duplicate_sessions(engine, seat):
+    from sqlalchemy.orm import Session
+    from app import crud, models
+
+    def put_path(status: bool):
+        # Như PUT /seats/{id}: khoá dòng ghế rồi ghi seat_sessions
+        with Session(engine) as db:
+            row = db.query(models.Seat).filter(models.Seat.id == seat).with_for_update().one()
+            row.status = status
+            crud.record_seat_session(db, row, status, datetime.now())
+            db.commit()
+
+    def batch_path(status: bool):
+        with Session(engine) as db:
+            crud.apply_seat_states(db, TENXA_ID, {seat: status}, datetime.now())
+            db.commit()
+
+    jobs = [(put_path if i % 2 else batch_path, i % 3 == 0) for i in range(200)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for future in [pool.submit(fn, status) for fn, status in jobs]:
+            future.result()
+
+    assert len(open_sessions(engine)) == 1
+
+
+def test_seat_log_keeps_real_old_status(engine, seat):
+    from sqlalchemy import text
+    from sqlalchemy.orm import Session
+    from app import crud
+
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE seats SET status = NULL WHERE id = :id"), {"id": seat})
+
+    with Session(engine) as db:
+        crud.apply_seat_states(db, TENXA_ID, {seat: True}, datetime.now())
+        crud.apply_seat_states(db, TENXA_ID, {seat: False}, datetime.now())
+        db.commit()
+        logs = db.execute(text("SELECT old_status, new_status FROM seat_logs WHERE tenxa_id = :t ORDER BY id"),
+                          {"t": TENXA_ID}).all()
+
+    # Ghế chưa từng có trạng thái (NULL): old_status là NULL, không phải "not True"
+    assert [tuple(log) for log in logs] == [(None, True), (True, False)]
@@ -0,0 +1,134 @@
+# tests/test_ticket_query_plans.py
+# EXPLAIN các truy vấn nóng trên bảng tickets (hàng chờ, tra vé, gọi vé, cấp số vé) với bảng vài triệu dòng:
+# lỗi nếu truy vấn nào quay về Seq Scan trên tickets (thiếu / mất index của migration 0002, 0003).
+#
+# Cần TEST_DATABASE_URL (tests/conftest.py): test chạy migration và ghi dữ liệu mẫu vào DB đó.
+# Số vé mẫu: TEST_TICKET_ROWS (mặc định 2 triệu), chỉ seed khi bảng còn ít hơn số đó.
+import os
+from datetime import datetime
+
+import pytest
+
+TICKET_ROWS = int(os.getenv("TEST_TICKET_ROWS", "2000000"))
+TENANTS = 100
+COUNTERS = 8
+
+SEED_TENXA_SQL = """
+INSERT INTO tenxa (id, name, slug, auto_call, feedback_timeout, qr_rating, postfix, password)
+SELECT g, 'Xã ' || g, 'xa' || g, false, 15, true, 'default', '123456'
+FROM generate_series(1, :tenants) g
+ON CONFLICT DO NOTHING
+"""
+
+# Vé đã xong rải đều 1 năm cho mọi xã / quầy
+SEED_HISTORY_SQL = """
+INSERT INTO tickets (number, counter_id, created_at, status, called_at, finished_at, tenxa_id, service_date)
+SELECT (g / :tenants) % 300 + 1, g % :counters + 1, t.ts, 'done', t.ts, t.ts + interval '5 minutes',
+       g % :tenants + 1, t.ts::date
+FROM generate_series(1, :rows) g,
+     LATERAL (SELECT (now() AT TIME ZONE 'Asia/Ho_Chi_Minh') - interval '1 day' * (1 + g % 365)
+                     - interval '1 minute' * (g % 540) AS ts) t
+"""
+
+# Hàng chờ hôm nay: mỗi quầy 20 vé chờ và 1 vé đang gọi
+SEED_TODAY_SQL = """
+INSERT INTO tickets (number, counter_id, created_at, status, called_at, tenxa_id, service_date)
+SELECT n, c, now() AT TIME ZONE 'Asia/Ho_Chi_Minh', CASE WHEN n = 1 THEN 'called' ELSE 'waiting' END,
+       CASE WHEN n = 1 THEN now() AT TIME ZONE 'Asia/Ho_Chi_Minh' END, x, :today
+FROM generate_series(1, :tenants) x, generate_series(1, :counters) c, generate_series(1, 21) n
+"""
+
+
+@pytest.fixture(scope="module")
+def seeded(engine):
+    from sqlalchemy import text
+    from app.utils.service_date import get_service_date, vn_tz
+
+    today = get_service_date(datetime.now(vn_tz))
+    with engine.begin() as conn:
+        conn.execute(text(SEED_TENXA_SQL), {"tenants": TENANTS})
+        count = conn.execute(text("SELECT count(*) FROM tickets")).scalar()
+        if count < TICKET_ROWS:
+            params = {"tenants": TENANTS, "counters": COUNTERS, "rows": TICKET_ROWS - count, "today": today}
+            conn.execute(text(SEED_HISTORY_SQL), params)
+            conn.execute(text(SEED_TODAY_SQL), params)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE tickets"))
+    return engine
+
+
+@pytest.fixture
+def captured(seeded):
+    """Các câu SELECT trên tickets mà code phát ra trong test, kèm tham số để EXPLAIN lại"""
+    from sqlalchemy import event
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "tickets" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(seeded, "before_cursor_execute", capture)
+    yield statements
+    event.remove(seeded, "before_cursor_execute", capture)
+
+
+def seq_scans_on_tickets(plan: dict) -> list:
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") == "tickets":
+        found.append(plan)
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans_on_tickets(child))
+    return found
+
+
+def explain(engine, statement, parameters) -> dict:
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        return cursor.fetchone()[0][0]["Plan"]
+    finally:
+        raw.rollback()
+        raw.close()
+
+
+def assert_index_only(engine, statements):
+    assert statements, "không bắt được câu SELECT nào trên tickets"
+    for statement, parameters in statements:
+        plan = explain(engine, statement, parameters)
+        assert not seq_scans_on_tickets(plan), f"Seq Scan trên tickets:\n{statement}\n{plan}"
+
+
+def test_queue_and_lookup_queries_use_indexes(seeded, captured):
+    from sqlalchemy.orm import Session
+    from app import crud
+    from app.utils.queue_state import queue_state
+
+    with Session(seeded) as db:
+        crud.get_waiting_tickets(db, 1)
+        crud.get_waiting_tickets(db, 1, counter_id=2)
+        crud.get_called_tickets(db, 1, counter_id=2)
+        crud.get_done_tickets(db, 1, counter_id=2)
+        crud.get_ticket(db, 1, 5)
+        queue_state.hydrate(db, 1)
+        # MAX(number) khi khởi tạo bộ đếm của ngày; rollback để không đổi dữ liệu mẫu
+        crud.next_ticket_number(db, 1, datetime(2000, 1, 1).date())
+        db.rollback()
+
+    assert_index_only(seeded, captured)
+
+
+def test_call_next_uses_indexes(seeded):
+    from app import crud
+    from app.utils.service_date import get_service_date, vn_tz
+
+    now = datetime.now(vn_tz)
+    with seeded.connect() as conn:
+        compiled = crud.CALL_NEXT_SQL.bindparams(
+            tenxa_id=1, counter_id=2, now=now, service_date=get_service_date(now)
+        ).compile(conn)
+        statement = compiled.string
+        parameters = compiled.params
+    plan = explain(seeded, statement, parameters)
+    assert not seq_scans_on_tickets(plan), f"Seq Scan trên tickets khi gọi vé:\n{plan}"
@@ -0,0 +1,75 @@
+# tests/test_tts_clips.py
+# Ghép số không có file thu sẵn (app/utils/tts_clips.py): thứ tự đoạn và từ nối thiếu file.
+import os
+
+import pytest
+
+from app.utils.mp3_concat import concat_mp3
+from app.utils.tts_backend import StubBackend
+from app.utils import tts_announcement
+from app.utils.tts_announcement import MissingClip, get_announcement
+from app.utils.tts_clips import ClipBank, CounterClip, compose_number
+
+RECORDED = set(range(1, 401))  # numbers/ chỉ có 1–400
+
+
+@pytest.mark.parametrize("n, parts", [
+    (400, [400]),
+    (401, [400, "linh", 1]),
+    (523, [5, "tram", 23]),
+    (1000, [1, "nghin"]),
+    (1234, [1, "nghin", 234]),
+    (2005, [2, "nghin", "khong", "tram", "linh", 5]),
+    (2050, [2, "nghin", "khong", "tram", 50]),
+    (3410, [3, "nghin", 400, 10]),
+    (3510, [3, "nghin", 5, "tram", 10]),
+])
+def test_compose_number(n, parts):
+    assert compose_number(n, RECORDED) == parts
+
+
+WORDS = {"khong": "không", "linh": "linh", "tram": "trăm", "nghin": "nghìn"}
+
+
+def clip(text: str) -> bytes:
+    return StubBackend().synthesize(text)  # MP3 im lặng cùng định dạng gTTS, đủ để ghép frame
+
+
+def make_bank(tmp_path, words=WORDS) -> ClipBank:
+    for folder in ("prefix", "numbers", "words"):
+        os.makedirs(tmp_path / folder)
+    for n in (1, 2, 5, 400):
+        (tmp_path / "numbers" / f"{n}.mp3").write_bytes(clip(str(n)))
+    for name, word in words.items():
+        (tmp_path / "words" / f"{name}.mp3").write_bytes(clip(word))
+    return ClipBank(
+        prefix_dir=str(tmp_path / "prefix"),
+        numbers_dir=str(tmp_path / "numbers"),
+        words_dir=str(tmp_path / "words"),
+    )
+
+
+def test_number_composed_from_word_clips(tmp_path):
+    bank = make_bank(tmp_path)
+    assert bank.number(401) == concat_mp3([clip("400"), clip("linh"), clip("1")])
+    assert bank.number(2005) == concat_mp3(
+        [clip("2"), clip("nghìn"), clip("không"), clip("trăm"), clip("linh"), clip("5")]
+    )
+
+
+def test_missing_word_clip_returns_none(tmp_path):
+    bank = make_bank(tmp_path, words={"tram": "trăm", "nghin": "nghìn"})
+    assert bank.number(400) is not None
+    assert bank.number(401) is None  # thiếu "linh" → /tts/ trả 404, không gọi TTS qua mạng
+    assert bank.number(2005) is None
+
+
+def test_missing_word_clip_raises_missing_clip(tmp_path, monkeypatch):
+    bank = make_bank(tmp_path, words={})
+    (tmp_path / "prefix" / "prefix_tap.mp3").write_bytes(clip("mời số"))
+    bank._counters[(7, 1)] = CounterClip(version=1, data=clip("quầy 1"))  # không cần đọc DB
+    monkeypatch.setattr(tts_announcement, "clip_bank", bank)
+
+    assert get_announcement(None, 7, 1, 400).data
+    with pytest.raises(MissingClip, match="401.mp3"):
+        get_announcement(None, 7, 1, 401)